@@ -0,0 +1,332 @@
+"""Measure request throughput and latency of the pasted application.
+
+Usage: python benchmarks/bench_app.py [--mode inprocess|wsgi] [--requests N]
+           [--concurrency N] [--repeat N] [--save-baseline] [--check]
+
+The application is pointed at a local stand in for Keystone, Swift and the
+CDN endpoint, see tests/fake_openstack.py, and driven either in-process
+through the Flask test client or over HTTP against a threaded WSGI server.
+Throughput and p50/p99 latency are reported for paste creation, raw reads
+with a hot and a cold cache, paste pages, link redirects and the index
+page.
+
+Results are compared with the numbers stored in benchmarks/baselines.json;
+a scenario is flagged when its p50 latency grows, or its throughput drops,
+by more than the tolerance. Baselines are machine specific, refresh them
+with --save-baseline when the benchmark host changes.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+from werkzeug import serving  # noqa: E402
+
+import pasted  # noqa: E402
+
+from pasted import backend  # noqa: E402
+from pasted import memory  # noqa: E402
+
+from tests import fake_openstack  # noqa: E402
+
+
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+SCENARIOS = ['create', 'raw_hot', 'raw_cold', 'page', 'link', 'index']
+
+
+class InProcessClient(object):
+    """Issue requests through the Flask test client."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = pasted.app.test_client()
+        return client
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, payload):
+        r = self.client.post(path, json=payload)
+        return r.status_code, r.get_data(as_text=True)
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(serving.WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class WSGIClient(object):
+    """Issue requests over HTTP to a threaded WSGI server."""
+
+    def __init__(self):
+        self.server = serving.make_server(
+            '127.0.0.1',
+            0,
+            pasted.app,
+            threaded=True,
+            request_handler=QuietRequestHandler
+        )
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self._thread = threading.Thread(
+            target=self.server.serve_forever,
+            daemon=True
+        )
+        self._thread.start()
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def get(self, path):
+        return self.session.get(
+            self.url + path,
+            allow_redirects=False
+        ).status_code
+
+    def post(self, path, payload):
+        r = self.session.post(self.url + path, json=payload)
+        return r.status_code, r.text
+
+    def close(self):
+        self.server.shutdown()
+
+
+def clear_caches():
+    memory.CONTENT.clear()
+    memory.MISSING.clear()
+    with backend.LocalCache() as c:
+        c.clear()
+
+
+def paste_content(size, tag):
+    line = '%s %s\n' % (tag, uuid.uuid4().hex)
+    return (line * (size // len(line) + 1))[:size]
+
+
+def create_pastes(client, count, size):
+    keys = []
+    for i in range(count):
+        content = paste_content(size, 'seed-%d' % i)
+        status, _ = client.post('/api/pastes', {'content': content})
+        assert status == 201, status
+        keys.append(hashlib.sha1(content.encode('utf-8')).hexdigest())
+    return keys
+
+
+def scenario_requests(name, client, args):
+    """Return a list of request callables for a scenario.
+
+    Each callable returns True when the response had the expected status.
+    """
+    n = args.requests
+    if name == 'create':
+        contents = [
+            paste_content(args.paste_size, 'create-%d' % i) for i in range(n)
+        ]
+        return [
+            lambda c=c: client.post('/api/pastes', {'content': c})[0] == 201
+            for c in contents
+        ]
+    elif name == 'raw_hot':
+        key = create_pastes(client, 1, args.paste_size)[0]
+        client.get('/pastes/%s.raw' % key)
+        return [
+            lambda: client.get('/pastes/%s.raw' % key) == 200
+        ] * n
+    elif name == 'raw_cold':
+        keys = create_pastes(client, n, args.paste_size)
+        clear_caches()
+        return [
+            lambda k=k: client.get('/pastes/%s.raw' % k) == 200 for k in keys
+        ]
+    elif name == 'page':
+        key = create_pastes(client, 1, args.paste_size)[0]
+        return [lambda: client.get('/pastes/%s' % key) == 200] * n
+    elif name == 'link':
+        status, url = client.post(
+            '/api/links',
+            {'content': 'https://example.com/%s' % uuid.uuid4().hex}
+        )
+        assert status == 201, status
+        path = '/l/%s' % url.rstrip('/').rsplit('/', 1)[-1]
+        return [lambda: client.get(path) == 308] * n
+    elif name == 'index':
+        return [lambda: client.get('/') == 200] * n
+    raise ValueError('Unknown scenario %s' % name)
+
+
+def percentile(samples, fraction):
+    return samples[int(round(fraction * (len(samples) - 1)))]
+
+
+def run_scenario(calls, concurrency):
+    def timed(call):
+        start = time.perf_counter()
+        ok = call()
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed, calls))
+    else:
+        results = [timed(call) for call in calls]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for r in results if not r[1]),
+        'ops': len(results) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Return a description of a regression against the baseline or None."""
+    if not baseline:
+        return None
+    slower = result['p50_ms'] > baseline['p50_ms'] * (1 + tolerance)
+    fewer = result['ops'] < baseline['ops'] / (1 + tolerance)
+    if slower or fewer:
+        return 'p50 %.2fms (was %.2fms), %.0f ops/s (was %.0f)' % (
+            result['p50_ms'],
+            baseline['p50_ms'],
+            result['ops'],
+            baseline['ops']
+        )
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--mode',
+        choices=['inprocess', 'wsgi'],
+        default='inprocess'
+    )
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--paste-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        choices=SCENARIOS,
+        help='Scenario to run, may be repeated. Defaults to all of them.'
+    )
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Exit non-zero when a scenario regressed.'
+    )
+    args = parser.parse_args()
+
+    fake = fake_openstack.FakeOpenStack().start()
+    paste_dir = tempfile.mkdtemp()
+    pasted.app.config.update(fake.config())
+    pasted.app.config['PASTE_DIR'] = paste_dir
+    client = WSGIClient() if args.mode == 'wsgi' else InProcessClient()
+
+    baselines = dict()
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    regressions = []
+    header = '%-10s %8s %7s %10s %10s %10s  %s' % (
+        'scenario', 'requests', 'errors', 'ops/s', 'p50 ms', 'p99 ms',
+        'baseline'
+    )
+    print('mode=%s concurrency=%d paste_size=%d' % (
+        args.mode, args.concurrency, args.paste_size
+    ))
+    print(header)
+    print('-' * len(header))
+    try:
+        for name in args.scenario or SCENARIOS:
+            # the fastest of several runs is the least noisy estimate
+            result = None
+            for _ in range(args.repeat):
+                clear_caches()
+                calls = scenario_requests(name, client, args)
+                run = run_scenario(calls, args.concurrency)
+                if result is None or run['p50_ms'] < result['p50_ms']:
+                    result = run
+            baseline_key = '%s-c%d/%s' % (
+                args.mode,
+                args.concurrency,
+                name
+            )
+            regression = compare(
+                result,
+                baselines.get(baseline_key),
+                args.tolerance
+            )
+            if regression:
+                regressions.append((name, regression))
+            print('%-10s %8d %7d %10.1f %10.2f %10.2f  %s' % (
+                name,
+                result['requests'],
+                result['errors'],
+                result['ops'],
+                result['p50_ms'],
+                result['p99_ms'],
+                'REGRESSED' if regression else (
+                    'ok' if baseline_key in baselines else '-'
+                )
+            ))
+            baselines[baseline_key] = dict(
+                (k, round(v, 3)) for k, v in result.items()
+                if k in ('ops', 'p50_ms', 'p99_ms')
+            )
+    finally:
+        client.close()
+        backend.CACHE_MANAGER.close()
+        fake.stop()
+        shutil.rmtree(paste_dir)
+
+    for name, regression in regressions:
+        print('%s regressed: %s' % (name, regression))
+
+    if args.save_baseline:
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved baselines to %s' % args.baselines)
+
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""Compare the WSGI and ASGI serving modes at high concurrency.
+
+Usage: python benchmarks/bench_asgi.py [--requests N] [--concurrency N]
+           [--threads N] [--cdn-latency SECONDS]
+
+The sync mode serves the application from a WSGI server with a fixed pool
+of request threads, like a gunicorn gthread worker. The async mode serves
+pasted.asgi with uvicorn and the same number of executor threads. Both run
+against tests/fake_openstack.py with an artificial CDN latency, and are
+driven by many concurrent clients opening a connection per request.
+
+Throughput and p50/p99 latency are reported for raw reads with a cold
+cache, where each request waits on the CDN, raw reads with a hot cache and
+link redirects. Requires uvicorn and httpx.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from werkzeug import serving  # noqa: E402
+
+import pasted  # noqa: E402
+
+from pasted import asgi  # noqa: E402
+from pasted import backend  # noqa: E402
+from pasted import memory  # noqa: E402
+
+from tests import fake_openstack  # noqa: E402
+
+
+SCENARIOS = ['raw_cold', 'raw_hot', 'link']
+
+
+class QuietRequestHandler(serving.WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(serving.BaseWSGIServer):
+    """WSGI server handling requests in a fixed size thread pool."""
+
+    def __init__(self, port, threads):
+        super(PooledWSGIServer, self).__init__(
+            '127.0.0.1',
+            port,
+            pasted.app,
+            handler=QuietRequestHandler
+        )
+        self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class SyncServer(object):
+    def __init__(self, threads):
+        self.server = PooledWSGIServer(free_port(), threads)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self._thread = threading.Thread(
+            target=self.server.serve_forever,
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.pool.shutdown()
+
+
+class AsyncServer(object):
+    def __init__(self, threads):
+        pasted.app.config['ASGI_THREADS'] = threads
+        port = free_port()
+        self.url = 'http://127.0.0.1:%s' % port
+        self.server = uvicorn.Server(uvicorn.Config(
+            asgi.application,
+            host='127.0.0.1',
+            port=port,
+            lifespan='on',
+            log_level='warning',
+            access_log=False
+        ))
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def clear_caches():
+    memory.CONTENT.clear()
+    memory.MISSING.clear()
+    with backend.LocalCache() as c:
+        c.clear()
+
+
+def create_pastes(count):
+    client = pasted.app.test_client()
+    keys = []
+    for i in range(count):
+        content = 'paste %d %s\n' % (i, uuid.uuid4().hex) * 64
+        r = client.post('/api/pastes', json={'content': content})
+        assert r.status_code == 201, r.status_code
+        keys.append(hashlib.sha1(content.encode('utf-8')).hexdigest())
+    return keys
+
+
+def create_link():
+    r = pasted.app.test_client().post(
+        '/api/links',
+        json={'content': 'https://example.com/%s' % uuid.uuid4().hex}
+    )
+    assert r.status_code == 201, r.status_code
+    return '/l/%s' % r.get_data(as_text=True).rstrip('/').rsplit('/', 1)[-1]
+
+
+def scenario_paths(name, count):
+    if name == 'raw_cold':
+        keys = create_pastes(count)
+        clear_caches()
+        return ['/pastes/%s.raw' % key for key in keys], 200
+    elif name == 'raw_hot':
+        key = create_pastes(1)[0]
+        return ['/pastes/%s.raw' % key] * count, 200
+    elif name == 'link':
+        return [create_link()] * count, 308
+    raise ValueError('Unknown scenario %s' % name)
+
+
+async def drive(url, paths, status, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=0
+    )
+    async with httpx.AsyncClient(
+        base_url=url,
+        limits=limits,
+        timeout=60
+    ) as client:
+        async def one(path):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    r = await client.get(path)
+                    ok = r.status_code == status
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(path) for path in paths])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'errors': errors,
+        'ops': len(paths) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(0.99 * (len(latencies) - 1))] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--cdn-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    fake = fake_openstack.FakeOpenStack(cdn_latency=args.cdn_latency).start()
+    paste_dir = tempfile.mkdtemp()
+    pasted.app.config.update(fake.config())
+    pasted.app.config['PASTE_DIR'] = paste_dir
+
+    print('concurrency=%d threads=%d cdn_latency=%.3fs' % (
+        args.concurrency, args.threads, args.cdn_latency
+    ))
+    header = '%-6s %-10s %7s %10s %10s %10s' % (
+        'mode', 'scenario', 'errors', 'ops/s', 'p50 ms', 'p99 ms'
+    )
+    print(header)
+    print('-' * len(header))
+    try:
+        for mode, server_class in (('sync', SyncServer), ('async', AsyncServer)):
+            server = server_class(args.threads)
+            try:
+                for name in SCENARIOS:
+                    clear_caches()
+                    paths, status = scenario_paths(name, args.requests)
+                    result = asyncio.run(drive(
+                        server.url,
+                        paths,
+                        status,
+                        args.concurrency
+                    ))
+                    print('%-6s %-10s %7d %10.1f %10.2f %10.2f' % (
+                        mode,
+                        name,
+                        result['errors'],
+                        result['ops'],
+                        result['p50_ms'],
+                        result['p99_ms']
+                    ))
+            finally:
+                server.stop()
+    finally:
+        backend.CACHE_MANAGER.close()
+        fake.stop()
+        shutil.rmtree(paste_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Compare the cost and size of the paste compression codecs.
+
+Usage: python benchmarks/bench_codecs.py [--size BYTES] [--repeat N]
+
+Each codec is run over corpora shaped like real pastes, service logs,
+Python source and JSON API output, and the compression ratio and
+throughput of compression and decompression are reported.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import sysconfig
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pasted import codec  # noqa: E402
+
+
+CODECS = [
+    ('gzip', 1),
+    ('gzip', 6),
+    ('gzip', 9),
+    ('zstd', 1),
+    ('zstd', 3),
+    ('zstd', 10),
+    ('zstd', 19),
+]
+
+
+def corpus_logs(size, seed=0):
+    rnd = random.Random(seed)
+    levels = ['INFO', 'INFO', 'INFO', 'DEBUG', 'WARNING', 'ERROR']
+    services = ['nova.compute', 'neutron.agent', 'swift.proxy', 'keystone']
+    messages = [
+        'Took %.2f seconds to build instance.',
+        'Successfully synced instances from host %s.',
+        'Request %s completed with status 200 in %.3fs',
+        'Lock "compute_resources" acquired by %s :: waited 0.000s',
+        'Traceback (most recent call last): File "%s", line 42',
+    ]
+    lines = []
+    total = 0
+    ts = 1600000000.0
+    while total < size:
+        ts += rnd.random()
+        message = rnd.choice(messages)
+        args = tuple(
+            rnd.random() * 10 if part.startswith('.') else '%032x' % rnd.getrandbits(128)
+            for part in message.split('%')[1:]
+        )
+        line = '%s.%03d %d %s %s [req-%s] %s' % (
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)),
+            int(ts * 1000) % 1000,
+            rnd.randint(1000, 9999),
+            rnd.choice(levels),
+            rnd.choice(services),
+            '%08x' % rnd.getrandbits(32),
+            message % args
+        )
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines).encode('utf-8')[:size]
+
+
+def corpus_source(size):
+    stdlib = sysconfig.get_paths()['stdlib']
+    chunks = []
+    total = 0
+    for name in sorted(os.listdir(stdlib)):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(stdlib, name), 'rb') as f:
+            data = f.read()
+        chunks.append(data)
+        total += len(data)
+        if total >= size:
+            break
+    return b''.join(chunks)[:size]
+
+
+def corpus_json(size, seed=0):
+    rnd = random.Random(seed)
+    items = []
+    total = 0
+    while total < size:
+        item = {
+            'id': '%032x' % rnd.getrandbits(128),
+            'name': 'server-%d' % rnd.randint(0, 10000),
+            'status': rnd.choice(['ACTIVE', 'BUILD', 'ERROR', 'SHUTOFF']),
+            'flavor': {'vcpus': rnd.choice([1, 2, 4, 8]), 'ram': 2048},
+            'addresses': ['10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(1, 254))]
+        }
+        items.append(item)
+        total += 160
+    return json.dumps(items, indent=2).encode('utf-8')[:size]
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpora = [
+        ('logs', corpus_logs(args.size)),
+        ('source', corpus_source(args.size)),
+        ('json', corpus_json(args.size)),
+    ]
+    header = '%-8s %-6s %5s %10s %8s %12s %12s' % (
+        'corpus', 'codec', 'level', 'size', 'ratio', 'comp MB/s',
+        'decomp MB/s'
+    )
+    print(header)
+    print('-' * len(header))
+    for corpus_name, data in corpora:
+        mb = len(data) / 1024.0 / 1024.0
+        for name, level in CODECS:
+            if not codec.available(name):
+                print('%-8s %-6s %5s %s' % (
+                    corpus_name, name, level, 'not available'
+                ))
+                continue
+
+            comp_time, (compressed, _) = timed(
+                lambda: codec.compress(data, name, level=level),
+                args.repeat
+            )
+            decomp_time, _ = timed(
+                lambda: codec.decompress(compressed),
+                args.repeat
+            )
+            print('%-8s %-6s %5d %10d %8.2f %12.1f %12.1f' % (
+                corpus_name,
+                name,
+                level,
+                len(compressed),
+                len(data) / float(len(compressed)),
+                mb / comp_time,
+                mb / decomp_time
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Measure the cost of server side highlighting against paste size.
+
+Usage: python benchmarks/bench_highlight.py [--sizes BYTES,...] [--repeat N]
+
+For every corpus and size the language detection time, the highlighting
+time and the size of the highlighted HTML are reported. Use the results to
+pick HIGHLIGHT_MAX_SIZE and HIGHLIGHT_DETECT_SIZE: pastes are highlighted
+once and the rendering is cached, so the cost is paid on the first view.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import pygments  # noqa: E402
+
+from pygments import formatters  # noqa: E402
+
+import bench_codecs  # noqa: E402
+import pasted  # noqa: E402
+
+from pasted import highlight  # noqa: E402
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes',
+        default='1024,16384,131072,524288,2097152',
+        help='Comma separated paste sizes in bytes.'
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    corpora = [
+        ('logs', lambda size: bench_codecs.corpus_logs(size)),
+        ('source', bench_codecs.corpus_source),
+        ('json', lambda size: bench_codecs.corpus_json(size)),
+    ]
+    header = '%-8s %9s %-12s %10s %12s %12s %10s' % (
+        'corpus', 'size', 'language', 'detect ms', 'highlight ms',
+        'html bytes', 'MB/s'
+    )
+    print('detect_size=%d' % pasted.app.config['HIGHLIGHT_DETECT_SIZE'])
+    print(header)
+    print('-' * len(header))
+    formatter = formatters.HtmlFormatter(nowrap=True)
+    with pasted.app.app_context():
+        for corpus_name, corpus in corpora:
+            for size in sizes:
+                content = corpus(size).decode('utf-8', 'replace')
+                detect_time, lexer = timed(
+                    lambda: highlight.detect(content),
+                    args.repeat
+                )
+                highlight_time, html = timed(
+                    lambda: pygments.highlight(content, lexer, formatter),
+                    args.repeat
+                )
+                print('%-8s %9d %-12s %10.2f %12.2f %12d %10.2f' % (
+                    corpus_name,
+                    size,
+                    lexer.name[:12],
+                    detect_time * 1000,
+                    highlight_time * 1000,
+                    len(html),
+                    size / 1024.0 / 1024.0 / highlight_time
+                ))
+
+
+if __name__ == '__main__':
+    main()
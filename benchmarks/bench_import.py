@@ -0,0 +1,76 @@
+"""Measure how long importing and starting the pasted application takes.
+
+Usage: python benchmarks/bench_import.py [--repeat N] [--top N]
+
+Each sample runs a fresh interpreter, the way a restarted worker or a CLI
+tool does. The report lists the median time of importing pasted, of
+importing it and preloading the storage provider, and the slowest modules
+of the import as reported by python -X importtime.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEPS = [
+    ('import', 'import pasted'),
+    ('import+preload', 'import pasted; pasted.preload()'),
+]
+
+
+def run(code):
+    timer = (
+        'import time; _start = time.perf_counter(); %s; '
+        'print(time.perf_counter() - _start)' % code
+    )
+    output = subprocess.check_output(
+        [sys.executable, '-c', timer],
+        cwd=ROOT
+    )
+    return float(output.decode('utf-8').split()[-1])
+
+
+def slowest_modules(top):
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import pasted'],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        check=True
+    ).stderr.decode('utf-8')
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative_us), name.rstrip()))
+    modules.sort(reverse=True)
+    return modules[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    print('%-16s %10s %10s' % ('step', 'median ms', 'min ms'))
+    for name, code in STEPS:
+        samples = [run(code) for _ in range(args.repeat)]
+        print('%-16s %10.1f %10.1f' % (
+            name,
+            statistics.median(samples) * 1000,
+            min(samples) * 1000
+        ))
+
+    print()
+    print('%10s  %s' % ('cumul. ms', 'module'))
+    for cumulative_us, name in slowest_modules(args.top):
+        print('%10.1f  %s' % (cumulative_us / 1000.0, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,12 +8,26 @@ from flask_selfdoc import Autodoc
 from flask_wtf.csrf import CSRFProtect
 
 app = flask.Flask(__name__, instance_relative_config=True)
-csrf = CSRFProtect(app)
-csrf.init_app(app)
-auto = Autodoc(app)
+csrf = CSRFProtect()
+auto = Autodoc()
 
 
-def _app_setup():
+def _check_config(config):
+    """Reject config items which cannot work together.
+
+    :param config: Complete app config.
+    :type config: dict
+    """
+    if (
+        config.get('CHUNKING')
+        and config['CHUNKING_MIN_SIZE'] <= config['CHUNK_MAX_SIZE']
+    ):
+        # content below the largest chunk size could be a single chunk,
+        # whose key is the key of the paste itself
+        raise ValueError('CHUNKING_MIN_SIZE must exceed CHUNK_MAX_SIZE')
+
+
+def _app_setup(config=None):
     """start the application."""
     app.config.from_object('pasted.config')
 
@@ -24,6 +38,13 @@ def _app_setup():
     except RuntimeError:
         pass
 
+    if config:
+        app.config.update(config)
+    _check_config(app.config)
+
+    csrf.init_app(app)
+    auto.init_app(app)
+
     # ensure the local PASTE_DIR exists
     _local_path = os.path.expanduser(app.config['PASTE_DIR'])
     if not os.path.exists(_local_path):
@@ -41,6 +62,47 @@ def _app_setup():
     app.config['APP_SETUP'] = True
 
 
-if not app.config.get('APP_SETUP'):
-    _app_setup()
-    import pasted.views as views # flake8: noqa
+def create_app(config=None):
+    """Return the configured application.
+
+    The configuration is loaded and the views are registered once per
+    process, later calls return the same application with the config items
+    applied and the values derived from the config computed again. Nothing
+    here opens a connection or a cache handle, those are created on first
+    use so a preloading server creates them in each worker after fork.
+
+    :param config: Config items overriding the config files.
+    :type config: dict
+    :returns: object
+    """
+    if not app.config.get('APP_SETUP'):
+        _app_setup(config=config)
+        import pasted.views as views # flake8: noqa
+    elif config:
+        from pasted import highlight
+        from pasted import views
+
+        _check_config(dict(app.config, **config))
+        app.config.update(config)
+        views._templates_version.cache_clear()
+        highlight.stylesheet.cache_clear()
+    return app
+
+
+def preload():
+    """Load what workers would otherwise load on their first request.
+
+    Called once in a preloading server before it forks its workers, so the
+    storage provider libraries and the compiled templates are shared by
+    every worker instead of being loaded by each of them.
+    """
+    from pasted import cdn
+    from pasted import views
+
+    cdn.load_provider()
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+    views._templates_version()
+
+
+create_app()
@@ -0,0 +1,403 @@
+"""Serve pasted from an event loop.
+
+    uvicorn pasted.asgi:application
+
+Every route is served by the Flask views, unchanged, running in the event
+loop's thread pool. Reads of content missing from the local cache are first
+fetched from the CDN_ENDPOINT on the event loop, so a worker waiting on the
+CDN holds no thread, and the view then serves the content from the cache.
+Reads of rate limited clients are not fetched, the view rejects them.
+Uploads and other storage calls run in the thread pool with the view.
+
+Requires the optional httpx package.
+"""
+
+import asyncio
+import concurrent.futures
+import sys
+import tempfile
+
+import httpx
+
+from werkzeug import exceptions as http_exceptions
+
+import pasted
+
+from pasted import app
+from pasted import backend
+from pasted import breaker
+from pasted import codec
+from pasted import exceptions
+from pasted import log
+from pasted import memory
+from pasted import ratelimit
+
+
+# Views reading the content of the paste or link in their URL
+READ_ENDPOINTS = frozenset([
+    'show_paste',
+    'show_paste_raw',
+    'show_link',
+    'show_link_data'
+])
+
+
+class _WSGIInstance(object):
+    """Serve one ASGI HTTP request with a WSGI application.
+
+    The request body is spooled, then the application runs in the event
+    loop's executor, so views execute concurrently on ASGI_THREADS threads.
+    The response is sent back from the executor thread through the loop as
+    the application yields it.
+    """
+
+    def __init__(self, wsgi_app):
+        """Initialization method for class.
+
+        :param wsgi_app: WSGI application.
+        :type wsgi_app: object
+        """
+        self.wsgi_app = wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported scope type %s' % scope['type'])
+
+        body = tempfile.SpooledTemporaryFile(
+            max_size=app.config['STREAM_CHUNK_SIZE'] * 16
+        )
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None,
+                self.run,
+                _environ(scope, body),
+                lambda message: asyncio.run_coroutine_threadsafe(
+                    send(message),
+                    loop
+                ).result()
+            )
+        finally:
+            body.close()
+
+    def run(self, environ, send):
+        """Run the WSGI application and send its response.
+
+        :param environ: WSGI environment.
+        :type environ: dict
+        :param send: Function sending an ASGI message from this thread.
+        :type send: function
+        """
+        state = dict()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [
+                    (name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers
+                ]
+            }
+            return write
+
+        def write(output):
+            if not state.get('started'):
+                state['started'] = True
+                send(state['start'])
+            if output:
+                send({
+                    'type': 'http.response.body',
+                    'body': output,
+                    'more_body': True
+                })
+
+        response = self.wsgi_app(environ, start_response)
+        try:
+            for output in response:
+                write(output)
+        finally:
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+        write(b'')
+        send({'type': 'http.response.body'})
+
+
+def _environ(scope, body):
+    """Return the WSGI environment of an ASGI HTTP request.
+
+    :param scope: ASGI connection scope.
+    :type scope: dict
+    :param body: Request body.
+    :type body: object
+    :returns: dict
+    """
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
+
+
+class Fetcher(object):
+    """Fetch content from the CDN endpoint into the local disk cache.
+
+    Concurrent fetches of the same key share a single CDN request and count
+    against the "cdn.read" circuit breaker like synchronous reads do.
+    Failures are not raised, the view retries the read and reports them.
+    """
+
+    def __init__(self):
+        """Initialization method for class."""
+        self._client = None
+        self._loop = None
+        self._inflight = dict()
+
+    @property
+    def client(self):
+        """Return the keep-alive HTTP client of the running event loop.
+
+        :returns: object
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._inflight = dict()
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=app.config['CDN_POOL_MAXSIZE'],
+                    max_keepalive_connections=app.config['CDN_POOL_MAXSIZE']
+                ),
+                timeout=httpx.Timeout(
+                    app.config['CDN_READ_TIMEOUT'],
+                    connect=app.config['CDN_CONNECT_TIMEOUT']
+                )
+            )
+        return self._client
+
+    async def close(self):
+        """Close the HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def load(self, key):
+        """Fetch a key into the local disk cache.
+
+        :param key: index item.
+        :type key: str
+        :returns: bool
+        """
+        client = self.client
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(
+                self._fetch(client, key)
+            )
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, client, key):
+        cdn_breaker = breaker.get('cdn.read')
+        if not cdn_breaker.allow():
+            return False
+
+        accept_encoding = [c for c in codec.MAGIC if codec.available(c)]
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=app.config['STREAM_CHUNK_SIZE'] * 16
+        )
+        try:
+            async with client.stream(
+                'GET',
+                backend.remote_url(key),
+                headers={
+                    'Accept-Encoding': ', '.join(
+                        accept_encoding + ['identity']
+                    )
+                }
+            ) as r:
+                if r.status_code >= 500:
+                    raise exceptions.ProviderError(
+                        'CDN read failed with status %s' % r.status_code
+                    )
+                elif r.status_code == 404:
+                    log.info('Paste not found in CDN', key=key)
+                    memory.MISSING.add(key)
+                elif r.status_code == 200:
+                    # Content compressed with a known codec is cached as is
+                    if r.headers.get('Content-Encoding') in accept_encoding:
+                        chunks = r.aiter_raw()
+                    else:
+                        chunks = r.aiter_bytes()
+                    async for chunk in chunks:
+                        spool.write(chunk)
+                status_code = r.status_code
+        except (httpx.HTTPError, exceptions.ProviderError) as e:
+            cdn_breaker.failure()
+            spool.close()
+            log.warning('CDN read failed: %s' % e, key=key)
+            return False
+        cdn_breaker.success()
+
+        if status_code != 200:
+            spool.close()
+            return False
+
+        spool.seek(0)
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                backend.cache_file,
+                key,
+                spool
+            )
+        finally:
+            spool.close()
+        log.info('Retrieved paste from CDN', key=key)
+        return True
+
+
+class Application(object):
+    """ASGI application wrapping the Flask application."""
+
+    def __init__(self, wsgi_app):
+        """Initialization method for class.
+
+        :param wsgi_app: Flask application.
+        :type wsgi_app: object
+        """
+        self.wsgi_app = wsgi_app
+        self.fetcher = Fetcher()
+        self.url_adapter = wsgi_app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.prefetch(scope)
+        await _WSGIInstance(self.wsgi_app)(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                asyncio.get_running_loop().set_default_executor(
+                    concurrent.futures.ThreadPoolExecutor(
+                        max_workers=app.config['ASGI_THREADS'],
+                        thread_name_prefix='pasted-asgi'
+                    )
+                )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.fetcher.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _read_key(self, scope):
+        """Return the key read by a request or None.
+
+        :param scope: ASGI connection scope.
+        :type scope: dict
+        :returns: str or None
+        """
+        if scope['method'] not in ('GET', 'HEAD'):
+            return None
+
+        try:
+            endpoint, args = self.url_adapter.match(
+                scope['path'],
+                method=scope['method']
+            )
+        except http_exceptions.HTTPException:
+            return None
+
+        if endpoint not in READ_ENDPOINTS:
+            return None
+
+        # conditional requests are answered without reading the content
+        for name, _ in scope.get('headers', []):
+            if name == b'if-none-match':
+                return None
+        return args.get('pasted_id')
+
+    async def prefetch(self, scope):
+        """Fetch the content read by a request when it is not cached.
+
+        :param scope: ASGI connection scope.
+        :type scope: dict
+        """
+        key = self._read_key(scope)
+        if key is None or memory.CONTENT.get(key) is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self._needs_fetch, scope, key):
+            await self.fetcher.load(key)
+
+    def _needs_fetch(self, scope, key):
+        """Check whether a read is admitted and its content is not cached.
+
+        :param scope: ASGI connection scope.
+        :type scope: dict
+        :param key: index item.
+        :type key: str
+        :returns: bool
+        """
+        with self.wsgi_app.test_request_context(
+            scope['path'],
+            method=scope['method'],
+            headers=[
+                (name.decode('latin-1'), value.decode('latin-1'))
+                for name, value in scope.get('headers', [])
+            ],
+            environ_base={
+                'REMOTE_ADDR': (scope.get('client') or ('',))[0]
+            }
+        ):
+            if not ratelimit.admits('read'):
+                return False
+        return backend.needs_fetch(key)
+
+
+application = Application(pasted.create_app())
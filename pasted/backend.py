@@ -1,5 +1,14 @@
+import atexit
+import concurrent.futures
+import contextlib
 import hashlib
+import io
 import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 import urllib.parse as urlparse
 
 import flask
@@ -9,51 +18,367 @@ import diskcache
 import requests
 
 from pasted import app
+from pasted import breaker
 from pasted import cdn
+from pasted import chunking
+from pasted import codec
+from pasted import exceptions
 from pasted import log
+from pasted import memory
+from pasted import metrics
+from pasted import session
+from pasted import singleflight
+from pasted import uploads
+
+
+# Keys are SHA-1 hex digests of the content, or a prefix of one
+KEY_RE = re.compile(r'[0-9a-f]{1,40}')
+
+
+class CacheManager(object):
+    """Process wide registry of open cache handles.
+
+    Opening a diskcache object means opening and configuring a SQLite
+    database, so handles are opened once per worker process and shared by
+    every request. Handles are dropped in a forked child, because SQLite
+    connections must not cross a fork, and are reopened on first use.
+    """
+
+    def __init__(self):
+        """Initialization method for class."""
+        self._lock = threading.Lock()
+        self._handles = dict()
+        self._pid = os.getpid()
+
+    def get(self, cache_path, **settings):
+        """Return the open cache handle for a given path.
+
+        Settings are only used when the handle is first opened.
+
+        :param cache_path: File path to store cache
+        :type cache_path: str
+        :param settings: diskcache settings.
+        :type settings: dict
+        :returns: object
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        handle = self._handles.get(cache_path)
+        if handle is None:
+            with self._lock:
+                handle = self._handles.get(cache_path)
+                if handle is None:
+                    log.debug('Opening cache handle', path=cache_path)
+                    handle = self._handles[cache_path] = diskcache.Cache(
+                        directory=cache_path,
+                        **settings
+                    )
+        return handle
+
+    def reset(self):
+        """Forget all handles opened by a parent process.
+
+        The handles are not closed, closing them would touch connections
+        owned by the parent.
+        """
+        self._lock = threading.Lock()
+        self._handles = dict()
+        self._pid = os.getpid()
+
+    def close(self):
+        """Close all handles opened by this process."""
+        if self._pid != os.getpid():
+            return self.reset()
+
+        with self._lock:
+            handles, self._handles = self._handles, dict()
+        for handle in handles.values():
+            handle.close()
+
+
+CACHE_MANAGER = CacheManager()
+atexit.register(CACHE_MANAGER.close)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=CACHE_MANAGER.reset)
 
 
 class LocalCache(object):
-    """Context Manager for opening and closing access to the cache objects."""
+    """Context Manager for accessing the shared cache objects."""
 
-    def __init__(self, cache_path=app.config['PASTE_DIR']):
+    def __init__(self, cache_path=None):
         """Set the Path cache object.
-        :param cache_file: File path to store cache
-        :type cache_file: str
+        :param cache_path: File path to store cache
+        :type cache_path: str
         """
-        self.cache_path = cache_path
+        self.cache_path = cache_path or app.config['PASTE_DIR']
 
         if not os.path.isdir(self.cache_path):
             os.makedirs(self.cache_path)
 
     def __enter__(self):
-        """Open the cache object.
+        """Return the shared cache object.
         :returns: object
         """
         return self.open_cache
 
     def __exit__(self, *args, **kwargs):
-        """Close cache object."""
-        self.lc_close()
+        """Release the cache object.
+
+        The handle is owned by the CACHE_MANAGER and stays open for the
+        next request.
+        """
+        pass
 
     @property
     def open_cache(self):
         """Return open caching opbject.
         :returns: object
         """
-        return diskcache.Cache(directory=self.cache_path)
+        return CACHE_MANAGER.get(self.cache_path)
 
     def lc_open(self):
         """Open shelved data.
-        :param cache_file: File path to store cache
-        :type cache_file: str
         :returns: object
         """
         return self.open_cache
 
     def lc_close(self):
-        """Close shelved data."""
-        self.open_cache.close()
+        """Close all shelved data handles held by this process."""
+        CACHE_MANAGER.close()
+
+
+class KnownKeys(object):
+    """Persistent index of keys known to exist in the CDN.
+
+    The index is a diskcache store kept in the PASTE_DIR next to the content
+    cache. It never evicts or expires entries, so a write for content that
+    is already known never touches the CDN.
+    """
+
+    def __init__(self, cache_path=None):
+        """Set the Path of the index.
+        :param cache_path: File path to store the index
+        :type cache_path: str
+        """
+        self.cache_path = cache_path
+
+    @property
+    def index(self):
+        """Return the open index object.
+        :returns: object
+        """
+        cache_path = self.cache_path or app.config['PASTE_DIR']
+        return CACHE_MANAGER.get(
+            os.path.join(cache_path, 'known_keys'),
+            eviction_policy='none'
+        )
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def add(self, key):
+        """Record a key as existing in the CDN.
+
+        :param key: index item.
+        :type key: str
+        """
+        self.index.set(key, 1)
+
+    def discard(self, key):
+        """Forget a key.
+
+        :param key: index item.
+        :type key: str
+        """
+        self.index.delete(key)
+
+    def rebuild(self, container=None):
+        """Rebuild the index from a CDN container listing.
+
+        :param container: Name of the CDN container to list.
+        :type container: str
+        :returns: int
+        """
+        index = self.index
+        index.clear()
+        total = 0
+        for key in cdn.list_objects(container=container):
+            index.set(key, 1)
+            total += 1
+        log.info('Known keys index rebuilt', total=total)
+        return total
+
+
+KNOWN_KEYS = KnownKeys()
+
+
+class ObjectCounters(object):
+    """Host wide object count and total size of the CDN container.
+
+    The counters live in a non-evicting diskcache store in the PASTE_DIR.
+    Writes increment them, a background thread reconciles them with the
+    container every STATS_RECONCILE_INTERVAL seconds and each worker serves
+    a snapshot from memory, refreshed every STATS_REFRESH_INTERVAL seconds,
+    so reading them never waits on the CDN.
+    """
+
+    def __init__(self, cache_path=None):
+        """Set the Path of the counters store.
+        :param cache_path: File path to store the counters
+        :type cache_path: str
+        """
+        self.cache_path = cache_path
+        self.reset()
+
+    def reset(self):
+        """Forget the snapshot and thread of a parent process."""
+        self._lock = threading.Lock()
+        self._thread = None
+        self._snapshot = None
+        self._snapshot_at = 0
+        self._pid = os.getpid()
+
+    @property
+    def store(self):
+        """Return the open counters store.
+        :returns: object
+        """
+        cache_path = self.cache_path or app.config['PASTE_DIR']
+        return CACHE_MANAGER.get(
+            os.path.join(cache_path, 'stats'),
+            eviction_policy='none'
+        )
+
+    def add(self, objects, size):
+        """Count new objects.
+
+        :param objects: Number of new objects.
+        :type objects: int
+        :param size: Size of the new objects in bytes.
+        :type size: int
+        """
+        store = self.store
+        store.incr(b'object_count', objects)
+        store.incr(b'total_size', size)
+        self._snapshot = None
+
+    def add_chunked(self, size, stored):
+        """Count a chunked paste.
+
+        :param size: Size of the paste in bytes.
+        :type size: int
+        :param stored: Size of the chunks it added to the storage in bytes.
+        :type stored: int
+        """
+        store = self.store
+        store.incr(b'chunked_size', size)
+        store.incr(b'chunked_stored_size', stored)
+
+    def chunked(self):
+        """Return the (<size>, <stored size>) of every chunked paste.
+
+        The ratio of both is the deduplication ratio of chunked pastes.
+
+        :returns: tuple
+        """
+        store = self.store
+        return (
+            store.get(b'chunked_size', 0),
+            store.get(b'chunked_stored_size', 0)
+        )
+
+    def get(self):
+        """Return the (<count>, <size>) snapshot.
+
+        :returns: tuple
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or now - self._snapshot_at >= app.config['STATS_REFRESH_INTERVAL']
+        ):
+            store = self.store
+            snapshot = self._snapshot = (
+                store.get(b'object_count', 0),
+                store.get(b'total_size', 0)
+            )
+            self._snapshot_at = now
+            self.start()
+        return snapshot
+
+    def reconcile(self, container=None):
+        """Replace the counters with the container statistics.
+
+        :param container: Name of the CDN container to count.
+        :type container: str
+        :returns: tuple
+        """
+        object_count, total_size = cdn.count(container=container)
+        store = self.store
+        with store.transact():
+            store.set(b'object_count', object_count)
+            store.set(b'total_size', total_size)
+            store.set(b'reconciled_at', time.time())
+        self._snapshot = None
+        log.info(
+            'Object counters reconciled',
+            count=object_count,
+            size=total_size
+        )
+        return object_count, total_size
+
+    def start(self):
+        """Start the reconciliation thread if it is not running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name='pasted-stats',
+                daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            interval = app.config['STATS_RECONCILE_INTERVAL']
+            store = self.store
+            age = time.time() - store.get(b'reconciled_at', 0)
+            # one worker per host holds the lease and reconciles
+            if age >= interval and store.add(
+                b'reconcile_lease',
+                os.getpid(),
+                expire=interval
+            ):
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    log.warning('Object counters reconcile failed: %s' % e)
+                age = 0
+            time.sleep(max(interval - age, 1))
+
+
+COUNTERS = ObjectCounters()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=COUNTERS.reset)
+
+
+def valid_key(key):
+    """Check that a key can be a SHA-1 prefix.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    return KEY_RE.fullmatch(key) is not None
 
 
 def local_url(key, backend):
@@ -80,25 +405,630 @@ def remote_url(key):
     return urlparse.urljoin(app.config['CDN_ENDPOINT'], key)
 
 
-def read(key):
-    """Read the content from the CDN.
+def cache_set(key, content):
+    """Store content in the local disk cache and the memory tier.
+
+    Keys are SHA-1 hashes of their content, the content behind a key never
+    changes so entries may live as long as DISK_CACHE_TTL allows.
+
+    :param key: index item.
+    :type key: str
+    :param content: data.
+    :type content: bytes
+    """
+    with LocalCache() as c:
+        c.set(key, content, expire=app.config['DISK_CACHE_TTL'])
+    memory.CONTENT.set(key, content)
+
+
+@metrics.timed('cache_get')
+def cache_open(key):
+    """Return a readable file object for cached content.
+
+    Content is read from the memory tier or opened from the local disk cache
+    without loading it into memory.
+
+    :param key: index item.
+    :type key: str
+    :returns: tuple (file, size) or None
+    """
+    content = memory.CONTENT.get(key)
+    if content is not None:
+        return io.BytesIO(content), len(content)
+
+    with LocalCache() as c:
+        handle = c.get(key, read=True)
+    if handle is None:
+        return None
+    elif isinstance(handle, bytes):
+        # small values are stored inline in the cache database
+        return io.BytesIO(handle), len(handle)
+
+    size = handle.seek(0, io.SEEK_END)
+    handle.seek(0)
+    return handle, size
+
+
+def cache_file(key, stream):
+    """Copy fetched content from a binary file into the local disk cache.
 
     :param key: index item.
     :type key: str
+    :param stream: Readable binary file.
+    :type stream: object
     """
     with LocalCache() as c:
-        content = c.get(key)
+        c.set(key, stream, read=True, expire=app.config['DISK_CACHE_TTL'])
+    KNOWN_KEYS.add(key)
+
+
+def needs_fetch(key):
+    """Check whether reading a key would fetch it from the CDN endpoint.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    return bool(
+        app.config['CDN_ENDPOINT']
+        and not _direct()
+        and valid_key(key)
+        and key not in memory.MISSING
+        and not _cached(key)
+    )
+
+
+def _cached(key):
+    if memory.CONTENT.get(key) is not None:
+        return True
+
+    with LocalCache() as c:
+        return key in c
+
+
+def _direct():
+    """Check whether the provider serves its objects as local files.
+
+    Such objects are read straight from the provider, they are not copied
+    into the disk cache.
+
+    :returns: bool
+    """
+    provider_class = cdn.PROVIDERS.get(app.config['CDN_PROVIDER'])
+    return provider_class is not None and provider_class.serves_files
+
+
+@metrics.timed('cdn_fetch')
+def _fetch(key):
+    """Stream content into the local disk cache.
+
+    Content is read from the public CDN_ENDPOINT when one is configured,
+    otherwise straight from the storage provider.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    if app.config['CDN_ENDPOINT']:
+        return _fetch_url(key)
+    return _fetch_provider(key)
+
+
+def _fetch_provider(key):
+    """Stream content from the storage provider into the local disk cache.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    try:
+        opened = cdn.fetch(key)
+    except Exception as e:
+        log.warning('Provider read failed: %s' % e, key=key)
+        raise exceptions.ServiceUnavailable('Storage is unavailable')
+
+    if opened is None:
+        log.info('Paste not found in provider', key=key)
+        memory.MISSING.add(key)
+        return False
+
+    stream, _ = opened
+    try:
+        cache_file(key, stream)
+    finally:
+        stream.close()
+    log.info('Retrieved paste from provider', key=key)
+    return True
+
+
+def _get_url(url, **kwargs):
+    """Issue a CDN GET, raising on server errors.
+
+    :param url: Remote URL.
+    :type url: str
+    :returns: object
+    """
+    r = session.SESSION_POOL.get(url, **kwargs)
+    if r.status_code >= 500:
+        r.close()
+        raise exceptions.ProviderError(
+            'CDN read failed with status %s' % r.status_code
+        )
+    return r
+
+
+def _fetch_url(key):
+    """Stream content from the CDN into the local disk cache.
 
-    if not content:
-        r = requests.get(remote_url(key))
+    Unavailable CDN reads count against the "cdn.read" circuit breaker and
+    raise ServiceUnavailable.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    accept_encoding = [c for c in codec.MAGIC if codec.available(c)]
+    try:
+        r = breaker.get('cdn.read').call(
+            _get_url,
+            remote_url(key),
+            stream=True,
+            headers={
+                'Accept-Encoding': ', '.join(accept_encoding + ['identity'])
+            }
+        )
+    except (requests.RequestException, exceptions.ProviderError) as e:
+        log.warning('CDN read failed: %s' % e, key=key)
+        raise exceptions.ServiceUnavailable('Storage is unavailable')
+
+    with r:
         if r.status_code == requests.codes.ok:
             log.info('Retrieved paste from CDN', key=key)
-            return r'{}'.format(r.text)
+            # Content compressed with a known codec is cached as is
+            r.raw.decode_content = r.headers.get(
+                'Content-Encoding'
+            ) not in accept_encoding
+            try:
+                with LocalCache() as c:
+                    c.set(
+                        key,
+                        r.raw,
+                        read=True,
+                        expire=app.config['DISK_CACHE_TTL']
+                    )
+            except requests.RequestException as e:
+                log.warning('CDN read failed: %s' % e, key=key)
+                raise exceptions.ServiceUnavailable('Storage is unavailable')
+            KNOWN_KEYS.add(key)
+            return True
+        elif r.status_code == requests.codes.not_found:
+            log.info('Paste not found in CDN', key=key)
+            memory.MISSING.add(key)
+    return False
+
+
+def _fetch_host_locked(key):
+    """Fetch content from the CDN once for all processes on a host.
+
+    Once the lock is held the local cache is checked again, another worker
+    may have fetched the content while this one was waiting.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    lock_path = os.path.join(app.config['PASTE_DIR'], 'locks')
+    with singleflight.host_lock(lock_path, key):
+        if _cached(key):
+            log.info('Read object fetched by another worker', key=key)
+            return True
+        return _fetch(key)
+
+
+def _load(key):
+    """Make sure content is in the local cache, fetching it when needed.
+
+    Concurrent cache misses for the same key are coalesced so that only one
+    CDN fetch is in flight per process, or per host when CDN_FETCH_HOST_LOCK
+    is enabled. Malformed keys are rejected before any I/O and keys the CDN
+    recently reported missing are not fetched again until their negative
+    cache entry expires.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    if not valid_key(key):
+        return False
+    elif key in memory.MISSING:
+        return False
+
+    if app.config['CDN_FETCH_HOST_LOCK']:
+        fetch = _fetch_host_locked
+    else:
+        fetch = _fetch
+    return singleflight.FETCHES.do(key, fetch, key)
+
+
+def _open_memory(key):
+    content = memory.CONTENT.get(key)
+    if content is not None:
+        return io.BytesIO(content), len(content)
+
+
+def _open_provider(key):
+    """Open content from a local provider file.
+
+    Missing keys are not negatively cached, looking for the file costs a
+    single open and another worker may write it at any time.
+
+    :param key: index item.
+    :type key: str
+    :returns: tuple (file, size) or None
+    """
+    try:
+        opened = cdn.fetch(key)
+    except Exception as e:
+        log.warning('Provider read failed: %s' % e, key=key)
+        raise exceptions.ServiceUnavailable('Storage is unavailable')
+
+    if opened is not None:
+        KNOWN_KEYS.add(key)
+    return opened
+
+
+@metrics.timed('read')
+def read(key):
+    """Read the content from the CDN.
+
+    :param key: index item.
+    :type key: str
+    :returns: str or None
+    """
+    if not valid_key(key):
+        return None
+
+    content = memory.CONTENT.get(key)
+    if content is None or chunking.is_manifest(content):
+        opened = open_stream(key)
+        if opened is None:
+            return None
+
+        stream, _, _ = opened
+        with contextlib.closing(stream):
+            content = stream.read()
+        # chunked content is large, its chunks are in the memory tier
+        if not isinstance(stream, chunking.ChunkedFile):
+            memory.CONTENT.set(key, content)
+    else:
+        log.info('Read object from memory', key=key)
+    return codec.decompress(content).decode("utf-8")
+
+
+@metrics.timed('open')
+def open_stream(key):
+    """Open the content of a key as a binary file object.
+
+    Content is never decoded, large objects are streamed from the CDN into
+    the disk cache and served from there in chunks, or served straight from
+    the provider files for providers which store objects locally. Content
+    waiting in the upload journal is served from the journal. When the
+    storage is unavailable expired content of the memory tier is served,
+    content never changes, otherwise ServiceUnavailable is raised. The
+    returned codec names the compression of the stored bytes, None when
+    uncompressed.
+
+    :param key: index item.
+    :type key: str
+    :returns: tuple (file, size, codec) or None
+    """
+    if not valid_key(key):
+        return None
+
+    direct = _direct()
+    if direct:
+        opened = _open_memory(key)
+    else:
+        opened = cache_open(key)
+
+    if opened is None:
+        opened = uploads.JOURNAL.open(key)
+
+    if opened is None:
+        try:
+            if direct:
+                opened = _open_provider(key)
+            elif _load(key):
+                opened = cache_open(key)
+        except exceptions.ServiceUnavailable:
+            content = memory.CONTENT.get(key, stale=True)
+            if content is None:
+                raise
+            log.warning('Serving stale content', key=key)
+            opened = io.BytesIO(content), len(content)
+    if opened is None:
+        return None
+
+    stream, size = opened
+    head = stream.read(len(chunking.MAGIC))
+    stream.seek(0)
+    if chunking.is_manifest(head):
+        with contextlib.closing(stream):
+            entries = chunking.parse(stream.read())
+        chunked = chunking.ChunkedFile(
+            entries,
+            _open_chunk,
+            load_chunk=_prefetch_chunk,
+            readahead=app.config['BULK_WORKERS']
+        )
+        return chunked, chunked.size, None
+    return stream, size, codec.sniff(head)
+
+
+def _open_chunk(key):
+    """Open the decompressed content of a chunk.
+
+    :param key: index item.
+    :type key: str
+    :returns: object
+    """
+    opened = open_stream(key)
+    if opened is None:
+        log.error('Chunk of a paste is missing', key=key)
+        raise exceptions.ServiceUnavailable('Storage is unavailable')
+
+    stream, _, content_encoding = opened
+    return codec.open_decompressed(stream, content_encoding)
+
+
+def _prefetch_chunk(key):
+    """Load a chunk into the local cache ahead of its read.
+
+    Failures are ignored, they are raised again when the chunk is opened.
+
+    :param key: index item.
+    :type key: str
+    """
+    if _direct() or _cached(key) or key in uploads.JOURNAL:
+        return
+    try:
+        _load(key)
+    except exceptions.ServiceUnavailable:
+        pass
+
+
+def open_many(keys):
+    """Open the content of many keys, see open_stream.
+
+    The local cache is checked for every key up front and the misses are
+    fetched from the CDN concurrently on a pool of at most BULK_WORKERS
+    threads. Keys are yielded in order as soon as their content is ready,
+    with None for missing keys or the ServiceUnavailable error raised while
+    opening them.
+
+    :param keys: list of index items.
+    :type keys: list
+    :returns: generator of (key, opened) tuples
+    """
+    misses = []
+    if not _direct():
+        with LocalCache() as c:
+            for key in dict.fromkeys(keys):
+                if (
+                    valid_key(key)
+                    and key not in memory.MISSING
+                    and memory.CONTENT.get(key) is None
+                    and key not in c
+                    and key not in uploads.JOURNAL
+                ):
+                    misses.append(key)
+
+    fetches = dict()
+    pool = None
+    if misses:
+        pool = concurrent.futures.ThreadPoolExecutor(
+            min(app.config['BULK_WORKERS'], len(misses))
+        )
+        fetches = dict((key, pool.submit(_load, key)) for key in misses)
+    try:
+        for key in keys:
+            fetch = fetches.get(key)
+            try:
+                if fetch is not None:
+                    # failures are raised again, or served stale, below
+                    concurrent.futures.wait([fetch])
+                opened = open_stream(key)
+            except exceptions.ServiceUnavailable as e:
+                opened = e
+            yield key, opened
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def decode_stream(stream, content_encoding):
+    """Decompress a stored stream into a seekable spooled file.
+
+    Small content stays in memory, larger content spills to a temporary
+    file, so the decompressed size is known and ranges can be served.
+
+    :param stream: Stored binary file object, closed once copied.
+    :type stream: object
+    :param content_encoding: Compression codec of the stream.
+    :type content_encoding: str
+    :returns: tuple (file, size)
+    """
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    spool = tempfile.SpooledTemporaryFile(max_size=chunk_size * 16)
+    reader = codec.open_decompressed(stream, content_encoding)
+    try:
+        shutil.copyfileobj(reader, spool, chunk_size)
+    finally:
+        reader.close()
+    size = spool.tell()
+    spool.seek(0)
+    return spool, size
+
+
+@metrics.timed('exists')
+def exists(key):
+    """Check whether a key exists without reading its content.
+
+    The known keys index is consulted first, when the key is not indexed
+    and CDN_WRITE_HEAD_CHECK is enabled a HEAD request is sent to the CDN,
+    or to the storage provider when no CDN_ENDPOINT is set.
+
+    :param key: index item.
+    :type key: str
+    :returns: bool
+    """
+    if key in KNOWN_KEYS:
+        return True
+
+    if not app.config['CDN_WRITE_HEAD_CHECK']:
+        return False
+
+    try:
+        if app.config['CDN_ENDPOINT'] and not _direct():
+            r = breaker.get('cdn.head').call(
+                session.SESSION_POOL.head,
+                remote_url(key)
+            )
+            found = r.status_code == requests.codes.ok
+        else:
+            found = cdn.head(key) is not None
+    except Exception as e:
+        log.warning('CDN head failed: %s' % e, key=key)
+        return False
+
+    if found:
+        KNOWN_KEYS.add(key)
+    return found
+
+
+def _key(content, truncate=None):
+    key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    if truncate:
+        key = key[:truncate]
+    return key
+
+
+def _store(key, content):
+    """Compress and upload new content, then cache it locally.
+
+    When CHUNKING is enabled, content of at least CHUNKING_MIN_SIZE bytes is
+    split into content-defined chunks. Chunks are stored as objects of
+    their own, keyed by their hash, and only the chunks missing from the
+    storage are uploaded. The content is stored as a manifest listing its
+    chunks, unless it is a single chunk, whose key is the key of the
+    content itself.
+
+    :param key: index item.
+    :type key: str
+    :param content: data.
+    :type content: str
+    """
+    data = content.encode('utf-8')
+    if (
+        app.config['CHUNKING']
+        and len(data) >= app.config['CHUNKING_MIN_SIZE']
+    ):
+        manifest = _store_chunks(key, data)
+        if manifest is not None:
+            _put(key, manifest, compress=False)
+            return
+    _put(key, data)
+
+
+def _store_chunks(key, data):
+    """Store the chunks of content, and return its manifest.
+
+    Nothing is stored when a chunk has the key of the content, its manifest
+    would otherwise replace the chunk and list itself.
+
+    :param key: index item of the content.
+    :type key: str
+    :param data: UTF-8 encoded content.
+    :type data: bytes
+    :returns: bytes, or None when the content is not chunked
+    """
+    chunks = chunking.split(
+        data,
+        app.config['CHUNK_SIZE'],
+        app.config['CHUNK_MAX_SIZE']
+    )
+    entries = []
+    unique = dict()
+    for chunk in chunks:
+        chunk_key = chunking.key(chunk)
+        entries.append((chunk_key, len(chunk)))
+        unique.setdefault(chunk_key, chunk)
+    if len(chunks) < 2 or key in unique:
+        return None
+
+    workers = min(app.config['BULK_WORKERS'], len(unique))
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        found = dict(zip(unique, pool.map(exists, unique)))
+        new = [chunk_key for chunk_key in unique if not found[chunk_key]]
+        list(pool.map(lambda k: _put(k, unique[k]), new))
+
+    stored = sum(len(unique[chunk_key]) for chunk_key in new)
+    COUNTERS.add_chunked(len(data), stored)
+    log.info(
+        'Chunked paste',
+        key=key,
+        chunks=len(entries),
+        new=len(new),
+        stored=stored
+    )
+    return chunking.manifest(entries)
+
+
+def _put(key, data, compress=True):
+    """Upload an object, then cache it locally.
+
+    :param key: index item.
+    :type key: str
+    :param data: Object content.
+    :type data: bytes
+    :param compress: Compress the content with CONTENT_COMPRESSION.
+    :type compress: bool
+    """
+    if compress:
+        encoded_content, content_encoding = codec.compress(
+            data,
+            app.config['CONTENT_COMPRESSION'],
+            level=app.config['CONTENT_COMPRESSION_LEVEL'],
+            min_size=app.config['CONTENT_COMPRESSION_MIN_SIZE']
+        )
     else:
-        log.info('Read object from cache', key=key)
-        return content.decode("utf-8")
+        encoded_content, content_encoding = data, None
+    if app.config['WRITE_BEHIND']:
+        uploads.JOURNAL.add(key, encoded_content)
+        uploads.UPLOADER.start()
+        uploads.UPLOADER.wake()
+        log.info('Journaled paste for upload', key=key)
+    else:
+        try:
+            cdn.upload(
+                key=key,
+                content=encoded_content,
+                content_encoding=content_encoding
+            )
+        except exceptions.ServiceUnavailable:
+            raise
+        except Exception as e:
+            log.error('CDN upload failed: %s' % e, key=key)
+            raise exceptions.ServiceUnavailable('Storage is unavailable')
+        log.info('Wrote paste to CDN', key=key, encoding=content_encoding)
+    log.info('new object cached', key=key)
+    cache_set(key, encoded_content)
+    KNOWN_KEYS.add(key)
+    COUNTERS.add(1, len(encoded_content))
+    memory.MISSING.discard(key)
 
 
+@metrics.timed('write')
 def write(content, backend, truncate=None):
     """Write the content to a backend, and get a URL for it.
 
@@ -108,62 +1038,65 @@ def write(content, backend, truncate=None):
     :type truncate: int
     :returns: str
     """
-    key = hashlib.sha1(content.encode('utf-8')).hexdigest()
-    if truncate:
-        key = key[:truncate]
-
-    if read(key):
+    key = _key(content, truncate=truncate)
+    if exists(key):
         return key, local_url(key=key, backend=backend), False
 
-    encoded_content = content.encode('utf-8')
-    cdn.upload(key=key, content=encoded_content)
-    log.info('Wrote paste to CDN', key=key)
-    with LocalCache() as c:
-        log.info('new object cached', key=key)
-        c.set(
-            key,
-            encoded_content,
-            expire=150
-        )
-
+    _store(key, content)
     return key, local_url(key=key, backend=backend), True
 
 
-def count(container=None):
-    """Read the content from the CDN.
+@metrics.timed('write_many')
+def write_many(contents, backend, truncate=None):
+    """Write many contents to a backend, and get a URL for each of them.
 
-    :param container: Name of the CDN container to count.
-    :type container: str
-    :returns: int
+    Contents are deduplicated by key. The existence of every unique key is
+    checked, and the new contents stored, concurrently on a pool of at most
+    BULK_WORKERS threads.
+
+    :param contents: list of data.
+    :type contents: list
+    :param truncate: number of charactors to slice from the keys.
+    :type truncate: int
+    :returns: list of (key, url, created) tuples, in the order of contents
     """
-    with LocalCache() as c:
-        object_count = c.get(b'object_count')
-        if not object_count:
-            log.info('No valid count object cached.')
-        else:
-            log.info('Cached object returned, count: %s.' % object_count)
+    keys = [_key(content, truncate=truncate) for content in contents]
+    unique = dict()
+    for key, content in zip(keys, contents):
+        unique.setdefault(key, content)
+    if not unique:
+        return []
 
-        total_size = c.get(b'total_size')
-        if not total_size:
-            log.info('No valid size object cached.')
-        else:
-            log.info('Cached object returned, size: %s.' % total_size)
+    workers = min(app.config['BULK_WORKERS'], len(unique))
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        found = dict(zip(unique, pool.map(exists, unique)))
+        new = [key for key in unique if not found[key]]
+        list(pool.map(lambda key: _store(key, unique[key]), new))
+    log.info('Wrote batch', items=len(contents), new=len(new))
 
-        if not all([object_count, total_size]):
-            object_count, total_size = cdn.count(container=container)
+    written = []
+    created = set(new)
+    for key in keys:
+        written.append((
+            key,
+            local_url(key=key, backend=backend),
+            key in created
+        ))
+        created.discard(key)
+    return written
 
-            log.info('Count object cached')
-            c.set(
-                b'object_count',
-                object_count,
-                expire=900
-            )
 
-            log.info('Size object cached')
-            c.set(
-                b'total_size',
-                total_size,
-                expire=900
-            )
+@metrics.timed('count')
+def count(container=None):
+    """Return the object count and total size of the CDN container.
 
+    Counters are served from memory and never block on the CDN, see
+    ObjectCounters.
+
+    :param container: Name of the CDN container to count.
+    :type container: str
+    :returns: tuple
+    """
+    object_count, total_size = COUNTERS.get()
+    log.debug('Object counters', count=object_count, size=total_size)
     return object_count, total_size
@@ -0,0 +1,193 @@
+import collections
+import functools
+import os
+import threading
+import time
+
+from pasted import app
+from pasted import exceptions
+from pasted import log
+
+
+class CircuitBreaker(object):
+    """Circuit breaker guarding one provider operation.
+
+    After CDN_BREAKER_FAILURE_THRESHOLD consecutive failures the breaker
+    opens and calls fail fast with CircuitOpen. Once CDN_BREAKER_RESET_TIMEOUT
+    seconds have passed a single trial call is let through, half open, and
+    its outcome closes or reopens the breaker. State transitions are counted
+    for the metrics endpoint.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        """Initialization method for class.
+
+        :param name: Name of the guarded operation.
+        :type name: str
+        :param failure_threshold: Consecutive failures opening the breaker.
+        :type failure_threshold: int
+        :param reset_timeout: Seconds the breaker stays open.
+        :type reset_timeout: int
+        """
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.transitions = collections.Counter()
+        self.reset()
+
+    def reset(self):
+        """Close the breaker."""
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._trial = False
+
+    @property
+    def failure_threshold(self):
+        if self._failure_threshold is None:
+            return app.config['CDN_BREAKER_FAILURE_THRESHOLD']
+        return self._failure_threshold
+
+    @property
+    def reset_timeout(self):
+        if self._reset_timeout is None:
+            return app.config['CDN_BREAKER_RESET_TIMEOUT']
+        return self._reset_timeout
+
+    def _transition(self, state):
+        if state != self.state:
+            log.warning(
+                'Circuit breaker state changed',
+                breaker=self.name,
+                old=self.state,
+                new=state
+            )
+            self.transitions[(self.state, state)] += 1
+            self.state = state
+
+    def allow(self):
+        """Check whether a call may go through.
+
+        :returns: bool
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            elif self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+                self._trial = False
+
+            # half open, let a single trial call through
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        """Record a successful call."""
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            self._transition(self.CLOSED)
+
+    def failure(self):
+        """Record a failed call."""
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if (
+                self.state == self.HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def call(self, func, *args, **kwargs):
+        """Call a function through the breaker.
+
+        :param func: Function to call.
+        :type func: callable
+        :returns: object
+        """
+        if not self.allow():
+            raise exceptions.CircuitOpen(
+                'Storage operation %s is unavailable' % self.name
+            )
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.failure()
+            raise
+        self.success()
+        return result
+
+    def stats(self):
+        """Return the breaker state and transition counters.
+
+        :returns: dict
+        """
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'transitions': dict(
+                ('%s_to_%s' % k, v) for k, v in self.transitions.items()
+            )
+        }
+
+
+_BREAKERS = dict()
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get(name):
+    """Return the process wide breaker of an operation.
+
+    :param name: Name of the guarded operation.
+    :type name: str
+    :returns: object
+    """
+    breaker = _BREAKERS.get(name)
+    if breaker is None:
+        with _BREAKERS_LOCK:
+            breaker = _BREAKERS.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def protect(name):
+    """Guard the decorated function with the breaker of an operation.
+
+    :param name: Name of the guarded operation.
+    :type name: str
+    """
+    def deco_protect(f):
+        @functools.wraps(f)
+        def f_protect(*args, **kwargs):
+            return get(name).call(f, *args, **kwargs)
+        return f_protect
+    return deco_protect
+
+
+def stats():
+    """Return the stats of every breaker.
+
+    :returns: dict
+    """
+    return dict((name, b.stats()) for name, b in list(_BREAKERS.items()))
+
+
+def reset():
+    """Close every breaker."""
+    for breaker in list(_BREAKERS.values()):
+        breaker.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset)
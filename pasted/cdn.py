@@ -1,15 +1,281 @@
+import concurrent.futures
+import datetime
+import fcntl
 import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
 import time
 
-from openstack import connection as os_conn
-
 from pasted import app
+from pasted import breaker
+from pasted import codec
 from pasted import log
 from pasted import exceptions
+from pasted import metrics
+
+
+class TokenCache(object):
+    """Host wide cache of OpenStack auth state.
+
+    The keystone auth state is stored as a file in the PASTE_DIR so every
+    worker process on a host can share a single token. Files are named from
+    a hash of the auth arguments and written atomically. A companion lock
+    file ensures only one process authenticates at a time.
+    """
+
+    def __init__(self, cache_path=None):
+        """Initialization method for class.
+
+        :param cache_path: Directory used to store auth state.
+        :type cache_path: str
+        """
+        self.cache_path = cache_path
+
+    def _path(self, key):
+        cache_path = self.cache_path or app.config['PASTE_DIR']
+        return os.path.join(cache_path, 'os-auth-%s.json' % key)
+
+    def load(self, key):
+        """Return a stored auth state.
+
+        :param key: Auth key.
+        :type key: str
+        :returns: str or None
+        """
+        try:
+            with open(self._path(key)) as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def save(self, key, state):
+        """Store an auth state.
 
+        :param key: Auth key.
+        :type key: str
+        :param state: Serialized auth state.
+        :type state: str
+        """
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(state)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            log.warning('Unable to store auth state: %s' % e)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def lock(self, key):
+        """Return an open file holding an exclusive lock for a key.
+
+        :param key: Auth key.
+        :type key: str
+        :returns: object
+        """
+        lock_file = open(self._path(key) + '.lock', 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+
+class ConnectionPool(object):
+    """Process wide pool of authenticated OpenStack connections.
+
+    One connection is kept per set of auth arguments and shared by every
+    thread in a worker. Tokens are refreshed before they expire and shared
+    with the other workers on the host through the TokenCache. Connections
+    are dropped in a forked child and rebuilt on first use.
+    """
 
-class OpenStack(object):
-    """Class for reusable OpenStack utility methods."""
+    def __init__(self, token_cache=None):
+        """Initialization method for class.
+
+        :param token_cache: Shared token store.
+        :type token_cache: TokenCache
+        """
+        self.token_cache = token_cache or TokenCache()
+        self.reset()
+
+    def reset(self):
+        """Forget all connections opened by a parent process."""
+        self._lock = threading.Lock()
+        self._conns = dict()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _key(verify, auth_args):
+        return hashlib.sha1(
+            json.dumps([verify, auth_args], sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    @staticmethod
+    def _expiring(auth_ref):
+        if auth_ref is None or auth_ref.expires is None:
+            return auth_ref is None
+
+        window = datetime.timedelta(
+            seconds=app.config['OS_TOKEN_REFRESH_WINDOW']
+        )
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return auth_ref.expires - window <= now
+
+    def get(self, verify, auth_args):
+        """Return an authenticated connection.
+
+        :param verify: Verify TLS certificates.
+        :type verify: bool
+        :param auth_args: OpenStack auth arguments.
+        :type auth_args: dict
+        :returns: object
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        key = self._key(verify, auth_args)
+        conn = self._conns.get(key)
+        if conn is None:
+            with self._lock:
+                conn = self._conns.get(key)
+                if conn is None:
+                    # openstacksdk is slow to import, load it on first use
+                    from openstack import connection as os_conn
+
+                    log.info('Creating OpenStack connection')
+                    conn = os_conn.Connection(verify=verify, **auth_args)
+                    self._conns[key] = conn
+
+        if self._expiring(conn.session.auth.auth_ref):
+            with self._lock:
+                self._authenticate(key, conn)
+        return conn
+
+    @metrics.timed('keystone_auth')
+    def _authenticate(self, key, conn):
+        auth = conn.session.auth
+        if not self._expiring(auth.auth_ref):
+            return
+
+        lock_file = self.token_cache.lock(key)
+        try:
+            state = self.token_cache.load(key)
+            if state:
+                auth.set_auth_state(state)
+                if not self._expiring(auth.auth_ref):
+                    log.info('Using shared OpenStack token')
+                    return
+
+            log.info('Authenticating OpenStack connection')
+            auth.invalidate()
+            auth.get_access(conn.session)
+            self.token_cache.save(key, auth.get_auth_state())
+        finally:
+            lock_file.close()
+
+    def close(self):
+        """Close all connections opened by this process."""
+        if self._pid != os.getpid():
+            return self.reset()
+
+        with self._lock:
+            conns, self._conns = self._conns, dict()
+        for conn in conns.values():
+            conn.close()
+
+
+CONNECTION_POOL = ConnectionPool()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=CONNECTION_POOL.reset)
+
+
+class Provider(object):
+    """Interface of a storage provider.
+
+    Providers store content addressed objects in a named container. Object
+    content is stored and returned as is, compressed content is recognised
+    by the codec module.
+    """
+
+    #: True when get returns real files which can be served with sendfile
+    serves_files = False
+
+    def __init__(self, container):
+        """Initialization method for class.
+
+        :param container: Name of the container to store objects in.
+        :type container: str
+        """
+        self.container = container or app.config['CDN_CONTAINER_NAME']
+
+    @classmethod
+    def load(cls):
+        """Import the libraries the provider needs ahead of first use."""
+
+    def put(self, key, content, content_encoding=None):
+        """Store an object and return its etag.
+
+        :param key: File object name.
+        :type key: str
+        :param content: File content.
+        :type content: bytes
+        :param content_encoding: Compression codec of the content.
+        :type content_encoding: str
+        :returns: str
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """Open an object for reading.
+
+        :param key: File object name.
+        :type key: str
+        :returns: tuple (file, size) or None
+        """
+        raise NotImplementedError
+
+    def head(self, key):
+        """Return object metadata.
+
+        The returned dict holds the "size" and "content_encoding" of the
+        object.
+
+        :param key: File object name.
+        :type key: str
+        :returns: dict or None
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Delete an object, missing objects are ignored.
+
+        :param key: File object name.
+        :type key: str
+        """
+        raise NotImplementedError
+
+    def count(self):
+        """Return the object count and size of the container.
+
+        The returned object is (<count>, <size>)
+            Size is returned in bytes.
+
+        :returns: tuple
+        """
+        raise NotImplementedError
+
+    def list(self):
+        """Return an iterator of object names in the container.
+
+        :returns: iterator
+        """
+        raise NotImplementedError
+
+
+class OpenStack(Provider):
+    """Provider storing objects in an OpenStack Swift container."""
 
     def __init__(self, container):
         """Initialization method for class.
@@ -18,7 +284,7 @@ class OpenStack(object):
         :type container: str
         """
 
-        self.container = container or app.config['CDN_CONTAINER_NAME']
+        super(OpenStack, self).__init__(container=container)
         self.os_auth_args = {
             'username': app.config['OS_USERNAME'],
             'password': app.config['OS_PASSWORD'],
@@ -36,30 +302,175 @@ class OpenStack(object):
             k: v for k, v in self.os_auth_args.items() if v is not None
         }
 
+    @classmethod
+    def load(cls):
+        """Import openstacksdk, it is slow to import."""
+        from openstack import connection  # noqa: F401
+        from openstack import exceptions  # noqa: F401
+
     @property
     def conn(self):
-        """Return an OpenStackSDK connection.
+        """Return a pooled OpenStackSDK connection.
 
         :returns: object
         """
-        return os_conn.Connection(verify=self.verify, **self.os_auth_args)
+        return CONNECTION_POOL.get(
+            verify=self.verify,
+            auth_args=self.os_auth_args
+        )
 
-    def object_upload(self, key, content):
-        """Upload content to a container and return its object.
+    def put(self, key, content, content_encoding=None):
+        """Upload content to a container and return its etag.
 
         :param key: File object name.
         :type key: str
         :param content: File content.
         :type content: str
-        :returns: object
+        :param content_encoding: Compression codec of the content, stored
+                                 as the object Content-Encoding.
+        :type content_encoding: str
+        :returns: str
         """
+        if len(content) > app.config['CDN_SEGMENT_THRESHOLD']:
+            return self._put_segmented(
+                key=key,
+                content=content,
+                content_encoding=content_encoding
+            )
+
+        headers = dict()
+        if content_encoding:
+            headers['content_encoding'] = content_encoding
         return self.conn.object_store.upload_object(
             container=self.container,
             name=key,
-            data=content
+            data=content,
+            **headers
         ).etag
 
-    def object_count(self):
+    def _put_segmented(self, key, content, content_encoding=None):
+        """Upload content as a Static Large Object.
+
+        The content is split into CDN_SEGMENT_SIZE segments uploaded
+        concurrently into the "<container>_segments" container, then a
+        manifest is published under the object name. Segments already
+        uploaded with the same checksum are skipped, so a failed upload
+        resumes where it stopped.
+
+        :param key: File object name.
+        :type key: str
+        :param content: File content.
+        :type content: bytes
+        :param content_encoding: Compression codec of the content.
+        :type content_encoding: str
+        :returns: str
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        segment_container = '%s_segments' % self.container
+        self.conn.object_store.create_container(name=segment_container)
+        segment_size = app.config['CDN_SEGMENT_SIZE']
+        segments = [
+            (segment_container, key, index, content[offset:offset + segment_size])
+            for index, offset in enumerate(
+                range(0, len(content), segment_size)
+            )
+        ]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=app.config['CDN_SEGMENT_WORKERS']
+        ) as executor:
+            manifest = list(
+                executor.map(lambda args: self._put_segment(*args), segments)
+            )
+
+        headers = {'Content-Type': 'application/octet-stream'}
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        r = self.conn.object_store.put(
+            '%s/%s' % (self.container, key),
+            params={'multipart-manifest': 'put'},
+            data=json.dumps(manifest),
+            headers=headers
+        )
+        log.info('Published large object', key=key, segments=len(manifest))
+        return r.headers.get('Etag')
+
+    def _put_segment(self, segment_container, key, index, segment):
+        name = '%s/%s/%08d' % (segment_container, key, index)
+        etag = hashlib.md5(segment).hexdigest()
+        r = self.conn.object_store.head(name, raise_exc=False)
+        if r.status_code != 200 or r.headers.get('Etag', '').strip('"') != etag:
+            self.conn.object_store.put(
+                name,
+                data=segment,
+                headers={'Etag': etag}
+            )
+        return {'path': '/' + name, 'etag': etag, 'size_bytes': len(segment)}
+
+    def get(self, key):
+        """Open an object for streaming.
+
+        :param key: File object name.
+        :type key: str
+        :returns: tuple (file, size) or None
+        """
+        r = self.conn.object_store.get(
+            '%s/%s' % (self.container, key),
+            stream=True,
+            raise_exc=False
+        )
+        if r.status_code == 404:
+            r.close()
+            return None
+        elif r.status_code >= 400:
+            r.close()
+            raise exceptions.ProviderError(
+                'Object read failed with status %s' % r.status_code
+            )
+        r.raw.decode_content = False
+        return r.raw, int(r.headers.get('Content-Length') or 0)
+
+    def head(self, key):
+        """Return object metadata.
+
+        :param key: File object name.
+        :type key: str
+        :returns: dict or None
+        """
+        from openstack import exceptions as os_exceptions
+
+        try:
+            obj = self.conn.object_store.get_object_metadata(
+                key,
+                container=self.container
+            )
+        except os_exceptions.NotFoundException:
+            return None
+        return {
+            'size': int(obj.content_length or 0),
+            'content_encoding': obj.content_encoding
+        }
+
+    def delete(self, key):
+        """Delete an object, missing objects are ignored.
+
+        Segments of large objects are deleted with their manifest.
+
+        :param key: File object name.
+        :type key: str
+        """
+        r = self.conn.object_store.delete(
+            '%s/%s' % (self.container, key),
+            params={'multipart-manifest': 'delete'},
+            raise_exc=False
+        )
+        if r.status_code >= 400 and r.status_code != 404:
+            raise exceptions.ProviderError(
+                'Object delete failed with status %s' % r.status_code
+            )
+
+    def count(self):
         """Return the object count and size of a given container.
 
         The returned object is (<count>, <size>)
@@ -67,32 +478,262 @@ class OpenStack(object):
 
         :returns: tuple
         """
-        container = self.conn.get_container(name=self.container)
+        container = self.conn.object_store.get_container_metadata(
+            self.container
+        )
         log.info('container information: %s' % container)
-        return int(container['X-Container-Object-Count']), int(container['X-Container-Bytes-Used'])
+        return int(container.object_count), int(container.bytes_used)
+
+    def list(self):
+        """Return an iterator of object names in the container.
 
+        :returns: iterator
+        """
+        for obj in self.conn.object_store.objects(self.container):
+            yield obj.name
+
+
+class LocalDirectory(Provider):
+    """Provider storing objects as files in a local sharded directory.
+
+    Objects are stored as <CDN_LOCAL_PATH>/<container>/<aa>/<bb>/<key>,
+    sharded on the first characters of the key. Writes go to a temporary
+    file which is renamed into place, so readers never see partial
+    objects.
+    """
+
+    serves_files = True
+
+    def __init__(self, container):
+        """Initialization method for class.
+
+        :param container: Name of the container directory.
+        :type container: str
+        """
+        super(LocalDirectory, self).__init__(container=container)
+        self.path = os.path.join(
+            os.path.expanduser(app.config['CDN_LOCAL_PATH']),
+            self.container
+        )
+
+    def _path(self, key):
+        if not key or key.startswith('.') or os.sep in key:
+            raise ValueError('Invalid object name: %s' % key)
+        return os.path.join(self.path, key[:2], key[2:4], key)
+
+    def put(self, key, content, content_encoding=None):
+        """Atomically write an object and return its etag.
+
+        :param key: File object name.
+        :type key: str
+        :param content: File content.
+        :type content: bytes
+        :param content_encoding: Compression codec of the content.
+        :type content_encoding: str
+        :returns: str
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.tmp-',
+            dir=os.path.dirname(path)
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return hashlib.md5(content).hexdigest()
+
+    def get(self, key):
+        """Open an object file.
+
+        :param key: File object name.
+        :type key: str
+        :returns: tuple (file, size) or None
+        """
+        try:
+            f = open(self._path(key), 'rb')
+        except FileNotFoundError:
+            return None
+        return f, os.fstat(f.fileno()).st_size
 
-@exceptions.retry(ExceptionToCheck=Exception)
-def upload(key, content, container=None):
+    def head(self, key):
+        """Return object metadata.
+
+        :param key: File object name.
+        :type key: str
+        :returns: dict or None
+        """
+        opened = self.get(key)
+        if opened is None:
+            return None
+
+        f, size = opened
+        with f:
+            content_encoding = codec.sniff(f.read(4))
+        return {'size': size, 'content_encoding': content_encoding}
+
+    def delete(self, key):
+        """Delete an object, missing objects are ignored.
+
+        :param key: File object name.
+        :type key: str
+        """
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _walk(self):
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.startswith('.'):
+                    yield os.path.join(root, name)
+
+    def count(self):
+        """Return the object count and size of the container.
+
+        :returns: tuple
+        """
+        object_count = total_size = 0
+        for path in self._walk():
+            try:
+                total_size += os.stat(path).st_size
+            except FileNotFoundError:
+                continue
+            object_count += 1
+        return object_count, total_size
+
+    def list(self):
+        """Return an iterator of object names in the container.
+
+        :returns: iterator
+        """
+        for path in self._walk():
+            yield os.path.basename(path)
+
+
+PROVIDERS = {
+    'openstack': OpenStack,
+    'local': LocalDirectory
+}
+
+
+def load_provider():
+    """Import the libraries of the configured storage provider."""
+    provider_class = PROVIDERS.get(app.config['CDN_PROVIDER'])
+    if provider_class is not None:
+        provider_class.load()
+
+
+def provider(container=None):
+    """Return the configured storage provider.
+
+    :param container: Name of the container.
+    :type container: str
+    :returns: object
+    """
+    try:
+        provider_class = PROVIDERS[app.config['CDN_PROVIDER']]
+    except KeyError:
+        raise exceptions.ProviderError(
+            'Unknown CDN_PROVIDER: %s' % app.config['CDN_PROVIDER']
+        )
+    return provider_class(container=container)
+
+
+@metrics.timed('cdn_upload')
+@breaker.protect('cdn.upload')
+@exceptions.retry(
+    ExceptionToCheck=Exception,
+    delay=0.2,
+    backoff=2,
+    jitter=True,
+    max_delay=2
+)
+def upload(key, content, container=None, content_encoding=None):
     """Upload content to a CDN provider.
 
     :param key: File object name.
     :type key: str
     :param content: File content.
     :type content: str or bytes
+    :param content_encoding: Compression codec of the content.
+    :type content_encoding: str
     :returns: str
     """
-    if app.config['CDN_PROVIDER'] == 'openstack':
-        cdn_provider = OpenStack(container=container)
-        return cdn_provider.object_upload(key=key, content=content)
+    return provider(container=container).put(
+        key=key,
+        content=content,
+        content_encoding=content_encoding
+    )
+
 
+@metrics.timed('cdn_get')
+@breaker.protect('cdn.fetch')
+def fetch(key, container=None):
+    """Open content stored in a CDN provider.
 
-@exceptions.retry(ExceptionToCheck=Exception)
+    :param key: File object name.
+    :type key: str
+    :returns: tuple (file, size) or None
+    """
+    return provider(container=container).get(key=key)
+
+
+@metrics.timed('cdn_head')
+@breaker.protect('cdn.head')
+def head(key, container=None):
+    """Return metadata of content stored in a CDN provider.
+
+    :param key: File object name.
+    :type key: str
+    :returns: dict or None
+    """
+    return provider(container=container).head(key=key)
+
+
+@breaker.protect('cdn.delete')
+def delete(key, container=None):
+    """Delete content from a CDN provider.
+
+    :param key: File object name.
+    :type key: str
+    """
+    return provider(container=container).delete(key=key)
+
+
+@metrics.timed('cdn_count')
+@breaker.protect('cdn.count')
+@exceptions.retry(
+    ExceptionToCheck=Exception,
+    delay=0.2,
+    backoff=2,
+    jitter=True,
+    max_delay=2
+)
 def count(container=None):
     """Count uploaded content to a CDN provider.
 
     :returns: int
     """
-    if app.config['CDN_PROVIDER'] == 'openstack':
-        cdn_provider = OpenStack(container=container)
-        return cdn_provider.object_count()
+    return provider(container=container).count()
+
+
+def list_objects(container=None):
+    """List uploaded content in a CDN provider.
+
+    :returns: iterator
+    """
+    return provider(container=container).list()
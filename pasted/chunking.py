@@ -0,0 +1,285 @@
+import bisect
+import concurrent.futures
+import hashlib
+import io
+import zlib
+
+
+# Manifests start with a byte which cannot start valid UTF-8, nor a
+# compressed object, so they are recognised by their first bytes alone.
+MAGIC = b'\xffpasted-chunks 1\n'
+
+# Bytes hashed before each candidate boundary
+WINDOW = 48
+
+# Random values of every byte for the gear hash of runs without line ends
+GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([b])).digest()[:4], 'little')
+    for b in range(256)
+]
+
+
+def _cut(data, start, minimum, average, maximum):
+    """Return the end of the chunk starting at an offset.
+
+    Boundaries are only placed at line ends, past the minimum chunk size,
+    after a line whose trailing window of bytes hashes below a threshold
+    proportional to the length of the line. The decision only depends on
+    the content around the boundary so an edit only moves the boundaries
+    next to it, and chunks average the requested size whatever the line
+    length is. Without a boundary the chunk is cut at the last line end
+    before the maximum size. Runs without line ends, such as minified
+    documents, are cut at a byte boundary found by _cut_bytes, or at the
+    maximum size.
+    """
+    end = len(data)
+    limit = min(start + maximum, end)
+    position = start + minimum
+    if position >= limit:
+        return limit
+
+    scale = (1 << 32) // max(average - minimum, 1)
+    line_start = data.rfind(b'\n', start, position) + 1 or start
+    while True:
+        newline = data.find(b'\n', position, limit)
+        if newline == -1:
+            break
+        position = newline + 1
+        window = data[max(position - WINDOW, 0):position]
+        if zlib.crc32(window) < (position - line_start) * scale:
+            return position
+        line_start = position
+
+    if limit == end:
+        return end
+
+    newline = data.rfind(b'\n', start + minimum, limit)
+    if newline != -1:
+        return newline + 1
+
+    cut = _cut_bytes(data, start + minimum, limit, average - minimum)
+    if cut is not None:
+        return cut
+    # never split a multibyte character, every chunk stays valid UTF-8
+    while limit > start + minimum and data[limit] & 0xC0 == 0x80:
+        limit -= 1
+    return limit
+
+
+def _cut_bytes(data, position, limit, distance):
+    """Return a content-defined boundary at any byte, or None.
+
+    A gear hash rolls over the bytes, each byte shifts the hash left so its
+    top bits only depend on the last 32 bytes. A boundary is placed where
+    the top bits are all zero, which happens every distance bytes on
+    average. Boundaries are never placed inside a multibyte character.
+    """
+    bits = max(distance.bit_length() - 1, 1)
+    shift = 32 - bits
+    gear = GEAR
+    h = 0
+    # warm the hash up with the bytes before the first candidate
+    for b in data[max(position - 32, 0):position]:
+        h = ((h << 1) + gear[b]) & 0xFFFFFFFF
+    for b in data[position:limit]:
+        h = ((h << 1) + gear[b]) & 0xFFFFFFFF
+        position += 1
+        if not h >> shift and data[position] & 0xC0 != 0x80:
+            return position
+    return None
+
+
+def split(data, average, maximum):
+    """Split content into content-defined chunks.
+
+    :param data: UTF-8 encoded content.
+    :type data: bytes
+    :param average: Average chunk size in bytes.
+    :type average: int
+    :param maximum: Largest chunk size in bytes.
+    :type maximum: int
+    :returns: list of bytes
+    """
+    minimum = average // 4
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = _cut(data, start, minimum, average, maximum)
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+def key(chunk):
+    """Return the key of a chunk, the key of a paste of the same content.
+
+    :param chunk: Chunk content.
+    :type chunk: bytes
+    :returns: str
+    """
+    return hashlib.sha1(chunk).hexdigest()
+
+
+def manifest(entries):
+    """Return the manifest listing the chunks of a paste.
+
+    :param entries: list of (key, size) tuples, in content order.
+    :type entries: list
+    :returns: bytes
+    """
+    return MAGIC + ''.join(
+        '%s %d\n' % (chunk_key, size) for chunk_key, size in entries
+    ).encode('ascii')
+
+
+def is_manifest(head):
+    """Check whether stored content is a manifest.
+
+    :param head: Stored content or its first bytes.
+    :type head: bytes
+    :returns: bool
+    """
+    return head[:len(MAGIC)] == MAGIC
+
+
+def parse(data):
+    """Return the chunks listed by a manifest.
+
+    :param data: Manifest content.
+    :type data: bytes
+    :returns: list of (key, size) tuples
+    """
+    entries = []
+    for line in data[len(MAGIC):].decode('ascii').splitlines():
+        chunk_key, size = line.split(' ')
+        entries.append((chunk_key, int(size)))
+    return entries
+
+
+class ChunkedFile(io.RawIOBase):
+    """Readable and seekable view of the content of a chunked paste.
+
+    Chunks are opened one at a time when the read reaches them. The chunks
+    following the one being read are loaded ahead of time on a small thread
+    pool, so a cold read does not wait on every chunk in turn.
+    """
+
+    def __init__(self, entries, open_chunk, load_chunk=None, readahead=0):
+        """Initialization method for class.
+
+        :param entries: list of (key, size) tuples, see parse.
+        :type entries: list
+        :param open_chunk: Callable returning a readable file of the
+                           decompressed content of a chunk key.
+        :type open_chunk: callable
+        :param load_chunk: Callable making a chunk key ready to be opened.
+        :type load_chunk: callable
+        :param readahead: Number of chunks loaded ahead of the read.
+        :type readahead: int
+        """
+        super(ChunkedFile, self).__init__()
+        self.entries = entries
+        self.open_chunk = open_chunk
+        self.load_chunk = load_chunk
+        self.readahead = readahead if load_chunk else 0
+        self.offsets = [0]
+        for _, size in entries:
+            self.offsets.append(self.offsets[-1] + size)
+        self.size = self.offsets[-1]
+        self._position = 0
+        self._index = None
+        self._chunk = None
+        self._pool = None
+        self._loading = dict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('Negative seek position %d' % offset)
+        if offset != self._position:
+            self._close_chunk()
+            self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self._position
+        parts = []
+        while size > 0 and self._position < self.size:
+            if self._chunk is None:
+                index = bisect.bisect_right(self.offsets, self._position) - 1
+                self._open(index)
+            data = self._chunk.read(size)
+            if not data:
+                raise IOError(
+                    'Chunk %s is shorter than its manifest entry'
+                    % self.entries[self._index][0]
+                )
+            parts.append(data)
+            size -= len(data)
+            self._position += len(data)
+            if self._position >= self.offsets[self._index + 1]:
+                self._close_chunk()
+        return b''.join(parts)
+
+    def readall(self):
+        return self.read()
+
+    def _open(self, index):
+        self._prefetch(index)
+        loading = self._loading.pop(index, None)
+        if loading is not None:
+            concurrent.futures.wait([loading])
+        self._index = index
+        self._chunk = self.open_chunk(self.entries[index][0])
+        # decompressed chunks only read forward
+        skip = self._position - self.offsets[index]
+        while skip > 0:
+            skipped = len(self._chunk.read(min(skip, 64 * 1024)))
+            if not skipped:
+                break
+            skip -= skipped
+
+    def _prefetch(self, index):
+        if not self.readahead:
+            return
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                min(self.readahead, len(self.entries))
+            )
+        for ahead in range(index + 1, index + 1 + self.readahead):
+            if ahead < len(self.entries) and ahead not in self._loading:
+                self._loading[ahead] = self._pool.submit(
+                    self.load_chunk,
+                    self.entries[ahead][0]
+                )
+
+    def _close_chunk(self):
+        if self._chunk is not None:
+            self._chunk.close()
+        self._chunk = None
+        self._index = None
+
+    def close(self):
+        self._close_chunk()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        super(ChunkedFile, self).close()
@@ -0,0 +1,140 @@
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Pastes are UTF-8 text, none of these prefixes can start valid UTF-8 so
+# compressed content is recognised by its magic bytes alone.
+MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'zstd': b'\x28\xb5\x2f\xfd'
+}
+
+
+def available(codec):
+    """Check whether a codec can be used.
+
+    :param codec: Codec name.
+    :type codec: str
+    :returns: bool
+    """
+    if codec == 'gzip':
+        return True
+    elif codec == 'zstd':
+        return zstandard is not None
+    return False
+
+
+def sniff(data):
+    """Return the codec of stored content, None when uncompressed.
+
+    :param data: Stored content or its first bytes.
+    :type data: bytes
+    :returns: str or None
+    """
+    for codec, magic in MAGIC.items():
+        if data[:len(magic)] == magic:
+            return codec
+    return None
+
+
+def sniff_file(f):
+    """Return the codec of a stored file object, None when uncompressed.
+
+    :param f: Seekable binary file object.
+    :type f: object
+    :returns: str or None
+    """
+    position = f.tell()
+    head = f.read(4)
+    f.seek(position)
+    return sniff(head)
+
+
+def compress(data, codec, level=None, min_size=0):
+    """Compress content.
+
+    Content smaller than min_size, or that does not get smaller, is
+    returned uncompressed.
+
+    :param data: Content.
+    :type data: bytes
+    :param codec: Codec name, None disables compression.
+    :type codec: str
+    :param level: Compression level, None uses the codec default.
+    :type level: int
+    :param min_size: Smallest content size worth compressing.
+    :type min_size: int
+    :returns: tuple (bytes, codec)
+    """
+    if not codec or len(data) < min_size:
+        return data, None
+    elif not available(codec):
+        raise ValueError('Compression codec %s is not available' % codec)
+
+    if codec == 'gzip':
+        compressed = gzip.compress(
+            data,
+            compresslevel=6 if level is None else level,
+            mtime=0
+        )
+    else:
+        compressed = zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        ).compress(data)
+
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, codec
+
+
+def decompress(data):
+    """Return uncompressed content.
+
+    :param data: Stored content.
+    :type data: bytes
+    :returns: bytes
+    """
+    codec = sniff(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    elif codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+class _DecompressedFile(object):
+    """Readable decompressed view of a file, closing both on close."""
+
+    def __init__(self, reader, f):
+        self.reader = reader
+        self.f = f
+
+    def read(self, size=-1):
+        return self.reader.read(size)
+
+    def close(self):
+        self.reader.close()
+        self.f.close()
+
+
+def open_decompressed(f, codec):
+    """Wrap a stored file object in a streaming decompressor.
+
+    :param f: Binary file object.
+    :type f: object
+    :param codec: Codec of the stored content.
+    :type codec: str
+    :returns: object
+    """
+    if codec == 'gzip':
+        return _DecompressedFile(gzip.GzipFile(fileobj=f, mode='rb'), f)
+    elif codec == 'zstd':
+        return _DecompressedFile(
+            zstandard.ZstdDecompressor().stream_reader(f),
+            f
+        )
+    return f
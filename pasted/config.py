@@ -3,12 +3,137 @@ import uuid
 # Public CDN endpoint
 CDN_ENDPOINT = None
 
+# Keep-alive pool used for CDN reads. Pool connections is the number of
+# hosts kept, pool maxsize the number of connections kept per host.
+CDN_POOL_CONNECTIONS = 4
+CDN_POOL_MAXSIZE = 16
+# Timeouts, in seconds, for CDN reads
+CDN_CONNECT_TIMEOUT = 3.05
+CDN_READ_TIMEOUT = 10
+# Coalesce CDN fetches for the same key across all workers on a host using
+# a lock file in the PASTE_DIR. Fetches are always coalesced per process.
+CDN_FETCH_HOST_LOCK = False
+# Send a HEAD request to the CDN when writing a key missing from the local
+# known keys index. When disabled unknown keys are always uploaded.
+CDN_WRITE_HEAD_CHECK = True
+
 # Local temp directory
 PASTE_DIR = '/tmp/pasted'
 
-# String value of the CDN provider. Options: ["openstack"]
+# Cache tiers. Content keys are SHA-1 hashes of the content so cached entries
+# never go stale, TTLs only bound how long unused entries are kept. Set a TTL
+# to None to keep entries until they are evicted.
+# In-process memory tier, size in bytes per worker. 0 disables the tier.
+MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+MEMORY_CACHE_TTL = 3600
+# Rendered paste and link pages, size in bytes per worker. Pages are keyed
+# by their URL and the templates version. 0 disables the tier.
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+PAGE_CACHE_TTL = 3600
+# Local disk tier in the PASTE_DIR
+DISK_CACHE_TTL = 86400
+# Keys the CDN reported missing, kept in memory per worker
+NEGATIVE_CACHE_SIZE = 10000
+NEGATIVE_CACHE_TTL = 30
+
+# String value of the CDN provider. Options: ["openstack", "local"]
 CDN_PROVIDER = 'openstack'
 CDN_CONTAINER_NAME = 'pasted'
+# Content larger than the threshold, in bytes, is uploaded to OpenStack as a
+# Static Large Object made of segments uploaded concurrently
+CDN_SEGMENT_THRESHOLD = 32 * 1024 * 1024
+CDN_SEGMENT_SIZE = 8 * 1024 * 1024
+CDN_SEGMENT_WORKERS = 4
+# Circuit breakers guarding CDN operations. A breaker opens after the
+# threshold of consecutive failures and fails calls fast for the reset
+# timeout, in seconds, before letting a trial call through.
+CDN_BREAKER_FAILURE_THRESHOLD = 5
+CDN_BREAKER_RESET_TIMEOUT = 30
+# Root directory of the "local" provider. Without a CDN_ENDPOINT objects are
+# served straight from these files.
+CDN_LOCAL_PATH = '/var/lib/pasted'
+
+# Compression of stored paste content. Options: [None, "gzip", "zstd"],
+# "zstd" requires the zstandard package. Content smaller than the minimum
+# size is stored uncompressed.
+CONTENT_COMPRESSION = None
+CONTENT_COMPRESSION_LEVEL = None
+CONTENT_COMPRESSION_MIN_SIZE = 1024
+
+# Content-defined chunking of large pastes. Content of at least the minimum
+# size, in bytes, is split into chunks of about CHUNK_SIZE bytes, cut at line
+# ends chosen by a hash of their content, or at any byte within long runs
+# without line ends. Each chunk is stored once and the paste as a manifest of
+# its chunks, so near-identical pastes share storage. CHUNKING_MIN_SIZE must
+# exceed CHUNK_MAX_SIZE.
+CHUNKING = False
+CHUNKING_MIN_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+
+# Write-behind uploads. New content is journaled in the PASTE_DIR and the
+# request returns right away, background workers upload the journal to the
+# CDN in batches and retry failures with exponential backoff.
+WRITE_BEHIND = False
+UPLOAD_WORKERS = 4
+UPLOAD_BATCH_SIZE = 32
+UPLOAD_POLL_INTERVAL = 5
+UPLOAD_MAX_BACKOFF = 300
+
+# Threads running the WSGI views when served through pasted.asgi, CDN reads
+# wait on the event loop and do not hold one of these threads.
+ASGI_THREADS = 32
+
+# Highlight pastes server side with pygments instead of in the browser.
+# Highlighted HTML is rendered once per paste and kept in the disk cache.
+# Pastes larger than HIGHLIGHT_MAX_SIZE characters are shown as plain text,
+# the language is detected from the first HIGHLIGHT_DETECT_SIZE characters.
+HIGHLIGHT = False
+HIGHLIGHT_MAX_SIZE = 256 * 1024
+HIGHLIGHT_DETECT_SIZE = 8 * 1024
+HIGHLIGHT_STYLE = 'default'
+
+# Batch API. Most items accepted per request, and the number of threads
+# checking and uploading the items of a batch concurrently.
+BULK_MAX_ITEMS = 500
+BULK_WORKERS = 8
+
+# Per client rate limiting of the routes creating and reading content.
+# Limits are token buckets of (requests per second, burst), None disables
+# the limit of a group. Batch and multi-get requests cost one token per
+# item. Clients are identified by the RATE_LIMIT_KEY_HEADER header when it
+# holds one of the RATE_LIMIT_KEYS, or when the request comes from one of the
+# RATE_LIMIT_TRUSTED_PROXIES addresses, which set the header themselves.
+# Otherwise clients are identified by their address, so a client cannot
+# escape its limit by sending a new header value. Buckets are shared by
+# every worker on a host through a table of RATE_LIMIT_SLOTS slots in the
+# PASTE_DIR.
+RATE_LIMIT = False
+RATE_LIMIT_CREATE = (2, 60)
+RATE_LIMIT_READ = (50, 500)
+RATE_LIMIT_KEY_HEADER = None
+RATE_LIMIT_KEYS = ()
+RATE_LIMIT_TRUSTED_PROXIES = ()
+RATE_LIMIT_SLOTS = 65536
+
+# Chunk size, in bytes, used when streaming raw content
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Object count and size shown on the index page. Workers refresh their copy
+# from the PASTE_DIR every refresh interval, the counters are reconciled with
+# the CDN container every reconcile interval.
+STATS_REFRESH_INTERVAL = 5
+STATS_RECONCILE_INTERVAL = 900
+
+# Cache-Control max-age, in seconds, for content addressed raw responses
+IMMUTABLE_MAX_AGE = 31536000
+
+# Record per-request operation timings, add them to responses as a
+# Server-Timing header and expose them at /metrics in the Prometheus text
+# format. Metrics are kept per worker process and are not aggregated, each
+# scrape of /metrics only sees the worker which served it.
+METRICS_ENABLED = False
+SERVER_TIMING = True
 
 # Web analytics
 GOOGLE_ANALYTICS = None
@@ -28,6 +153,8 @@ OS_AUTH_URL = None
 OS_REGION_NAME = None
 OS_INSECURE = True  # Typically True when running with an 'internal' interface
 OS_INTERFACE = 'internal'  # This is normally 'internal' or 'public'
+# Seconds before expiry at which a pooled OpenStack token is renewed
+OS_TOKEN_REFRESH_WINDOW = 300
 
 # System options
 SESSION_COOKIE_SECURE=True
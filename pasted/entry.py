@@ -1,4 +1,8 @@
+import pasted
+
 from pasted import app
+from pasted import backend
+from pasted import uploads
 
 
 def start_app_debug():
@@ -6,4 +10,16 @@ def start_app_debug():
 
 
 def start_app_prod():
-    return app
+    application = pasted.create_app()
+    pasted.preload()
+    return application
+
+
+def rebuild_index():
+    with app.app_context():
+        backend.KNOWN_KEYS.rebuild()
+
+
+def drain_uploads():
+    with app.app_context():
+        uploads.UPLOADER.drain()
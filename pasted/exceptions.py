@@ -1,4 +1,5 @@
 import functools
+import random
 import time
 
 
@@ -30,7 +31,20 @@ class NotFound(ApiException):
     status_code = 404
 
 
-def retry(ExceptionToCheck, tries=3, delay=1, backoff=1):
+class ServiceUnavailable(ApiException):
+    status_code = 503
+
+
+class CircuitOpen(ServiceUnavailable):
+    """Raised when a circuit breaker rejects a storage operation."""
+
+
+class ProviderError(Exception):
+    """Raised when a storage provider fails or is misconfigured."""
+
+
+def retry(ExceptionToCheck, tries=3, delay=1, backoff=1, jitter=False,
+          max_delay=None):
     """Retry calling the decorated function using an exponential backoff.
 
     :param ExceptionToCheck: the exception to check. may be a tuple of
@@ -43,6 +57,11 @@ def retry(ExceptionToCheck, tries=3, delay=1, backoff=1):
     :param backoff: backoff multiplier e.g. value of 2 will double the
                     delay each retry
     :type backoff: int
+    :param jitter: sleep a random time between zero and the delay, spreading
+                   retries of concurrent callers
+    :type jitter: bool
+    :param max_delay: upper bound of the delay between retries in seconds
+    :type max_delay: int
     """
     def deco_retry(f):
         @functools.wraps(f)
@@ -52,7 +71,9 @@ def retry(ExceptionToCheck, tries=3, delay=1, backoff=1):
                 try:
                     return f(*args, **kwargs)
                 except ExceptionToCheck:
-                    time.sleep(mdelay)
+                    if max_delay is not None:
+                        mdelay = min(mdelay, max_delay)
+                    time.sleep(random.uniform(0, mdelay) if jitter else mdelay)
                     mtries -= 1
                     mdelay *= backoff
             return f(*args, **kwargs)
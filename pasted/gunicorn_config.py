@@ -0,0 +1,11 @@
+"""Gunicorn settings for serving pasted from preloaded workers.
+
+    gunicorn -c python:pasted.gunicorn_config 'pasted.entry:start_app_prod()'
+
+The application and the storage provider libraries are loaded once in the
+master and shared with the workers. Connection pools, cache handles and
+background threads are created lazily, so each worker opens its own after
+fork.
+"""
+
+preload_app = True
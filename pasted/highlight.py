@@ -0,0 +1,108 @@
+import functools
+
+try:
+    import pygments
+
+    from pygments import formatters
+    from pygments import lexers
+    from pygments import util as pygments_util
+except ImportError:
+    pygments = None
+
+from pasted import app
+from pasted import backend
+from pasted import log
+from pasted import metrics
+
+
+# Bump when the rendered markup changes, cached renderings are keyed by it
+VERSION = 1
+
+
+def available():
+    """Check whether server side highlighting can be used.
+
+    :returns: bool
+    """
+    return pygments is not None
+
+
+def enabled():
+    """Check whether pastes are highlighted server side.
+
+    :returns: bool
+    """
+    return bool(app.config['HIGHLIGHT']) and available()
+
+
+def _cache_key(key):
+    return '%s.highlight-%s-%s-%s' % (
+        key,
+        VERSION,
+        pygments.__version__,
+        app.config['HIGHLIGHT_STYLE']
+    )
+
+
+def detect(content):
+    """Return the lexer of the language of some content.
+
+    Only the start of the content is analysed, detection tries every known
+    lexer and its cost grows with the size of the sample.
+
+    :param content: Paste content.
+    :type content: str
+    :returns: object
+    """
+    sample = content[:app.config['HIGHLIGHT_DETECT_SIZE']]
+    try:
+        return lexers.guess_lexer(sample)
+    except pygments_util.ClassNotFound:
+        return lexers.TextLexer()
+
+
+@metrics.timed('highlight')
+def render(key, content):
+    """Return the highlighted HTML of a paste and its language.
+
+    Content is highlighted once per paste, the rendering is stored in the
+    local disk cache next to the content. Content larger than
+    HIGHLIGHT_MAX_SIZE is not highlighted.
+
+    :param key: index item.
+    :type key: str
+    :param content: Paste content.
+    :type content: str
+    :returns: tuple (html, language) or None
+    """
+    if not enabled() or len(content) > app.config['HIGHLIGHT_MAX_SIZE']:
+        return None
+
+    cache_key = _cache_key(key)
+    with backend.LocalCache() as c:
+        rendered = c.get(cache_key)
+    if rendered is not None:
+        return rendered
+
+    lexer = detect(content)
+    html = pygments.highlight(
+        content,
+        lexer,
+        formatters.HtmlFormatter(nowrap=True)
+    )
+    rendered = html, lexer.name
+    with backend.LocalCache() as c:
+        c.set(cache_key, rendered, expire=app.config['DISK_CACHE_TTL'])
+    log.info('Highlighted paste', key=key, language=lexer.name)
+    return rendered
+
+
+@functools.lru_cache(maxsize=None)
+def stylesheet():
+    """Return the stylesheet of highlighted pastes.
+
+    :returns: str
+    """
+    return formatters.HtmlFormatter(
+        style=app.config['HIGHLIGHT_STYLE']
+    ).get_style_defs('.highlight')
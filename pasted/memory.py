@@ -0,0 +1,221 @@
+import collections
+import os
+import threading
+import time
+
+from pasted import app
+
+
+class MemoryCache(object):
+    """Byte bounded in-process LRU cache with per entry expiry.
+
+    Entries are kept in least recently used order and evicted from the cold
+    end once the total size of the cached values exceeds the byte limit.
+    Values larger than the limit are never cached.
+    """
+
+    def __init__(self, max_bytes=None, ttl=None, setting='MEMORY_CACHE'):
+        """Initialization method for class.
+
+        :param max_bytes: Maximum total size of cached values.
+                          Defaults to the <setting>_MAX_BYTES config item.
+        :type max_bytes: int
+        :param ttl: Seconds an entry stays valid. Defaults to the
+                    <setting>_TTL config item, None never expires.
+        :type ttl: int
+        :param setting: Prefix of the config items holding the defaults.
+        :type setting: str
+        """
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._setting = setting
+        self.hits = self.misses = self.evictions = 0
+        self.reset()
+
+    def reset(self):
+        """Replace the lock, a forked child must not inherit a held lock."""
+        self._lock = threading.Lock()
+        if not hasattr(self, '_entries'):
+            self._entries = collections.OrderedDict()
+            self.size = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            return app.config[self._setting + '_MAX_BYTES']
+        return self._max_bytes
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return app.config[self._setting + '_TTL']
+        return self._ttl
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, stale=False):
+        """Return a cached value.
+
+        Expired entries stay cached until they are evicted, they are only
+        returned when stale values are requested.
+
+        :param key: Cache key.
+        :type key: str
+        :param stale: Return the value even when expired.
+        :type stale: bool
+        :returns: bytes or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            if (
+                not stale
+                and expires is not None
+                and expires <= time.monotonic()
+            ):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache a value.
+
+        :param key: Cache key.
+        :type key: str
+        :param value: Value to cache.
+        :type value: bytes
+        :param ttl: Seconds the entry stays valid, overrides the default.
+        :type ttl: int
+        """
+        max_bytes = self.max_bytes
+        if not max_bytes or len(value) > max_bytes:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (expires, value)
+            self.size += len(value)
+            while self.size > max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove a cached value.
+
+        :param key: Cache key.
+        :type key: str
+        """
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """Remove all cached values."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class NegativeCache(object):
+    """Entry bounded in-process cache of keys known to be missing.
+
+    Entries expire after a short TTL and the oldest entries are dropped once
+    the entry limit is reached.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        """Initialization method for class.
+
+        :param max_entries: Maximum number of keys. Defaults to
+                            NEGATIVE_CACHE_SIZE.
+        :type max_entries: int
+        :param ttl: Seconds a key stays cached. Defaults to
+                    NEGATIVE_CACHE_TTL.
+        :type ttl: int
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self.reset()
+
+    def reset(self):
+        """Replace the lock, a forked child must not inherit a held lock."""
+        self._lock = threading.Lock()
+
+    @property
+    def max_entries(self):
+        if self._max_entries is None:
+            return app.config['NEGATIVE_CACHE_SIZE']
+        return self._max_entries
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return app.config['NEGATIVE_CACHE_TTL']
+        return self._ttl
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        expires = self._entries.get(key)
+        if expires is None:
+            return False
+        elif expires <= time.monotonic():
+            self.discard(key)
+            return False
+        return True
+
+    def add(self, key):
+        """Remember a key as missing.
+
+        :param key: Cache key.
+        :type key: str
+        """
+        max_entries = self.max_entries
+        if not max_entries:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = time.monotonic() + self.ttl
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Forget a missing key.
+
+        :param key: Cache key.
+        :type key: str
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Forget all missing keys."""
+        with self._lock:
+            self._entries.clear()
+
+
+CONTENT = MemoryCache()
+PAGES = MemoryCache(setting='PAGE_CACHE')
+MISSING = NegativeCache()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=CONTENT.reset)
+    os.register_at_fork(after_in_child=PAGES.reset)
+    os.register_at_fork(after_in_child=MISSING.reset)
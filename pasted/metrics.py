@@ -0,0 +1,185 @@
+import bisect
+import collections
+import functools
+import os
+import threading
+import time
+
+import flask
+
+from pasted import app
+
+
+# Histogram buckets, in seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0
+)
+
+
+def enabled():
+    """Check whether timings are recorded.
+
+    :returns: bool
+    """
+    return app.config['METRICS_ENABLED']
+
+
+class Histogram(object):
+    """Cumulative bucket histogram of durations."""
+
+    def __init__(self, buckets=BUCKETS):
+        """Initialization method for class.
+
+        :param buckets: Upper bounds of the buckets in seconds.
+        :type buckets: tuple
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry(object):
+    """Process wide registry of duration histograms."""
+
+    def __init__(self):
+        """Initialization method for class."""
+        self.reset()
+
+    def reset(self):
+        """Drop every recorded sample."""
+        self._lock = threading.Lock()
+        self._histograms = collections.OrderedDict()
+
+    def observe(self, name, value, **labels):
+        """Record a duration.
+
+        :param name: Metric name.
+        :type name: str
+        :param value: Duration in seconds.
+        :type value: float
+        :param labels: Metric labels.
+        :type labels: dict
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self, gauges=None, counters=None):
+        """Render every metric in the Prometheus text format.
+
+        :param gauges: Extra gauge samples, a list of (name, labels, value).
+        :type gauges: list
+        :param counters: Extra counter samples, a list of
+                         (name, labels, value).
+        :type counters: list
+        :returns: str
+        """
+        lines = []
+        seen = set()
+        with self._lock:
+            histograms = list(self._histograms.items())
+        for (name, labels), histogram in histograms:
+            metric = 'pasted_%s_seconds' % name
+            if metric not in seen:
+                seen.add(metric)
+                lines.append('# TYPE %s histogram' % metric)
+            cumulative = 0
+            bounds = [repr(b) for b in histogram.buckets] + ['+Inf']
+            for bound, bucket_count in zip(bounds, histogram.counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (
+                    metric,
+                    _labels(labels + (('le', bound),)),
+                    cumulative
+                ))
+            lines.append('%s_sum%s %r' % (metric, _labels(labels), histogram.sum))
+            lines.append('%s_count%s %d' % (
+                metric,
+                _labels(labels),
+                histogram.count
+            ))
+
+        for kind, samples in (('gauge', gauges), ('counter', counters)):
+            for name, labels, value in samples or []:
+                metric = 'pasted_%s' % name
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append('# TYPE %s %s' % (metric, kind))
+                lines.append('%s%s %r' % (
+                    metric,
+                    _labels(tuple(sorted(labels.items()))),
+                    value
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels
+    )
+
+
+REGISTRY = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+def record(name, duration):
+    """Record an operation duration for the metrics and Server-Timing.
+
+    :param name: Operation name.
+    :type name: str
+    :param duration: Duration in seconds.
+    :type duration: float
+    """
+    REGISTRY.observe('operation_duration', duration, operation=name)
+    if flask.has_request_context():
+        timings = flask.g.setdefault('timings', collections.OrderedDict())
+        timings[name] = timings.get(name, 0.0) + duration
+
+
+def timed(name):
+    """Time the decorated function when metrics are enabled.
+
+    :param name: Operation name.
+    :type name: str
+    """
+    def deco_timed(f):
+        @functools.wraps(f)
+        def f_timed(*args, **kwargs):
+            if not app.config['METRICS_ENABLED']:
+                return f(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return f_timed
+    return deco_timed
+
+
+def server_timing(timings):
+    """Format timings as a Server-Timing header value.
+
+    :param timings: Durations in seconds keyed by operation name.
+    :type timings: dict
+    :returns: str
+    """
+    return ', '.join(
+        '%s;dur=%.3f' % (name, duration * 1000)
+        for name, duration in timings.items()
+    )
@@ -0,0 +1,237 @@
+import collections
+import fcntl
+import functools
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+import flask
+
+from pasted import app
+from pasted import exceptions
+from pasted import log
+
+
+# Bucket slot: client fingerprint, tokens left, time of the last update
+SLOT = struct.Struct('=Qdd')
+
+
+class BucketStore(object):
+    """Token buckets shared by every worker process on a host.
+
+    Buckets live in a fixed size table memory mapped from a file in the
+    PASTE_DIR. A client is hashed onto a pair of slots, the pair is locked
+    with a byte range lock on the file while its bucket is updated, so
+    taking a token costs a couple of system calls and never touches a
+    database. When both slots of a pair hold other clients the least
+    recently updated one is taken over, its client starts again with a full
+    bucket.
+    """
+
+    def __init__(self, cache_path=None):
+        """Set the Path of the table.
+        :param cache_path: Directory holding the table file.
+        :type cache_path: str
+        """
+        self.cache_path = cache_path
+        self.reset()
+
+    def reset(self):
+        """Forget the table mapped by a parent process."""
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._path = None
+        self._slots = 0
+        self._pid = os.getpid()
+
+    def _open(self, path, slots):
+        self.close()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * SLOT.size
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._map = mmap.mmap(fd, size)
+        self._fd = fd
+        self._path = path
+        self._slots = slots
+
+    def close(self):
+        """Unmap the table."""
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        self._fd = None
+        self._map = None
+        self._path = None
+
+    def take(self, name, rate, burst, cost=1, consume=True):
+        """Take tokens from the bucket of a client.
+
+        A request is admitted while the bucket holds enough tokens, or is
+        full, so requests costing more than the burst are admitted once the
+        bucket is full and leave it in debt.
+
+        :param name: Bucket name.
+        :type name: str
+        :param rate: Tokens added per second.
+        :type rate: float
+        :param burst: Bucket size.
+        :type burst: float
+        :param cost: Tokens taken by the request.
+        :type cost: int
+        :param consume: Take the tokens, False only checks the bucket.
+        :type consume: bool
+        :returns: float seconds to wait before retrying, 0 when admitted
+        """
+        fingerprint = int.from_bytes(
+            hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(),
+            'little'
+        ) or 1
+        path = os.path.join(
+            self.cache_path or app.config['PASTE_DIR'],
+            'ratelimit'
+        )
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self.reset()
+            slots = app.config['RATE_LIMIT_SLOTS']
+            if path != self._path or slots != self._slots:
+                self._open(path, slots)
+
+            pair = fingerprint % (self._slots // 2) * 2 * SLOT.size
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 2 * SLOT.size, pair)
+            try:
+                offset = pair
+                first = SLOT.unpack_from(self._map, offset)
+                second = SLOT.unpack_from(self._map, offset + SLOT.size)
+                if second[0] == fingerprint or (
+                    first[0] != fingerprint and second[2] < first[2]
+                ):
+                    offset += SLOT.size
+                    first = second
+                owner, tokens, updated = first
+
+                now = time.time()
+                if owner != fingerprint:
+                    tokens = burst
+                else:
+                    tokens = min(
+                        burst,
+                        tokens + max(now - updated, 0) * rate
+                    )
+
+                if tokens >= min(cost, burst):
+                    tokens -= cost
+                    wait = 0
+                else:
+                    wait = (min(cost, burst) - tokens) / rate
+                if consume:
+                    SLOT.pack_into(
+                        self._map,
+                        offset,
+                        fingerprint,
+                        tokens,
+                        now
+                    )
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 2 * SLOT.size, pair)
+        return wait
+
+
+BUCKETS = BucketStore()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=BUCKETS.reset)
+
+# Rejected requests per route group, counted per process
+REJECTED = collections.Counter()
+
+
+def client():
+    """Return the identity of the client of the current request.
+
+    The key header is only trusted when it holds a configured key, or was
+    set by a trusted proxy, any other value falls back to the address.
+
+    :returns: str
+    """
+    header = app.config['RATE_LIMIT_KEY_HEADER']
+    remote_addr = flask.request.remote_addr
+    if header:
+        api_key = flask.request.headers.get(header)
+        if api_key and (
+            api_key in app.config['RATE_LIMIT_KEYS']
+            or remote_addr in app.config['RATE_LIMIT_TRUSTED_PROXIES']
+        ):
+            return 'key:' + api_key
+    return 'addr:%s' % remote_addr
+
+
+def admits(group):
+    """Check whether a request would be admitted, without charging it.
+
+    :param group: Route group.
+    :type group: str
+    :returns: bool
+    """
+    if not app.config['RATE_LIMIT']:
+        return True
+
+    limit = app.config['RATE_LIMIT_' + group.upper()]
+    if not limit:
+        return True
+
+    rate, burst = limit
+    return not BUCKETS.take(
+        group + ' ' + client(),
+        rate,
+        burst,
+        consume=False
+    )
+
+
+def check(group, cost=1):
+    """Charge a request to the bucket of its client.
+
+    :param group: Route group, limited by the RATE_LIMIT_<GROUP> config item.
+    :type group: str
+    :param cost: Tokens taken by the request.
+    :type cost: int
+    """
+    if not app.config['RATE_LIMIT']:
+        return
+
+    limit = app.config['RATE_LIMIT_' + group.upper()]
+    if not limit:
+        return
+
+    rate, burst = limit
+    identity = client()
+    wait = BUCKETS.take(group + ' ' + identity, rate, burst, cost=cost)
+    if wait:
+        REJECTED[group] += 1
+        log.info('Rate limit exceeded', group=group, client=identity)
+        raise exceptions.RateLimitExceeded(
+            'Rate limit exceeded',
+            payload={'retry_after': max(int(math.ceil(wait)), 1)}
+        )
+
+
+def limited(group):
+    """Rate limit the decorated view, see check.
+
+    :param group: Route group.
+    :type group: str
+    """
+    def deco_limited(f):
+        @functools.wraps(f)
+        def f_limited(*args, **kwargs):
+            check(group)
+            return f(*args, **kwargs)
+        return f_limited
+    return deco_limited
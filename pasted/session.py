@@ -0,0 +1,131 @@
+import os
+import threading
+
+import requests
+
+from requests import adapters
+
+from pasted import app
+from pasted import log
+
+
+class SessionPool(object):
+    """Process wide keep-alive HTTP session used for CDN reads.
+
+    A single requests Session is shared by every thread in a worker so TCP
+    and TLS connections to the CDN are reused between requests. The session
+    is dropped in a forked child, sockets must not be shared with the
+    parent, and is rebuilt on first use.
+    """
+
+    def __init__(self):
+        """Initialization method for class."""
+        self.reset()
+
+    def reset(self):
+        """Forget the session opened by a parent process."""
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = os.getpid()
+
+    @property
+    def session(self):
+        """Return the shared session.
+
+        :returns: object
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        session = self._session
+        if session is None:
+            with self._lock:
+                session = self._session
+                if session is None:
+                    session = self._session = self._build()
+        return session
+
+    @staticmethod
+    def _build():
+        log.debug(
+            'Creating CDN session',
+            pool_connections=app.config['CDN_POOL_CONNECTIONS'],
+            pool_maxsize=app.config['CDN_POOL_MAXSIZE']
+        )
+        session = requests.Session()
+        adapter = adapters.HTTPAdapter(
+            pool_connections=app.config['CDN_POOL_CONNECTIONS'],
+            pool_maxsize=app.config['CDN_POOL_MAXSIZE'],
+            pool_block=False
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def timeout(self):
+        """Return the (connect, read) timeout tuple.
+
+        :returns: tuple
+        """
+        return (
+            app.config['CDN_CONNECT_TIMEOUT'],
+            app.config['CDN_READ_TIMEOUT']
+        )
+
+    def get(self, url, **kwargs):
+        """Issue a GET request through the shared session.
+
+        :param url: Remote URL.
+        :type url: str
+        :returns: object
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """Issue a HEAD request through the shared session.
+
+        :param url: Remote URL.
+        :type url: str
+        :returns: object
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.head(url, **kwargs)
+
+    def stats(self):
+        """Return connection reuse statistics for this process.
+
+        :returns: dict
+        """
+        connections = requests_made = 0
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for pool_key in pools.keys():
+                    pool = pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    connections += pool.num_connections
+                    requests_made += pool.num_requests
+        return {
+            'connections': connections,
+            'requests': requests_made,
+            'reused': max(requests_made - connections, 0)
+        }
+
+    def close(self):
+        """Close the session opened by this process."""
+        if self._pid != os.getpid():
+            return self.reset()
+
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+
+SESSION_POOL = SessionPool()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=SESSION_POOL.reset)
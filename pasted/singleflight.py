@@ -0,0 +1,96 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import threading
+
+
+class _Call(object):
+    """An in flight call shared by every caller of the same key."""
+
+    def __init__(self):
+        """Initialization method for class."""
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key within a process.
+
+    The first caller for a key runs the function, every other caller
+    arriving while it is in flight waits and shares its result, or its
+    exception.
+    """
+
+    def __init__(self):
+        """Initialization method for class."""
+        self.reset()
+
+    def reset(self):
+        """Forget calls in flight in a parent process."""
+        self._lock = threading.Lock()
+        self._calls = dict()
+
+    def do(self, key, func, *args, **kwargs):
+        """Run a function once for all concurrent callers of a key.
+
+        :param key: Coalescing key.
+        :type key: str
+        :param func: Function to run.
+        :type func: callable
+        :returns: object
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+
+@contextlib.contextmanager
+def host_lock(lock_path, key, stripes=256):
+    """Hold an exclusive lock for a key shared by processes on a host.
+
+    Keys are hashed onto a fixed number of lock files so the lock directory
+    never grows with the number of keys.
+
+    :param lock_path: Directory holding the lock files.
+    :type lock_path: str
+    :param key: Lock key.
+    :type key: str
+    :param stripes: Number of lock files.
+    :type stripes: int
+    """
+    if not os.path.isdir(lock_path):
+        os.makedirs(lock_path, exist_ok=True)
+
+    stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % stripes
+    with open(os.path.join(lock_path, 'fetch-%03d.lock' % stripe), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+FETCHES = SingleFlight()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=FETCHES.reset)
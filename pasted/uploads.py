@@ -0,0 +1,437 @@
+import atexit
+import concurrent.futures
+import contextlib
+import fcntl
+import os
+import random
+import tempfile
+import threading
+import time
+
+from pasted import app
+from pasted import breaker
+from pasted import cdn
+from pasted import codec
+from pasted import log
+
+
+# Prefix of the files holding the retry schedule of a journaled object
+RETRY_PREFIX = '.retry-'
+
+
+class Journal(object):
+    """Durable journal of content waiting to be uploaded to the CDN.
+
+    Every pending object is a file named after its key in the journal
+    directory of the PASTE_DIR, shared by all workers on a host. Files are
+    written atomically and removed once the upload is confirmed, so content
+    survives restarts and stays readable until it is in the CDN. An object
+    whose upload failed has a retry file next to it, holding the number of
+    attempts, whose modification time is the time of the next attempt, so
+    every worker follows the same backoff.
+    """
+
+    def __init__(self, path=None):
+        """Set the Path of the journal.
+        :param path: Journal directory.
+        :type path: str
+        """
+        self._path = path
+
+    @property
+    def path(self):
+        path = self._path or os.path.join(app.config['PASTE_DIR'], 'journal')
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    def _file(self, key):
+        return os.path.join(self.path, key)
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def __len__(self):
+        return len(self.pending())
+
+    def add(self, key, content):
+        """Atomically journal content.
+
+        :param key: index item.
+        :type key: str
+        :param content: Stored content.
+        :type content: bytes
+        """
+        path = self.path
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(path, key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def open(self, key):
+        """Open journaled content.
+
+        :param key: index item.
+        :type key: str
+        :returns: tuple (file, size) or None
+        """
+        try:
+            f = open(self._file(key), 'rb')
+        except FileNotFoundError:
+            return None
+        return f, os.fstat(f.fileno()).st_size
+
+    def _retry_file(self, key):
+        return os.path.join(self.path, RETRY_PREFIX + key)
+
+    def _scan(self):
+        entries = []
+        retries = dict()
+        with os.scandir(self.path) as it:
+            for entry in it:
+                try:
+                    if entry.name.startswith(RETRY_PREFIX):
+                        key = entry.name[len(RETRY_PREFIX):]
+                        retries[key] = entry.stat().st_mtime
+                    elif not entry.name.startswith('.'):
+                        entries.append((entry.stat().st_mtime, entry.name))
+                except FileNotFoundError:
+                    continue
+        return [name for _, name in sorted(entries)], retries
+
+    def pending(self):
+        """Return the journaled keys, oldest first.
+
+        :returns: list
+        """
+        return self._scan()[0]
+
+    def due(self):
+        """Return the journaled keys not waiting for a retry, oldest first.
+
+        :returns: list
+        """
+        now = time.time()
+        keys, retries = self._scan()
+        return [key for key in keys if retries.get(key, 0) <= now]
+
+    def retrying(self):
+        """Return the number of journaled keys waiting for a retry.
+
+        :returns: int
+        """
+        keys, retries = self._scan()
+        return sum(1 for key in keys if key in retries)
+
+    def is_due(self, key):
+        """Check whether a journaled object is not waiting for a retry.
+
+        :param key: index item.
+        :type key: str
+        :returns: bool
+        """
+        try:
+            return os.stat(self._retry_file(key)).st_mtime <= time.time()
+        except FileNotFoundError:
+            return True
+
+    def schedule_retry(self, key, backoff):
+        """Record a failed upload and the time of the next attempt.
+
+        Called with the object claimed, so a single worker updates its
+        retry file at a time.
+
+        :param key: index item.
+        :type key: str
+        :param backoff: Function returning the seconds to wait before the
+                        next attempt given the number of attempts.
+        :type backoff: function
+        :returns: tuple (attempts, delay)
+        """
+        path = self._retry_file(key)
+        try:
+            with open(path) as f:
+                attempts = int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            attempts = 0
+        attempts += 1
+        delay = backoff(attempts)
+        with open(path, 'w') as f:
+            f.write(str(attempts))
+        retry_at = time.time() + delay
+        os.utime(path, (retry_at, retry_at))
+        return attempts, delay
+
+    @contextlib.contextmanager
+    def claim(self, key):
+        """Lock a journaled object for upload.
+
+        Yields the open file, or None when the object is being uploaded by
+        another worker or was already uploaded.
+
+        :param key: index item.
+        :type key: str
+        """
+        path = self._file(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            yield None
+            return
+
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+
+            try:
+                # the file may have been uploaded and unlinked meanwhile
+                current = os.stat(path)
+            except FileNotFoundError:
+                yield None
+                return
+
+            if current.st_ino != os.fstat(f.fileno()).st_ino:
+                yield None
+            else:
+                yield f
+
+    def remove(self, key):
+        """Remove a journaled object.
+
+        :param key: index item.
+        :type key: str
+        """
+        for path in (self._file(key), self._retry_file(key)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class Uploader(object):
+    """Background pool draining the journal into the CDN.
+
+    A dispatcher thread takes batches of pending objects and uploads them
+    concurrently on UPLOAD_WORKERS threads. A batch only holds objects
+    claimed by this process, objects claimed by other workers are skipped
+    so the workers of a host share the journal. Failed uploads are retried
+    with exponential backoff and jitter, capped at UPLOAD_MAX_BACKOFF
+    seconds, on a schedule kept in the journal. Threads are started lazily,
+    after the worker process has forked.
+    """
+
+    def __init__(self, journal):
+        """Initialization method for class.
+
+        :param journal: Journal to drain.
+        :type journal: Journal
+        """
+        self.journal = journal
+        self.reset()
+
+    def reset(self):
+        """Forget threads and state inherited from a parent process."""
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._pid = os.getpid()
+        self._resumed = False
+        self.uploaded = self.failed = self.batches = 0
+        self.last_error = None
+
+    def start(self):
+        """Start the background threads if they are not running."""
+        if self._pid != os.getpid():
+            self.reset()
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=app.config['UPLOAD_WORKERS'],
+                thread_name_prefix='pasted-upload'
+            )
+            self._thread = threading.Thread(
+                target=self._run,
+                name='pasted-upload-dispatcher',
+                daemon=True
+            )
+            self._thread.start()
+
+    def resume(self):
+        """Start the background threads when content is left in the journal.
+
+        Content journaled before a restart is otherwise only uploaded once
+        the worker writes again. The journal is checked once per process.
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        if self._resumed:
+            return
+        self._resumed = True
+        if app.config['WRITE_BEHIND'] and self.journal.pending():
+            log.info('Resuming journaled uploads')
+            self.start()
+
+    def wake(self):
+        """Wake the dispatcher for newly journaled content."""
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        """Stop the background threads, pending content stays journaled.
+
+        :param timeout: Seconds to wait for in flight uploads.
+        :type timeout: int
+        """
+        if self._pid != os.getpid():
+            return self.reset()
+
+        self._stop.set()
+        self._wake.set()
+        thread, executor = self._thread, self._executor
+        if thread is not None:
+            thread.join(timeout)
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self._thread = self._executor = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch_size = app.config['UPLOAD_BATCH_SIZE']
+            try:
+                uploaded = self.drain_batch(batch_size, self._executor)
+            except Exception as e:
+                log.exception('Upload dispatcher failed: %s' % e)
+                uploaded = 0
+            if uploaded < batch_size:
+                self._wake.wait(app.config['UPLOAD_POLL_INTERVAL'])
+                self._wake.clear()
+
+    def drain_batch(self, batch_size, executor=None):
+        """Upload one batch of due journaled objects.
+
+        :param batch_size: Maximum number of objects in the batch.
+        :type batch_size: int
+        :param executor: Executor running uploads, None runs them inline.
+        :type executor: object
+        :returns: int number of objects claimed by the batch
+        """
+        with contextlib.ExitStack() as claims:
+            batch = []
+            for key in self.journal.due():
+                with contextlib.ExitStack() as claim:
+                    f = claim.enter_context(self.journal.claim(key))
+                    # another worker may have failed it since the scan
+                    if f is None or not self.journal.is_due(key):
+                        continue
+                    batch.append((key, f))
+                    claims.enter_context(claim.pop_all())
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                return 0
+
+            self.batches += 1
+            provider = cdn.provider()
+            if executor is None:
+                results = [self._upload(provider, *item) for item in batch]
+            else:
+                results = list(
+                    executor.map(
+                        lambda item: self._upload(provider, *item),
+                        batch
+                    )
+                )
+        log.info(
+            'Upload batch drained',
+            size=len(batch),
+            uploaded=sum(results)
+        )
+        return len(batch)
+
+    def drain(self):
+        """Upload every due journaled object in the calling thread.
+
+        :returns: int
+        """
+        total = 0
+        while True:
+            drained = self.drain_batch(app.config['UPLOAD_BATCH_SIZE'])
+            if not drained:
+                return total
+            total += drained
+
+    def _upload(self, provider, key, f):
+        content = f.read()
+        try:
+            breaker.get('cdn.upload').call(
+                provider.put,
+                key=key,
+                content=content,
+                content_encoding=codec.sniff(content)
+            )
+        except Exception as e:
+            self._backoff(key, e)
+            return False
+
+        self.journal.remove(key)
+        with self._lock:
+            self.uploaded += 1
+        log.info('Wrote journaled paste to CDN', key=key)
+        return True
+
+    def _backoff(self, key, error):
+        attempts, delay = self.journal.schedule_retry(
+            key,
+            lambda attempts: min(
+                app.config['UPLOAD_MAX_BACKOFF'],
+                2 ** attempts
+            ) * random.uniform(0.5, 1)
+        )
+        with self._lock:
+            self.failed += 1
+            self.last_error = str(error)
+        log.warning(
+            'Journaled upload failed: %s' % error,
+            key=key,
+            attempts=attempts,
+            retry_in=round(delay, 2)
+        )
+
+    def stats(self):
+        """Return upload statistics for this process.
+
+        :returns: dict
+        """
+        return {
+            'pending': len(self.journal),
+            'retrying': self.journal.retrying(),
+            'uploaded': self.uploaded,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_error': self.last_error
+        }
+
+
+JOURNAL = Journal()
+UPLOADER = Uploader(journal=JOURNAL)
+atexit.register(UPLOADER.stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=UPLOADER.reset)
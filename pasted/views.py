@@ -1,20 +1,34 @@
+import contextlib
+import functools
+import hashlib
 import os
 import time
 import json
 import urllib.parse as urlparse
+import uuid
 
 import flask
 
 import requests
 
+import werkzeug.wsgi
+
 from pasted import app
 from pasted import auto
 from pasted import backend
+from pasted import breaker
+from pasted import codec
 from pasted import csrf
 from pasted import decorators
 from pasted import exceptions
 from pasted import forms
+from pasted import highlight
 from pasted import log
+from pasted import memory
+from pasted import metrics
+from pasted import ratelimit
+from pasted import session
+from pasted import uploads
 
 CACHE_HEADERS = {
     'X-Frame-Options': 'SAMEORIGIN',
@@ -22,12 +36,194 @@ CACHE_HEADERS = {
 }
 
 
+def _immutable_cache_headers():
+    """Return the cache headers of raw content.
+
+    Raw content is addressed by its SHA-1, the body behind a URL never
+    changes.
+
+    :returns: dict
+    """
+    return {
+        'X-Frame-Options': 'SAMEORIGIN',
+        'Cache-Control': 'public, max-age=%s, immutable' % app.config[
+            'IMMUTABLE_MAX_AGE'
+        ]
+    }
+
+
+@app.before_request
+def _start_timer():
+    if metrics.enabled():
+        flask.g.request_started = time.perf_counter()
+
+
+@app.before_request
+def _resume_uploads():
+    uploads.UPLOADER.resume()
+
+
+@app.context_processor
+def _template_context():
+    return {'highlight_enabled': highlight.enabled()}
+
+
+@app.after_request
+def _record_timings(response):
+    started = flask.g.pop('request_started', None)
+    if started is None:
+        return response
+
+    duration = time.perf_counter() - started
+    metrics.REGISTRY.observe(
+        'request_duration',
+        duration,
+        endpoint=flask.request.endpoint or 'none',
+        method=flask.request.method,
+        status=response.status_code
+    )
+    if app.config['SERVER_TIMING']:
+        timings = flask.g.get('timings', {})
+        timings['total'] = duration
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+
+def _start_render(sender, template, context, **extra):
+    if metrics.enabled():
+        flask.g.render_started = time.perf_counter()
+
+
+def _record_render(sender, template, context, **extra):
+    started = flask.g.pop('render_started', None)
+    if started is not None:
+        metrics.record('render', time.perf_counter() - started)
+
+
+flask.before_render_template.connect(_start_render, app)
+flask.template_rendered.connect(_record_render, app)
+
+
 def _add_headers(headers_obj):
     for key, value in CACHE_HEADERS.items():
         headers_obj[key] = value
     return headers_obj
 
 
+@functools.lru_cache(maxsize=None)
+def _templates_version():
+    """Return a hash of every template shipped with the application.
+
+    The hash changes whenever a deploy changes any template or the way pastes
+    are highlighted, which invalidates ETags of rendered pages.
+
+    :returns: str
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((
+        highlight.enabled(),
+        app.config['HIGHLIGHT_STYLE'],
+        highlight.VERSION
+    )).encode('utf-8'))
+    template_path = os.path.join(app.root_path, app.template_folder)
+    for root, dirs, files in sorted(os.walk(template_path)):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode('utf-8'))
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def _raw_etag(pasted_id, content_encoding=None):
+    """Return the ETag of a raw representation.
+
+    Every content coding is a distinct representation with its own ETag.
+
+    :param pasted_id: ID number (sha1) of a valid paste
+    :type pasted_id: str
+    :param content_encoding: Content coding of the representation.
+    :type content_encoding: str
+    :returns: str
+    """
+    if content_encoding:
+        return '"%s-%s"' % (pasted_id, content_encoding)
+    return '"%s"' % pasted_id
+
+
+def _page_etag(pasted_id):
+    """Return the ETag of a rendered page, or None.
+
+    Pages carrying flashed messages vary per session and get no ETag.
+
+    :param pasted_id: ID number (sha1) of a valid paste
+    :type pasted_id: str
+    :returns: str or None
+    """
+    if '_flashes' in flask.session:
+        return None
+    return '"%s-%s"' % (pasted_id, _templates_version())
+
+
+def _not_modified(pasted_id, etags, headers):
+    """Return a 304 response when the request holds a matching ETag.
+
+    Content is addressed by its hash so a matching ETag is answered without
+    reading the content from any backend.
+
+    :param pasted_id: ID number (sha1) of a valid paste
+    :type pasted_id: str
+    :param etags: Quoted strong ETags of every representation.
+    :type etags: list
+    :param headers: Headers added to the response.
+    :type headers: dict
+    :returns: object or None
+    """
+    if not backend.valid_key(pasted_id):
+        return None
+
+    # "*" matches any existing representation, existence is not checked
+    # here so only explicit strong ETags are answered.
+    for etag in etags:
+        if etag and flask.request.if_none_match.is_strong(etag.strip('"')):
+            response = flask.make_response('', 304)
+            for key, value in headers.items():
+                response.headers[key] = value
+            response.headers['ETag'] = etag
+            return response
+
+
+def _page_response(etag, render):
+    """Return a rendered page, served from the page cache when possible.
+
+    Pages only depend on the immutable content, the URL and the templates, so
+    they are cached by their URL and ETag, which holds the templates version.
+    Pages without an ETag carry flashed messages and are never cached.
+
+    :param etag: ETag of the page, see _page_etag.
+    :type etag: str
+    :param render: Callable returning the rendered page.
+    :type render: callable
+    :returns: object
+    """
+    cache_key = None
+    body = None
+    if etag:
+        cache_key = '%s %s' % (etag, flask.request.url)
+        body = memory.PAGES.get(cache_key)
+
+    if body is None:
+        body = render().encode('utf-8')
+        if cache_key:
+            memory.PAGES.set(cache_key, body)
+
+    response = flask.make_response(body)
+    response.headers = _add_headers(response.headers)
+    if etag:
+        response.headers['ETag'] = etag
+    return response
+
+
 def _get_description(content, content_slice=48):
     try:
         first_line = content.splitlines()[0]
@@ -62,7 +258,8 @@ def index():
 
 
 @app.route('/api/pastes', methods=['POST'])
-@auto.doc()
+@auto.doc(set_location=False)
+@ratelimit.limited('create')
 def create_paste():
     """Create Pastes.
 
@@ -92,7 +289,8 @@ def create_paste():
 
 
 @app.route('/api/links', methods=['POST'])
-@auto.doc()
+@auto.doc(set_location=False)
+@ratelimit.limited('create')
 def create_links():
     """Create shortened links.
 
@@ -126,6 +324,168 @@ def create_links():
         return return_url, 201, return_headers
 
 
+def _batch_items(name, error):
+    """Return the list of items posted to a batch API.
+
+    :param name: JSON key holding the items.
+    :type name: str
+    :param error: Message of the error raised when items are missing.
+    :type error: str
+    :returns: list
+    """
+    try:
+        contents = flask.request.json[name]
+    except (KeyError, TypeError, ValueError):
+        raise exceptions.BadRequest(error)
+
+    if (
+        not isinstance(contents, list)
+        or not contents
+        or not all(isinstance(content, str) for content in contents)
+    ):
+        raise exceptions.BadRequest(error)
+    elif len(contents) > app.config['BULK_MAX_ITEMS']:
+        raise exceptions.BadRequest(
+            'Too many items, at most %s are accepted.' % (
+                app.config['BULK_MAX_ITEMS']
+            )
+        )
+    return contents
+
+
+def _batch_response(urls):
+    response = flask.jsonify(urls=urls)
+    response.status_code = 201
+    response.headers = _add_headers(response.headers)
+    return response
+
+
+@app.route('/api/pastes/batch', methods=['POST'])
+@auto.doc(set_location=False)
+def create_pastes_batch():
+    """Create many Pastes at once.
+
+    POST content must be in JSON format and contain the key "contents", a
+    list of at most BULK_MAX_ITEMS pastes.
+
+    > "{'contents': ['example', 'another example']}"
+
+    On success this API returns a JSON object holding the URL of every
+    paste, in the order they were posted.
+
+    > "{'urls': ['https://.../pastes/<pasted_id>.raw', ...]}"
+
+    :returns: str
+    """
+    request = flask.request
+    contents = _batch_items('contents', 'Missing paste contents.')
+    ratelimit.check('create', cost=len(contents))
+    written = backend.write_many(contents, backend='show_paste')
+    return _batch_response([
+        urlparse.urljoin(request.url, url) + '.raw' for _, url, _ in written
+    ])
+
+
+@app.route('/api/links/batch', methods=['POST'])
+@auto.doc(set_location=False)
+def create_links_batch():
+    """Create many shortened links at once.
+
+    POST content must be in JSON format and contain the key "contents", a
+    list of at most BULK_MAX_ITEMS URLs. Nothing is written when any of the
+    URLs is invalid.
+
+    > "{'contents': ['https://example.com', 'https://example.org']}"
+
+    On success this API returns a JSON object holding the short URL of every
+    link, in the order they were posted.
+
+    :returns: str
+    """
+    request = flask.request
+    contents = _batch_items('contents', 'Missing link contents.')
+    ratelimit.check('create', cost=len(contents))
+    for index, content in enumerate(contents):
+        valid_url = urlparse.urlparse(content)
+        if not (valid_url.scheme and valid_url.netloc):
+            raise exceptions.BadRequest(
+                'No valid URL provided',
+                payload={'index': index}
+            )
+
+    written = backend.write_many(contents, backend='show_link', truncate=16)
+    return _batch_response([
+        urlparse.urljoin(request.url, url) for _, url, _ in written
+    ])
+
+
+def _multipart_part(boundary, key, status, size):
+    # IDs are written into the part headers, only valid keys are written
+    content_id = ''
+    if backend.valid_key(key):
+        content_id = 'Content-ID: <%s>\r\n' % key
+    return (
+        '--%s\r\n'
+        '%s'
+        'Content-Type: text/plain; charset=utf-8\r\n'
+        'Content-Length: %d\r\n'
+        'X-Pasted-Status: %d\r\n'
+        '\r\n' % (boundary, content_id, size, status)
+    ).encode('latin-1')
+
+
+@app.route('/api/pastes/multi', methods=['POST'])
+@auto.doc(set_location=False)
+def read_pastes_multi():
+    """Read many Pastes in one request.
+
+    POST content must be in JSON format and contain the key "ids", a list of
+    at most BULK_MAX_ITEMS paste IDs.
+
+    > "{'ids': ['<pasted_id>', '<pasted_id>']}"
+
+    The raw content of every paste is streamed back, in the order of the
+    IDs, as a "multipart/mixed" response. Each part carries the paste ID in
+    its Content-ID header and an X-Pasted-Status header, 200 when found, 404
+    for missing pastes and 503 when the storage could not be read. Parts of
+    pastes which were not found have an empty body. IDs which are not a
+    SHA-1 prefix are reported as missing, without a Content-ID header.
+
+    :returns: str
+    """
+    ids = _batch_items('ids', 'Missing paste ids.')
+    ratelimit.check('read', cost=len(ids))
+    boundary = uuid.uuid4().hex
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+
+    def generate():
+        for key, opened in backend.open_many(ids):
+            if opened is None:
+                yield _multipart_part(boundary, key, 404, 0) + b'\r\n'
+                continue
+            elif isinstance(opened, exceptions.ServiceUnavailable):
+                yield _multipart_part(boundary, key, 503, 0) + b'\r\n'
+                continue
+
+            stream, size, content_encoding = opened
+            if content_encoding:
+                stream, size = backend.decode_stream(stream, content_encoding)
+            with contextlib.closing(stream):
+                yield _multipart_part(boundary, key, 200, size)
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield b'\r\n'
+        yield ('--%s--\r\n' % boundary).encode('latin-1')
+
+    return flask.Response(
+        flask.stream_with_context(generate()),
+        content_type='multipart/mixed; boundary=%s' % boundary
+    )
+
+
 @app.route('/info/tos')
 def show_tos():
     return flask.render_template(
@@ -164,6 +524,7 @@ def show_usage_api():
 def links_index():
     urlform = forms.UrlForm()
     if urlform.validate_on_submit():
+        ratelimit.check('create')
         key, url, created = backend.write(urlform.content.data, backend='show_link', truncate=16)
         if created:
             flask.flash('Link created', 'success')
@@ -190,33 +551,38 @@ def links_index():
 
 
 @app.route('/links/<pasted_id>')
+@ratelimit.limited('read')
 def show_link_data(pasted_id):
     request = flask.request
-    content = backend.read(pasted_id)
-    if content:
-        response = flask.make_response(
-            flask.render_template(
-                'return_link.html',
-                go_to_remote_url='/l/{}'.format(pasted_id),
+    etag = _page_etag(pasted_id)
+    not_modified = _not_modified(pasted_id, [etag], CACHE_HEADERS)
+    if not_modified:
+        return not_modified
+
+    def render():
+        content = backend.read(pasted_id)
+        if not content:
+            flask.abort(404)
+        return flask.render_template(
+            'return_link.html',
+            go_to_remote_url='/l/{}'.format(pasted_id),
+            content=content,
+            remote_url=urlparse.urljoin(
+                request.url_root,
+                backend.local_url(pasted_id, backend='show_link')
+            ),
+            pasted_page_description=_get_description(
                 content=content,
-                remote_url=urlparse.urljoin(
-                    request.url_root,
-                    backend.local_url(pasted_id, backend='show_link')
-                ),
-                pasted_page_description=_get_description(
-                    content=content,
-                    content_slice=256
-                )
+                content_slice=256
             )
         )
-        response.headers = _add_headers(response.headers)
-        return response
-    else:
-        flask.abort(404)
+
+    return _page_response(etag, render)
 
 
 @app.route('/l/<pasted_id>')
-@auto.doc()
+@auto.doc(set_location=False)
+@ratelimit.limited('read')
 def show_link(pasted_id):
     """Show or visit a shortened link.
 
@@ -249,6 +615,7 @@ def show_link(pasted_id):
 def pastes_index():
     pasteform = forms.PasteForm()
     if pasteform.validate_on_submit():
+        ratelimit.check('create')
         key, url, created = backend.write(pasteform.content.data, backend='show_paste')
         if created:
             flask.flash('Paste created', 'success')
@@ -278,50 +645,93 @@ def pastes_index():
 
 
 @app.route('/pastes/<pasted_id>')
+@ratelimit.limited('read')
 def show_paste(pasted_id):
     request = flask.request
-    content = backend.read(pasted_id)
-    if content:
-        response = flask.make_response(
-            flask.render_template(
-                'return_paste.html',
-                url=backend.local_url(pasted_id, backend='show_paste'),
-                content=content,
-                remote_url=request.url,
-                pasted_page_description=_get_description(content=content)
-            )
+    etag = _page_etag(pasted_id)
+    not_modified = _not_modified(pasted_id, [etag], CACHE_HEADERS)
+    if not_modified:
+        return not_modified
+
+    def render():
+        content = backend.read(pasted_id)
+        if not content:
+            flask.abort(404)
+        return flask.render_template(
+            'return_paste.html',
+            url=backend.local_url(pasted_id, backend='show_paste'),
+            content=content,
+            highlighted=highlight.render(pasted_id, content),
+            server_highlight=highlight.enabled(),
+            remote_url=request.url,
+            pasted_page_description=_get_description(content=content)
         )
-        response.headers = _add_headers(response.headers)
-        return response
 
-    else:
-        flask.abort(404)
+    return _page_response(etag, render)
 
 
 @app.route('/pastes/<pasted_id>.raw')
-@auto.doc()
+@auto.doc(set_location=False)
+@ratelimit.limited('read')
 def show_paste_raw(pasted_id):
     """Show the raw content of a paste.
 
     All requests will be forwarded to the CDN provider and any returned object
-    will be formatted as raw text encoded UTF-8.
+    will be formatted as raw text encoded UTF-8. Responses carry a strong ETag
+    derived from the paste ID and requests with a matching If-None-Match
+    header are answered with a 304. Content is streamed and byte ranges can
+    be requested with a Range header. Compressed content is sent as stored
+    to clients accepting its encoding.
 
     :param paste_id: ID number (sha1) of a valid paste
     :type paste_id: str
     :returns: str
     """
     request = flask.request
-    content = backend.read(pasted_id)
-    if content:
-        return_headers = {
-            'Content-Type': 'text/plain; charset="utf-8"',
-            'Location': urlparse.urljoin(
-                request.url_root,
-                backend.local_url(pasted_id, backend='show_paste')
-            )
-        }
-        return_headers.update(CACHE_HEADERS)
-        return content, 200, return_headers
+    not_modified = _not_modified(
+        pasted_id,
+        [_raw_etag(pasted_id, c) for c in (None,) + tuple(codec.MAGIC)],
+        _immutable_cache_headers()
+    )
+    if not_modified:
+        return not_modified
+
+    opened = backend.open_stream(pasted_id)
+    if opened:
+        stream, size, stored_encoding = opened
+        content_encoding = stored_encoding
+        if content_encoding and (
+            request.range
+            or not request.accept_encodings.quality(content_encoding)
+        ):
+            stream, size = backend.decode_stream(stream, content_encoding)
+            content_encoding = None
+
+        response = flask.Response(
+            werkzeug.wsgi.wrap_file(
+                request.environ,
+                stream,
+                buffer_size=app.config['STREAM_CHUNK_SIZE']
+            ),
+            direct_passthrough=True
+        )
+        response.headers['Content-Type'] = 'text/plain; charset="utf-8"'
+        response.headers['ETag'] = _raw_etag(pasted_id, content_encoding)
+        response.headers['Location'] = urlparse.urljoin(
+            request.url_root,
+            backend.local_url(pasted_id, backend='show_paste')
+        )
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+        if stored_encoding:
+            response.vary.add('Accept-Encoding')
+        for key, value in _immutable_cache_headers().items():
+            response.headers[key] = value
+        return response.make_conditional(
+            request,
+            accept_ranges=True,
+            complete_length=size
+        )
     else:
         flask.abort(404)
 
@@ -380,10 +790,103 @@ def handle_bad_request(error):
     return response
 
 
+@app.errorhandler(exceptions.ServiceUnavailable)
+def handle_service_unavailable(error):
+    response = flask.jsonify(error.to_dict())
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = app.config['CDN_BREAKER_RESET_TIMEOUT']
+    return response
+
+
 @app.errorhandler(exceptions.RateLimitExceeded)
 def handle_rate_limit_exceeded(error):
     response = flask.jsonify(error.to_dict())
     response.status_code = error.status_code
+    retry_after = (error.payload or {}).get('retry_after')
+    if retry_after:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+
+def _gauges():
+    gauges = []
+    for name, stats in breaker.stats().items():
+        gauges.append((
+            'breaker_open',
+            {'operation': name},
+            int(stats['state'] != 'closed')
+        ))
+    upload_stats = uploads.UPLOADER.stats()
+    for name in ('pending', 'retrying'):
+        gauges.append(('uploads_%s' % name, {}, upload_stats[name]))
+    chunked_size, chunked_stored_size = backend.COUNTERS.chunked()
+    if chunked_stored_size:
+        gauges.append((
+            'chunked_dedup_ratio',
+            {},
+            chunked_size / chunked_stored_size
+        ))
+    return gauges
+
+
+def _counters():
+    counters = []
+    for name, stats in breaker.stats().items():
+        for transition, value in stats['transitions'].items():
+            counters.append((
+                'breaker_transitions_total',
+                {'operation': name, 'transition': transition},
+                value
+            ))
+    for name, value in session.SESSION_POOL.stats().items():
+        counters.append(('cdn_session_%s_total' % name, {}, value))
+    for tier, cache in (('memory', memory.CONTENT), ('page', memory.PAGES)):
+        for name in ('hits', 'misses', 'evictions'):
+            counters.append((
+                '%s_cache_%s_total' % (tier, name),
+                {},
+                getattr(cache, name)
+            ))
+    upload_stats = uploads.UPLOADER.stats()
+    for name in ('uploaded', 'failed', 'batches'):
+        counters.append(('uploads_%s_total' % name, {}, upload_stats[name]))
+    for group, value in ratelimit.REJECTED.items():
+        counters.append(('ratelimit_rejected_total', {'group': group}, value))
+    chunked_size, chunked_stored_size = backend.COUNTERS.chunked()
+    counters.append(('chunked_bytes_total', {}, chunked_size))
+    counters.append(('chunked_stored_bytes_total', {}, chunked_stored_size))
+    return counters
+
+
+@app.route('/metrics')
+def show_metrics():
+    """Expose the metrics in the Prometheus text format.
+
+    Timings, cache, breaker, session, upload and rate limit metrics are kept
+    by each worker process and are not aggregated, a scrape only sees the
+    worker serving it. Scrape every worker, or run a single worker, for
+    complete numbers. Only the chunked bytes counters are shared by the
+    workers of a host.
+    """
+    if not metrics.enabled():
+        flask.abort(404)
+
+    response = flask.make_response(
+        metrics.REGISTRY.render(gauges=_gauges(), counters=_counters())
+    )
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route('/highlight.css')
+def show_highlight_css():
+    if not highlight.enabled():
+        flask.abort(404)
+
+    response = flask.make_response(highlight.stylesheet())
+    response.headers['Content-Type'] = 'text/css; charset=utf-8'
+    response.headers = _add_headers(response.headers)
     return response
 
 
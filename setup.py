@@ -17,6 +17,11 @@ setuptools.setup(
         'blinker',
         'openstacksdk'
     ],
+    extras_require={
+        'asgi': ['httpx>=0.23,<1'],
+        'highlight': ['pygments'],
+        'zstd': ['zstandard']
+    },
     classifiers = [
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Information Technology',
@@ -30,7 +35,9 @@ setuptools.setup(
     entry_points = {
         "console_scripts": [
             "pasted-debug = pasted.entry:start_app_debug",
-            "pasted-prod = pasted.entry:start_app_prod"
+            "pasted-prod = pasted.entry:start_app_prod",
+            "pasted-rebuild-index = pasted.entry:rebuild_index",
+            "pasted-drain-uploads = pasted.entry:drain_uploads"
         ]
     }
 )
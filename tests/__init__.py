@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+import unittest
+
+import pasted
+
+from pasted import backend
+from pasted import breaker
+from pasted import cdn
+from pasted import memory
+from pasted import session
+
+from tests import fake_openstack
+
+
+class PastedTestCase(unittest.TestCase):
+    """Run the app against a fresh PASTE_DIR and empty caches.
+
+    The app config is restored, and the pools and cache handles opened by a
+    test are closed, when the test ends.
+    """
+
+    def setUp(self):
+        self.paste_dir = tempfile.mkdtemp()
+        self.saved_config = dict(pasted.app.config)
+        pasted.app.config['PASTE_DIR'] = self.paste_dir
+        pasted.app.config['TESTING'] = True
+        breaker.reset()
+        memory.CONTENT.clear()
+        memory.PAGES.clear()
+        memory.MISSING.clear()
+        self.app = pasted.app.test_client()
+
+    def tearDown(self):
+        session.SESSION_POOL.close()
+        cdn.CONNECTION_POOL.close()
+        backend.CACHE_MANAGER.close()
+        pasted.app.config.clear()
+        pasted.app.config.update(self.saved_config)
+        shutil.rmtree(self.paste_dir)
+
+
+class FakeOpenStackTestCase(PastedTestCase):
+    """Store pastes in a fake OpenStack object store, see fake_openstack."""
+
+    def setUp(self):
+        self.fake = fake_openstack.FakeOpenStack().start()
+        super(FakeOpenStackTestCase, self).setUp()
+        pasted.app.config.update(self.fake.config())
+
+    def tearDown(self):
+        super(FakeOpenStackTestCase, self).tearDown()
+        self.fake.stop()
+
+
+class LocalProviderTestCase(PastedTestCase):
+    """Store pastes in a directory of the PASTE_DIR."""
+
+    def setUp(self):
+        super(LocalProviderTestCase, self).setUp()
+        pasted.app.config['CDN_PROVIDER'] = 'local'
+        pasted.app.config['CDN_LOCAL_PATH'] = self.paste_dir + '/objects'
+        pasted.app.config['CDN_ENDPOINT'] = None
@@ -0,0 +1,303 @@
+"""A local stand in for Keystone, Swift and the public CDN endpoint.
+
+The server keeps everything in memory and records the requests it
+receives, so tests can assert how many round trips the application made.
+"""
+
+import collections
+import datetime
+import hashlib
+import http.server
+import json
+import threading
+import time
+import urllib.parse as urlparse
+
+
+PROJECT_ID = 'fakeproject'
+
+
+class FakeOpenStack(object):
+    """Threaded HTTP server emulating Keystone v3, Swift and a CDN."""
+
+    def __init__(self, token_lifetime=3600, cdn_latency=0):
+        """Initialization method for class.
+
+        :param token_lifetime: Lifetime of issued tokens in seconds.
+        :type token_lifetime: int
+        :param cdn_latency: Delay of CDN endpoint responses in seconds.
+        :type cdn_latency: float
+        """
+        self.token_lifetime = token_lifetime
+        self.cdn_latency = cdn_latency
+        self.objects = dict()
+        self.tokens = set()
+        self.requests = collections.Counter()
+        self.fail = collections.Counter()
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(_Handler):
+            server_state = fake
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever,
+            daemon=True
+        )
+
+    @property
+    def auth_url(self):
+        return self.url + '/v3'
+
+    @property
+    def swift_url(self):
+        return '%s/v1/AUTH_%s' % (self.url, PROJECT_ID)
+
+    @property
+    def cdn_url(self):
+        return self.url + '/cdn/'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
+
+    def config(self):
+        """Return app config items pointing at this server.
+
+        :returns: dict
+        """
+        return {
+            'CDN_ENDPOINT': self.cdn_url,
+            'CDN_PROVIDER': 'openstack',
+            'CDN_CONTAINER_NAME': 'pasted',
+            'OS_USERNAME': 'demo',
+            'OS_PASSWORD': 'secret',
+            'OS_PROJECT_NAME': 'demo',
+            'OS_PROJECT_DOMAIN_NAME': 'Default',
+            'OS_USER_DOMAIN_NAME': 'Default',
+            'OS_AUTH_URL': self.auth_url,
+            'OS_REGION_NAME': 'RegionOne',
+            'OS_INTERFACE': 'public',
+        }
+
+    def issue_token(self):
+        token = hashlib.sha1(
+            str(len(self.tokens)).encode('utf-8')
+        ).hexdigest()
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def catalog(self):
+        return [{
+            'id': 'swift',
+            'name': 'swift',
+            'type': 'object-store',
+            'endpoints': [
+                {
+                    'id': 'swift-%s' % interface,
+                    'interface': interface,
+                    'region': 'RegionOne',
+                    'region_id': 'RegionOne',
+                    'url': self.swift_url
+                }
+                for interface in ('public', 'internal', 'admin')
+            ]
+        }]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_state = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+    def _send(self, status, body=b'', headers=None, head=False):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            headers = dict(headers or {})
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _route(self, method):
+        state = self.server_state
+        path = urlparse.urlparse(self.path).path
+        state.requests[method] += 1
+        if state.fail[method] > 0:
+            state.fail[method] -= 1
+            self._body()
+            return self._send(503, b'unavailable')
+
+        if path.rstrip('/') == '/v3' and method == 'GET':
+            return self._send(200, {
+                'version': {
+                    'id': 'v3.14',
+                    'status': 'stable',
+                    'updated': '2020-04-07T00:00:00Z',
+                    'links': [{'rel': 'self', 'href': state.auth_url + '/'}],
+                    'media-types': [{
+                        'base': 'application/json',
+                        'type': 'application/vnd.openstack.identity-v3+json'
+                    }]
+                }
+            })
+        elif path == '/v3/auth/tokens' and method == 'POST':
+            self._body()
+            state.requests['auth'] += 1
+            now = datetime.datetime.now(datetime.timezone.utc)
+            expires = now + datetime.timedelta(seconds=state.token_lifetime)
+            domain = {'id': 'default', 'name': 'Default'}
+            return self._send(201, {
+                'token': {
+                    'methods': ['password'],
+                    'issued_at': now.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+                    'expires_at': expires.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+                    'user': {'id': 'fakeuser', 'name': 'demo', 'domain': domain},
+                    'project': {'id': PROJECT_ID, 'name': 'demo', 'domain': domain},
+                    'roles': [{'id': 'member', 'name': 'member'}],
+                    'catalog': state.catalog()
+                }
+            }, headers={'X-Subject-Token': state.issue_token()})
+        elif path.startswith('/v1/'):
+            return self._swift(method, path)
+        elif path.startswith('/cdn/'):
+            return self._cdn(method, path)
+        return self._send(404, b'not found')
+
+    def _swift(self, method, path):
+        state = self.server_state
+        state.requests[('swift', method)] += 1
+        if self.headers.get('X-Auth-Token') not in state.tokens:
+            self._body()
+            return self._send(401, b'unauthorized')
+
+        parts = path.split('/', 4)[3:]
+        if len(parts) == 1:
+            container = parts[0]
+            objects = [
+                v for k, v in state.objects.items() if k[0] == container
+            ]
+            headers = {
+                'X-Container-Object-Count': str(len(objects)),
+                'X-Container-Bytes-Used': str(
+                    sum(len(v['data']) for v in objects)
+                )
+            }
+            if method == 'HEAD':
+                return self._send(204, headers=headers, head=True)
+            elif method == 'GET':
+                listing = sorted(
+                    k[1] for k in state.objects if k[0] == container
+                )
+                marker = urlparse.parse_qs(
+                    urlparse.urlparse(self.path).query
+                ).get('marker', [''])[0]
+                listing = [
+                    {'name': name} for name in listing if name > marker
+                ]
+                return self._send(200, listing, headers=headers)
+            elif method == 'PUT':
+                self._body()
+                return self._send(201)
+        elif len(parts) == 2:
+            key = tuple(parts)
+            query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+            manifest = query.get('multipart-manifest', [None])[0]
+            if method == 'PUT':
+                data = self._body()
+                segments = None
+                if manifest == 'put':
+                    segments = []
+                    for segment in json.loads(data.decode('utf-8')):
+                        seg_key = tuple(segment['path'].lstrip('/').split('/', 1))
+                        seg = state.objects.get(seg_key)
+                        if seg is None or seg['etag'] != segment['etag']:
+                            return self._send(400, b'bad manifest')
+                        segments.append(seg_key)
+                    data = b''.join(state.objects[k]['data'] for k in segments)
+                    state.requests['manifests'] += 1
+                expected = self.headers.get('Etag')
+                if expected and expected != hashlib.md5(data).hexdigest():
+                    return self._send(422, b'unprocessable')
+                headers = {
+                    k.title(): v for k, v in self.headers.items()
+                    if k.lower().startswith('x-object-meta-')
+                    or k.lower() in ('content-encoding', 'content-type')
+                }
+                etag = hashlib.md5(data).hexdigest()
+                state.objects[key] = {
+                    'data': data,
+                    'headers': headers,
+                    'etag': etag,
+                    'segments': segments
+                }
+                return self._send(201, headers={'Etag': etag})
+            obj = state.objects.get(key)
+            if obj is None:
+                return self._send(404, b'', head=method == 'HEAD')
+            if method in ('GET', 'HEAD'):
+                headers = dict(obj['headers'])
+                headers['Etag'] = obj['etag']
+                return self._send(
+                    200, obj['data'], headers=headers, head=method == 'HEAD'
+                )
+            elif method == 'DELETE':
+                state.objects.pop(key, None)
+                if manifest == 'delete':
+                    for seg_key in obj.get('segments') or []:
+                        state.objects.pop(seg_key, None)
+                return self._send(204)
+        return self._send(405, b'')
+
+    def _cdn(self, method, path):
+        state = self.server_state
+        state.requests[('cdn', method)] += 1
+        if state.cdn_latency:
+            time.sleep(state.cdn_latency)
+        key = ('pasted', path[len('/cdn/'):])
+        obj = state.objects.get(key)
+        if obj is None:
+            return self._send(404, b'not found', head=method == 'HEAD')
+        return self._send(
+            200, obj['data'], headers=dict(obj['headers']),
+            head=method == 'HEAD'
+        )
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_HEAD(self):
+        self._route('HEAD')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_DELETE(self):
+        self._route('DELETE')
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import unittest
+
+try:
+    import httpx
+
+    from pasted import asgi
+except ImportError:
+    asgi = None
+
+import pasted
+
+from pasted import backend
+from pasted import memory
+from pasted import ratelimit
+
+import tests
+
+
+@unittest.skipIf(asgi is None, 'httpx is not installed')
+class ASGITestCase(tests.FakeOpenStackTestCase):
+    def setUp(self):
+        super(ASGITestCase, self).setUp()
+        self.application = asgi.Application(pasted.app)
+
+    def requests(self, *requests):
+        """Issue requests concurrently and return their responses."""
+        async def issue():
+            transport = httpx.ASGITransport(app=self.application)
+            async with httpx.AsyncClient(
+                transport=transport,
+                base_url='http://localhost'
+            ) as client:
+                try:
+                    return await asyncio.gather(*[
+                        client.request(method, path, **kwargs)
+                        for method, path, kwargs in requests
+                    ])
+                finally:
+                    await self.application.fetcher.close()
+        return asyncio.run(issue())
+
+    def uncached_paste(self, content):
+        """Create a paste and drop it from the local caches."""
+        r = pasted.app.test_client().post(
+            '/api/pastes',
+            json={'content': content}
+        )
+        self.assertEqual(r.status_code, 201)
+        memory.CONTENT.clear()
+        with backend.LocalCache() as c:
+            c.clear()
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def test_streamed_response(self):
+        content = 'streamed line\n' * 20000
+        key = self.uncached_paste(content)
+        r, = self.requests(('GET', '/pastes/%s.raw' % key, {}))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.text, content)
+
+    def test_create_paste(self):
+        r, = self.requests(('POST', '/api/pastes', {'json': {'content': 'a'}}))
+        self.assertEqual(r.status_code, 201)
+        wsgi_r = pasted.app.test_client().post(
+            '/api/pastes',
+            json={'content': 'a'}
+        )
+        self.assertEqual(r.text, wsgi_r.get_data(as_text=True))
+        self.assertEqual(r.headers['Location'], wsgi_r.headers['Location'])
+
+    def test_raw_read_matches_wsgi(self):
+        key = self.uncached_paste('async content')
+        r, = self.requests(('GET', '/pastes/%s.raw' % key, {}))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.text, 'async content')
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+        wsgi_r = pasted.app.test_client().get('/pastes/%s.raw' % key)
+        self.assertEqual(r.headers['ETag'], wsgi_r.headers['ETag'])
+        self.assertEqual(
+            r.headers['Cache-Control'],
+            wsgi_r.headers['Cache-Control']
+        )
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_concurrent_reads_fetch_once(self):
+        key = self.uncached_paste('popular')
+        responses = self.requests(
+            *[('GET', '/pastes/%s.raw' % key, {})] * 10
+        )
+        self.assertEqual([r.status_code for r in responses], [200] * 10)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_missing_paste(self):
+        key = hashlib.sha1(b'never written').hexdigest()
+        r, = self.requests(('GET', '/pastes/%s.raw' % key, {}))
+        self.assertEqual(r.status_code, 404)
+        self.assertIn(key, memory.MISSING)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_conditional_read_skips_fetch(self):
+        key = self.uncached_paste('conditional')
+        r, = self.requests((
+            'GET',
+            '/pastes/%s.raw' % key,
+            {'headers': {'If-None-Match': '"%s"' % key}}
+        ))
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+
+    def test_rate_limited_read_skips_fetch(self):
+        pasted.app.config['RATE_LIMIT'] = True
+        pasted.app.config['RATE_LIMIT_READ'] = (0.001, 1)
+        self.addCleanup(ratelimit.BUCKETS.close)
+        first = self.uncached_paste('first')
+        second = self.uncached_paste('second')
+        r, = self.requests(('GET', '/pastes/%s.raw' % first, {}))
+        self.assertEqual(r.status_code, 200)
+        r, = self.requests(('GET', '/pastes/%s.raw' % second, {}))
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_cdn_outage(self):
+        key = self.uncached_paste('outage')
+        self.fake.fail['GET'] = 2
+        r, = self.requests(('GET', '/pastes/%s.raw' % key, {}))
+        self.assertEqual(r.status_code, 503)
+        self.assertIn('Retry-After', r.headers)
@@ -0,0 +1,462 @@
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import pasted
+
+from pasted import backend
+from pasted import chunking
+from pasted import memory
+from pasted import session
+from pasted import singleflight
+from pasted import uploads
+
+import tests
+
+
+class LocalCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.manager = backend.CacheManager()
+
+    def tearDown(self):
+        self.manager.close()
+        backend.CACHE_MANAGER.close()
+        shutil.rmtree(self.cache_path)
+
+    def test_handle_is_reused(self):
+        first = self.manager.get(self.cache_path)
+        self.assertIs(first, self.manager.get(self.cache_path))
+
+    def test_handle_reopened_after_fork(self):
+        first = self.manager.get(self.cache_path)
+        self.manager._pid = os.getpid() + 1
+        self.assertIsNot(first, self.manager.get(self.cache_path))
+        first.close()
+
+    def test_context_manager_keeps_handle_open(self):
+        with backend.LocalCache(cache_path=self.cache_path) as c:
+            c.set('key', b'value')
+        with backend.LocalCache(cache_path=self.cache_path) as c2:
+            self.assertIs(c, c2)
+            self.assertEqual(c2.get('key'), b'value')
+
+
+class CDNTestCase(tests.FakeOpenStackTestCase):
+    def put_object(self, key, data):
+        self.fake.objects[('pasted', key)] = {
+            'data': data,
+            'headers': {},
+            'etag': 'etag'
+        }
+
+
+class BackendTestCase(CDNTestCase):
+    def test_read_reuses_cdn_connection(self):
+        self.put_object('abc', b'content')
+        self.put_object('def', b'content')
+        self.assertEqual(backend.read('abc'), 'content')
+        self.assertEqual(backend.read('def'), 'content')
+        stats = session.SESSION_POOL.stats()
+        self.assertEqual(stats['connections'], 1)
+        self.assertGreaterEqual(stats['reused'], 1)
+
+    def test_read_caches_cdn_content(self):
+        self.put_object('abc', b'content')
+        self.assertEqual(backend.read('abc'), 'content')
+        self.assertEqual(backend.read('abc'), 'content')
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_read_host_locked(self):
+        pasted.app.config['CDN_FETCH_HOST_LOCK'] = True
+        self.put_object('abc', b'content')
+        self.assertEqual(backend.read('abc'), 'content')
+        self.assertEqual(backend.read('abc'), 'content')
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_write_skips_cdn_read(self):
+        with pasted.app.test_request_context():
+            key, _, created = backend.write('content', backend='show_paste')
+            self.assertTrue(created)
+            self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+            self.assertEqual(self.fake.requests[('cdn', 'HEAD')], 1)
+
+            _, _, created = backend.write('content', backend='show_paste')
+            self.assertFalse(created)
+            self.assertEqual(self.fake.requests[('cdn', 'HEAD')], 1)
+        self.assertIn(key, backend.KNOWN_KEYS)
+
+    def test_write_existing_remote_key(self):
+        self.put_object(backend.hashlib.sha1(b'content').hexdigest(), b'content')
+        with pasted.app.test_request_context():
+            _, _, created = backend.write('content', backend='show_paste')
+        self.assertFalse(created)
+        self.assertEqual(self.fake.requests[('swift', 'PUT')], 0)
+
+    def test_write_many(self):
+        self.put_object(backend.hashlib.sha1(b'old').hexdigest(), b'old')
+        contents = ['a', 'b', 'a', 'old', 'c']
+        with pasted.app.test_request_context():
+            written = backend.write_many(contents, backend='show_paste')
+        self.assertEqual(
+            [key for key, _, _ in written],
+            [backend.hashlib.sha1(c.encode()).hexdigest() for c in contents]
+        )
+        self.assertEqual(
+            [created for _, _, created in written],
+            [True, True, False, False, True]
+        )
+        self.assertEqual(self.fake.requests[('cdn', 'HEAD')], 4)
+        self.assertEqual(self.fake.requests['auth'], 1)
+        self.assertEqual(
+            len([k for k in self.fake.objects if k[0] == 'pasted']),
+            4
+        )
+        self.assertEqual(backend.read(written[1][0]), 'b')
+
+    def test_rebuild_known_keys(self):
+        self.put_object('abc', b'content')
+        self.put_object('def', b'content')
+        self.assertEqual(backend.KNOWN_KEYS.rebuild(), 2)
+        self.assertIn('abc', backend.KNOWN_KEYS)
+        self.assertNotIn('ghi', backend.KNOWN_KEYS)
+
+    def test_read_served_from_memory(self):
+        self.put_object('abc', b'content')
+        self.assertEqual(backend.read('abc'), 'content')
+        with backend.LocalCache() as c:
+            c.clear()
+        self.assertEqual(backend.read('abc'), 'content')
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_read_missing(self):
+        self.assertIsNone(backend.read('abc'))
+        self.assertIsNone(backend.read('abc'))
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_read_invalid_key(self):
+        self.assertIsNone(backend.read('../etc'))
+        self.assertIsNone(backend.read('ABC'))
+        self.assertIsNone(backend.read('abc\n'))
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+
+    def test_write_clears_missing_key(self):
+        key = backend.hashlib.sha1(b'content').hexdigest()
+        self.assertIsNone(backend.read(key))
+        with pasted.app.test_request_context():
+            backend.write('content', backend='show_paste')
+        self.assertEqual(backend.read(key), 'content')
+
+
+class ObjectCountersTestCase(CDNTestCase):
+    def setUp(self):
+        super(ObjectCountersTestCase, self).setUp()
+        pasted.app.config['STATS_REFRESH_INTERVAL'] = 0
+        self.counters = backend.ObjectCounters()
+        self.counters.start = lambda: None
+
+    def test_write_increments(self):
+        backend.COUNTERS.start = lambda: None
+        try:
+            with pasted.app.test_request_context():
+                backend.write('content', backend='show_paste')
+                backend.write('content', backend='show_paste')
+            self.assertEqual(backend.count(), (1, 7))
+        finally:
+            del backend.COUNTERS.start
+
+    def test_reconcile(self):
+        self.put_object('abc', b'content')
+        self.put_object('def', b'content')
+        self.counters.add(5, 100)
+        self.assertEqual(self.counters.get(), (5, 100))
+        self.assertEqual(self.counters.reconcile(), (2, 14))
+        self.assertEqual(self.counters.get(), (2, 14))
+
+
+class ChunkingTestCase(CDNTestCase):
+    def setUp(self):
+        super(ChunkingTestCase, self).setUp()
+        pasted.app.config['CHUNKING'] = True
+        pasted.app.config['CHUNKING_MIN_SIZE'] = 8192
+        pasted.app.config['CHUNK_SIZE'] = 1024
+        pasted.app.config['CHUNK_MAX_SIZE'] = 4096
+        backend.COUNTERS.start = lambda: None
+
+    def tearDown(self):
+        del backend.COUNTERS.start
+        super(ChunkingTestCase, self).tearDown()
+
+    def log_lines(self, count):
+        return ['line %d of a long log, status=%d\n' % (i, i % 7)
+                for i in range(count)]
+
+    def clear_caches(self):
+        memory.CONTENT.clear()
+        with backend.LocalCache() as c:
+            c.clear()
+
+    def test_split(self):
+        data = ''.join(self.log_lines(2000)).encode('utf-8')
+        chunks = chunking.split(data, 1024, 4096)
+        self.assertEqual(b''.join(chunks), data)
+        self.assertGreater(len(chunks), 10)
+        self.assertTrue(all(len(c) <= 4096 for c in chunks))
+        self.assertTrue(all(c.endswith(b'\n') for c in chunks))
+
+    def test_split_without_line_ends(self):
+        data = ('\u00e9' * 10000).encode('utf-8')
+        chunks = chunking.split(data, 1024, 4096)
+        self.assertEqual(b''.join(chunks), data)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 4096)
+            chunk.decode('utf-8')
+
+    def test_split_without_line_ends_deduplicates(self):
+        data = ','.join(
+            '{"id": %d, "name": "\u00e9l\u00e8ve %d"}' % (i, i * 7919 % 1000)
+            for i in range(2000)
+        ).encode('utf-8')
+        chunks = chunking.split(data, 1024, 4096)
+        self.assertGreater(len(chunks), 10)
+        for chunk in chunks:
+            chunk.decode('utf-8')
+        edited = chunking.split(b'[' + data, 1024, 4096)
+        self.assertEqual(b''.join(edited), b'[' + data)
+        # only the first chunk changes
+        self.assertEqual(len(set(edited) - set(chunks)), 1)
+
+    def test_write_deduplicates_chunks(self):
+        lines = self.log_lines(2000)
+        first = ''.join(lines)
+        lines.insert(1000, 'an extra line\n')
+        second = ''.join(lines)
+        with pasted.app.test_request_context():
+            first_key, _, _ = backend.write(first, backend='show_paste')
+            puts = self.fake.requests[('swift', 'PUT')]
+            second_key, _, _ = backend.write(second, backend='show_paste')
+        chunks = len(chunking.parse(
+            self.fake.objects[('pasted', first_key)]['data']
+        ))
+        self.assertGreater(chunks, 10)
+        # the manifest and the chunks around the extra line
+        self.assertLessEqual(self.fake.requests[('swift', 'PUT')] - puts, 4)
+
+        size, stored = backend.COUNTERS.chunked()
+        self.assertEqual(size, len(first) + len(second))
+        self.assertLess(stored, len(first) * 1.1)
+
+        self.clear_caches()
+        self.assertEqual(backend.read(first_key), first)
+        self.assertEqual(backend.read(second_key), second)
+
+    def test_open_stream_seeks(self):
+        pasted.app.config['CONTENT_COMPRESSION'] = 'gzip'
+        content = ''.join(self.log_lines(2000)).encode('utf-8')
+        with pasted.app.test_request_context():
+            key, _, _ = backend.write(
+                content.decode('utf-8'),
+                backend='show_paste'
+            )
+        self.clear_caches()
+        stream, size, content_encoding = backend.open_stream(key)
+        self.assertIsNone(content_encoding)
+        self.assertEqual(size, len(content))
+        stream.seek(10000)
+        self.assertEqual(stream.read(5000), content[10000:15000])
+        stream.seek(-100, 2)
+        self.assertEqual(stream.read(), content[-100:])
+        stream.close()
+
+    def test_small_content_not_chunked(self):
+        with pasted.app.test_request_context():
+            key, _, _ = backend.write('content', backend='show_paste')
+        self.assertEqual(
+            self.fake.objects[('pasted', key)]['data'],
+            b'content'
+        )
+        self.assertEqual(backend.COUNTERS.chunked(), (0, 0))
+
+    def test_single_chunk_not_chunked(self):
+        # a misconfiguration create_app rejects, the minimum chunk size
+        # is larger than the content
+        pasted.app.config['CHUNKING_MIN_SIZE'] = 1024
+        pasted.app.config['CHUNK_SIZE'] = 16384
+        pasted.app.config['CHUNK_MAX_SIZE'] = 65536
+        content = ''.join(self.log_lines(100))
+        self.assertEqual(
+            len(chunking.split(content.encode('utf-8'), 16384, 65536)),
+            1
+        )
+        with pasted.app.test_request_context():
+            key, _, _ = backend.write(content, backend='show_paste')
+        data = self.fake.objects[('pasted', key)]['data']
+        self.assertFalse(data.startswith(chunking.MAGIC))
+        self.clear_caches()
+        self.assertEqual(backend.read(key), content)
+
+
+class WriteBehindTestCase(CDNTestCase):
+    def setUp(self):
+        super(WriteBehindTestCase, self).setUp()
+        pasted.app.config['WRITE_BEHIND'] = True
+        pasted.app.config['UPLOAD_POLL_INTERVAL'] = 0.05
+
+    def tearDown(self):
+        uploads.UPLOADER.stop()
+        uploads.UPLOADER.reset()
+        super(WriteBehindTestCase, self).tearDown()
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.02)
+        return condition()
+
+    def test_write_is_journaled_and_drained(self):
+        with pasted.app.test_request_context():
+            key, _, created = backend.write('content', backend='show_paste')
+        self.assertTrue(created)
+        # the journal entry is removed before the upload is counted
+        self.assertTrue(
+            self.wait_for(lambda: uploads.UPLOADER.stats()['uploaded'] == 1)
+        )
+        self.assertNotIn(key, uploads.JOURNAL)
+        self.assertIn(('pasted', key), self.fake.objects)
+
+    def test_journal_drained_after_restart(self):
+        key = backend.hashlib.sha1(b'content').hexdigest()
+        uploads.JOURNAL.add(key, b'content')
+        # a restarted worker resumes uploads on its first request
+        uploads.UPLOADER.reset()
+        pasted.app.test_client().get('/')
+        self.assertTrue(self.wait_for(lambda: key not in uploads.JOURNAL))
+        self.assertIn(('pasted', key), self.fake.objects)
+
+    def test_read_from_journal_until_uploaded(self):
+        self.fake.fail['PUT'] = 1000
+        with pasted.app.test_request_context():
+            key, _, _ = backend.write('content', backend='show_paste')
+        memory.CONTENT.clear()
+        with backend.LocalCache() as c:
+            c.clear()
+        self.assertEqual(backend.read(key), 'content')
+        self.assertTrue(self.wait_for(lambda: uploads.UPLOADER.failed > 0))
+        self.assertIn(key, uploads.JOURNAL)
+        self.assertNotIn(('pasted', key), self.fake.objects)
+
+        self.fake.fail['PUT'] = 0
+        os.unlink(uploads.JOURNAL._retry_file(key))
+        uploads.UPLOADER.wake()
+        self.assertTrue(self.wait_for(lambda: key not in uploads.JOURNAL))
+
+    def test_objects_claimed_elsewhere_are_skipped(self):
+        uploads.JOURNAL.add('a' * 40, b'first')
+        uploads.JOURNAL.add('b' * 40, b'second')
+        os.utime(uploads.JOURNAL._file('a' * 40), (1, 1))
+        # another worker uploads the oldest object
+        with open(uploads.JOURNAL._file('a' * 40), 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self.assertEqual(uploads.UPLOADER.drain_batch(1), 1)
+            self.assertIn(('pasted', 'b' * 40), self.fake.objects)
+            self.assertEqual(uploads.UPLOADER.drain(), 0)
+        self.assertEqual(uploads.UPLOADER.drain(), 1)
+        self.assertEqual(len(uploads.JOURNAL), 0)
+
+    def test_backoff_shared_by_workers(self):
+        self.fake.fail['PUT'] = 1
+        uploads.JOURNAL.add('a' * 40, b'content')
+        self.assertEqual(uploads.UPLOADER.drain(), 1)
+        self.assertEqual(uploads.UPLOADER.failed, 1)
+        # a worker which did not see the failure waits for the retry
+        other = uploads.Uploader(journal=uploads.JOURNAL)
+        self.assertEqual(other.drain(), 0)
+        self.assertEqual(other.stats()['retrying'], 1)
+        self.assertNotIn(('pasted', 'a' * 40), self.fake.objects)
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = memory.MemoryCache(max_bytes=10, ttl=60)
+        cache.set('a', b'aaaa')
+        cache.set('b', b'bbbb')
+        cache.get('a')
+        cache.set('c', b'cccc')
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 8)
+
+    def test_oversized_value_not_cached(self):
+        cache = memory.MemoryCache(max_bytes=4, ttl=60)
+        cache.set('a', b'aaaaa')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_expired_entry(self):
+        cache = memory.MemoryCache(max_bytes=10, ttl=60)
+        cache.set('a', b'aaaa', ttl=0)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', stale=True), b'aaaa')
+
+
+class NegativeCacheTestCase(unittest.TestCase):
+    def test_bounded(self):
+        cache = memory.NegativeCache(max_entries=2, ttl=60)
+        for key in ('a', 'b', 'c'):
+            cache.add(key)
+        self.assertNotIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_expired(self):
+        cache = memory.NegativeCache(max_entries=2, ttl=0)
+        cache.add('a')
+        self.assertNotIn('a', cache)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_concurrent_calls_coalesced(self):
+        flight = singleflight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return b'content'
+
+        def worker():
+            results.append(flight.do('key', fetch))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b'content'] * 8)
+
+    def test_error_shared(self):
+        flight = singleflight.SingleFlight()
+
+        def fetch():
+            raise ValueError('boom')
+
+        self.assertRaises(ValueError, flight.do, 'key', fetch)
+        self.assertEqual(flight._calls, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import io
+import unittest
+
+import pasted
+
+from pasted import backend
+from pasted import breaker
+from pasted import cdn
+from pasted import exceptions
+
+import tests
+
+
+class FailingProvider(cdn.Provider):
+    """In memory provider failing on demand."""
+
+    objects = dict()
+    fail = False
+    calls = 0
+
+    def _check(self):
+        FailingProvider.calls += 1
+        if FailingProvider.fail:
+            raise IOError('storage is down')
+
+    def put(self, key, content, content_encoding=None):
+        self._check()
+        self.objects[key] = content
+
+    def get(self, key):
+        self._check()
+        content = self.objects.get(key)
+        if content is not None:
+            return io.BytesIO(content), len(content)
+
+    def head(self, key):
+        self._check()
+        if key in self.objects:
+            return {'size': len(self.objects[key]), 'content_encoding': None}
+
+    def count(self):
+        self._check()
+        return len(self.objects), sum(len(v) for v in self.objects.values())
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def test_opens_and_recovers(self):
+        b = breaker.CircuitBreaker('test', failure_threshold=2, reset_timeout=0)
+
+        def fail():
+            raise IOError('down')
+
+        for _ in range(2):
+            self.assertRaises(IOError, b.call, fail)
+        self.assertEqual(b.state, b.OPEN)
+
+        # reset timeout elapsed, the trial call closes the breaker
+        self.assertEqual(b.call(lambda: 'ok'), 'ok')
+        self.assertEqual(b.state, b.CLOSED)
+        self.assertEqual(b.stats()['transitions'], {
+            'closed_to_open': 1,
+            'open_to_half_open': 1,
+            'half_open_to_closed': 1
+        })
+
+    def test_fails_fast_when_open(self):
+        b = breaker.CircuitBreaker('test', failure_threshold=1, reset_timeout=60)
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise IOError('down')
+
+        self.assertRaises(IOError, b.call, fail)
+        self.assertRaises(exceptions.CircuitOpen, b.call, fail)
+        self.assertEqual(len(calls), 1)
+
+
+class ProviderOutageTestCase(tests.PastedTestCase):
+    def setUp(self):
+        super(ProviderOutageTestCase, self).setUp()
+        cdn.PROVIDERS['failing'] = FailingProvider
+        FailingProvider.objects = dict()
+        FailingProvider.fail = False
+        FailingProvider.calls = 0
+        pasted.app.config['CDN_PROVIDER'] = 'failing'
+        pasted.app.config['CDN_ENDPOINT'] = None
+        pasted.app.config['CDN_BREAKER_FAILURE_THRESHOLD'] = 2
+
+    def tearDown(self):
+        breaker.reset()
+        del cdn.PROVIDERS['failing']
+        super(ProviderOutageTestCase, self).tearDown()
+
+    def test_read_fails_fast(self):
+        FailingProvider.fail = True
+        key = '0' * 40
+        for _ in range(2):
+            r = self.app.get('/pastes/%s.raw' % key)
+            self.assertEqual(r.status_code, 503)
+        calls = FailingProvider.calls
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(FailingProvider.calls, calls)
+        self.assertEqual(breaker.get('cdn.fetch').state, 'open')
+
+    def test_read_falls_back_to_stale_content(self):
+        pasted.app.config['MEMORY_CACHE_TTL'] = 0
+        FailingProvider.objects['abc'] = b'content'
+        self.assertEqual(backend.read('abc'), 'content')
+        with backend.LocalCache() as c:
+            c.clear()
+        FailingProvider.fail = True
+        self.assertEqual(backend.read('abc'), 'content')
+
+    def test_write_unavailable(self):
+        FailingProvider.fail = True
+        pasted.app.config['CDN_BREAKER_FAILURE_THRESHOLD'] = 1
+        r = self.app.post('/api/pastes', json={'content': 'content'})
+        self.assertEqual(r.status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
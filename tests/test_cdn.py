@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pasted
+
+from pasted import breaker
+from pasted import cdn
+from pasted import exceptions
+
+from tests import fake_openstack
+
+
+class OpenStackPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fake = fake_openstack.FakeOpenStack().start()
+        self.paste_dir = tempfile.mkdtemp()
+        self.saved_config = dict(pasted.app.config)
+        pasted.app.config.update(self.fake.config())
+        breaker.reset()
+        pasted.app.config['PASTE_DIR'] = self.paste_dir
+        cdn.CONNECTION_POOL.close()
+
+    def tearDown(self):
+        cdn.CONNECTION_POOL.close()
+        pasted.app.config.clear()
+        pasted.app.config.update(self.saved_config)
+        self.fake.stop()
+        shutil.rmtree(self.paste_dir)
+
+    def test_upload_reuses_token(self):
+        cdn.upload(key='a', content=b'a')
+        cdn.upload(key='b', content=b'b')
+        self.assertEqual(cdn.count(), (2, 2))
+        self.assertEqual(self.fake.requests['auth'], 1)
+
+    def test_token_shared_between_workers(self):
+        cdn.upload(key='a', content=b'a')
+        worker = cdn.ConnectionPool()
+        cdn_provider = cdn.OpenStack(container=None)
+        conn = worker.get(
+            verify=cdn_provider.verify,
+            auth_args=cdn_provider.os_auth_args
+        )
+        conn.object_store.upload_object(container='pasted', name='b', data=b'b')
+        self.assertEqual(self.fake.requests['auth'], 1)
+        conn.close()
+
+    def test_token_renewed_before_expiry(self):
+        self.fake.token_lifetime = 200
+        cdn.upload(key='a', content=b'a')
+        cdn.upload(key='b', content=b'b')
+        self.assertEqual(self.fake.requests['auth'], 2)
+
+    def test_provider_interface(self):
+        provider = cdn.provider()
+        provider.put('abc', b'content', content_encoding=None)
+        stream, size = provider.get('abc')
+        with stream:
+            self.assertEqual(stream.read(), b'content')
+        self.assertEqual(size, 7)
+        self.assertEqual(provider.head('abc')['size'], 7)
+        self.assertEqual(list(provider.list()), ['abc'])
+        provider.delete('abc')
+        self.assertIsNone(provider.get('abc'))
+        self.assertIsNone(provider.head('abc'))
+
+    def test_segmented_upload(self):
+        pasted.app.config['CDN_SEGMENT_THRESHOLD'] = 10
+        pasted.app.config['CDN_SEGMENT_SIZE'] = 4
+        content = b'0123456789abcdef'
+        cdn.upload(key='big', content=content)
+        self.assertEqual(self.fake.objects[('pasted', 'big')]['data'], content)
+        self.assertEqual(
+            len(self.fake.objects[('pasted', 'big')]['segments']),
+            4
+        )
+        self.assertIn(('pasted_segments', 'big/00000003'), self.fake.objects)
+
+        puts = self.fake.requests[('swift', 'PUT')]
+        cdn.upload(key='big', content=content)
+        # uploaded segments are skipped, only the container and manifest are put
+        self.assertEqual(self.fake.requests[('swift', 'PUT')] - puts, 2)
+
+        cdn.delete('big')
+        self.assertNotIn(('pasted_segments', 'big/00000000'), self.fake.objects)
+
+
+class LocalDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.saved_config = dict(pasted.app.config)
+        pasted.app.config['CDN_PROVIDER'] = 'local'
+        pasted.app.config['CDN_LOCAL_PATH'] = self.path
+
+    def tearDown(self):
+        pasted.app.config.clear()
+        pasted.app.config.update(self.saved_config)
+        shutil.rmtree(self.path)
+
+    def test_put_is_sharded(self):
+        cdn.upload(key='abcdef', content=b'content')
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.path, 'pasted', 'ab', 'cd', 'abcdef')
+        ))
+
+    def test_provider_interface(self):
+        provider = cdn.provider()
+        provider.put('abc', b'\x1f\x8bdata', content_encoding='gzip')
+        provider.put('def', b'content')
+        self.assertEqual(cdn.count(), (2, 13))
+        self.assertEqual(sorted(cdn.list_objects()), ['abc', 'def'])
+        self.assertEqual(cdn.head('abc')['content_encoding'], 'gzip')
+        stream, size = cdn.fetch('def')
+        with stream:
+            self.assertEqual(stream.read(), b'content')
+        cdn.delete('def')
+        cdn.delete('def')
+        self.assertIsNone(cdn.fetch('def'))
+
+    def test_invalid_key(self):
+        self.assertRaises(ValueError, cdn.fetch, '../abc')
+
+    def test_unknown_provider(self):
+        pasted.app.config['CDN_PROVIDER'] = 'other'
+        self.assertRaises(exceptions.ProviderError, cdn.provider)
+
+
+if __name__ == '__main__':
+    unittest.main()
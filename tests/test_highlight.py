@@ -0,0 +1,93 @@
+import hashlib
+import unittest
+
+from unittest import mock
+
+import pasted
+
+from pasted import highlight
+
+import tests
+
+
+PYTHON = '''import os
+
+
+def main():
+    """Print the working directory."""
+    print(os.getcwd())
+
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+@unittest.skipUnless(highlight.available(), 'pygments is not installed')
+class HighlightTestCase(tests.LocalProviderTestCase):
+    def setUp(self):
+        super(HighlightTestCase, self).setUp()
+        pasted.app.config['HIGHLIGHT'] = True
+
+    def test_render(self):
+        html, language = highlight.render('a' * 40, PYTHON)
+        self.assertEqual(language, 'Python')
+        self.assertIn('<span class="k">def</span>', html)
+
+    def test_render_cached(self):
+        rendered = highlight.render('b' * 40, PYTHON)
+        with mock.patch.object(
+            highlight.lexers,
+            'guess_lexer',
+            side_effect=AssertionError('detected twice')
+        ):
+            self.assertEqual(highlight.render('b' * 40, PYTHON), rendered)
+
+    def test_render_escapes(self):
+        html, _ = highlight.render('c' * 40, '<script>alert(1)</script>')
+        self.assertNotIn('<script>', html)
+
+    def test_render_size_cap(self):
+        pasted.app.config['HIGHLIGHT_MAX_SIZE'] = 10
+        self.assertIsNone(highlight.render('d' * 40, PYTHON))
+
+    def test_render_disabled(self):
+        pasted.app.config['HIGHLIGHT'] = False
+        self.assertIsNone(highlight.render('e' * 40, PYTHON))
+
+    def test_page(self):
+        r = self.app.post('/api/pastes', json={'content': PYTHON})
+        self.assertEqual(r.status_code, 201)
+        key = hashlib.sha1(PYTHON.encode('utf-8')).hexdigest()
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+        page = r.get_data(as_text=True)
+        self.assertIn('highlight nohighlight', page)
+        self.assertIn('data-language="Python"', page)
+        self.assertIn('<span class="k">def</span>', page)
+        self.assertIn('href="/highlight.css"', page)
+
+        r = self.app.get('/highlight.css')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('.highlight', r.get_data(as_text=True))
+
+    def test_page_above_size_cap(self):
+        pasted.app.config['HIGHLIGHT_MAX_SIZE'] = 10
+        self.app.post('/api/pastes', json={'content': PYTHON})
+        key = hashlib.sha1(PYTHON.encode('utf-8')).hexdigest()
+        page = self.app.get('/pastes/%s' % key).get_data(as_text=True)
+        self.assertIn('<code class="border nohighlight">', page)
+        self.assertNotIn('<span class="k">', page)
+
+    def test_stylesheet_disabled(self):
+        pasted.app.config['HIGHLIGHT'] = False
+        self.assertEqual(self.app.get('/highlight.css').status_code, 404)
+
+
+class HighlightUnavailableTestCase(tests.LocalProviderTestCase):
+    def test_stylesheet_not_linked(self):
+        pasted.app.config['HIGHLIGHT'] = True
+        with mock.patch.object(highlight, 'pygments', None):
+            page = self.app.get('/').get_data(as_text=True)
+            self.assertEqual(self.app.get('/highlight.css').status_code, 404)
+        self.assertNotIn('/highlight.css', page)
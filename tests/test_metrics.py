@@ -0,0 +1,104 @@
+import unittest
+
+import pasted
+
+from pasted import metrics
+
+import tests
+
+
+class RegistryTestCase(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        registry.observe('operation_duration', 0.0001, operation='read')
+        registry.observe('operation_duration', 0.2, operation='read')
+        registry.observe('operation_duration', 60, operation='read')
+        text = registry.render()
+        self.assertIn(
+            '# TYPE pasted_operation_duration_seconds histogram', text
+        )
+        self.assertIn(
+            'pasted_operation_duration_seconds_bucket'
+            '{operation="read",le="0.0005"} 1', text
+        )
+        self.assertIn(
+            'pasted_operation_duration_seconds_bucket'
+            '{operation="read",le="0.25"} 2', text
+        )
+        self.assertIn(
+            'pasted_operation_duration_seconds_bucket'
+            '{operation="read",le="+Inf"} 3', text
+        )
+        self.assertIn(
+            'pasted_operation_duration_seconds_count{operation="read"} 3', text
+        )
+
+    def test_gauges(self):
+        text = metrics.Registry().render(
+            gauges=[('breaker_open', {'operation': 'cdn.read'}, 1)]
+        )
+        self.assertIn('# TYPE pasted_breaker_open gauge', text)
+        self.assertIn('pasted_breaker_open{operation="cdn.read"} 1', text)
+
+    def test_counters(self):
+        text = metrics.Registry().render(
+            gauges=[('uploads_pending', {}, 2)],
+            counters=[('ratelimit_rejected_total', {'group': 'read'}, 3)]
+        )
+        self.assertIn('# TYPE pasted_uploads_pending gauge', text)
+        self.assertIn('# TYPE pasted_ratelimit_rejected_total counter', text)
+        self.assertIn('pasted_ratelimit_rejected_total{group="read"} 3', text)
+
+    def test_server_timing(self):
+        self.assertEqual(
+            metrics.server_timing({'cdn_fetch': 0.0125, 'total': 0.02}),
+            'cdn_fetch;dur=12.500, total;dur=20.000'
+        )
+
+
+class MetricsViewsTestCase(tests.FakeOpenStackTestCase):
+    def setUp(self):
+        super(MetricsViewsTestCase, self).setUp()
+        metrics.REGISTRY.reset()
+        pasted.app.config['METRICS_ENABLED'] = True
+
+    def test_server_timing_header(self):
+        r = self.app.post('/api/pastes', json={'content': 'timed'})
+        self.assertEqual(r.status_code, 201)
+        timing = r.headers['Server-Timing']
+        self.assertIn('write;dur=', timing)
+        self.assertIn('cdn_upload;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+        r = self.app.get('/')
+        self.assertIn('render;dur=', r.headers['Server-Timing'])
+
+    def test_server_timing_disabled(self):
+        pasted.app.config['SERVER_TIMING'] = False
+        r = self.app.get('/')
+        self.assertNotIn('Server-Timing', r.headers)
+
+    def test_metrics_endpoint(self):
+        self.app.post('/api/pastes', json={'content': 'measured'})
+        r = self.app.get('/metrics')
+        self.assertEqual(r.status_code, 200)
+        text = r.get_data(as_text=True)
+        self.assertIn(
+            'pasted_request_duration_seconds_count'
+            '{endpoint="create_paste",method="POST",status="201"} 1', text
+        )
+        self.assertIn(
+            'pasted_operation_duration_seconds_count'
+            '{operation="cdn_upload"} 1', text
+        )
+        self.assertIn('pasted_breaker_open{operation="cdn.upload"} 0', text)
+        self.assertIn('# TYPE pasted_memory_cache_hits_total counter', text)
+        self.assertIn('# TYPE pasted_uploads_pending gauge', text)
+        self.assertIn('pasted_chunked_bytes_total 0', text)
+
+    def test_disabled(self):
+        pasted.app.config['METRICS_ENABLED'] = False
+        r = self.app.get('/')
+        self.assertNotIn('Server-Timing', r.headers)
+        self.assertEqual(self.app.get('/metrics').status_code, 404)
+        self.assertEqual(metrics.REGISTRY.render(), '\n')
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+from unittest import mock
+
+import pasted
+
+from pasted import ratelimit
+
+import tests
+
+
+class BucketStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.store = ratelimit.BucketStore(cache_path=self.cache_path)
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            ratelimit.time,
+            'time',
+            lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.cache_path)
+
+    def test_burst_then_refill(self):
+        for _ in range(3):
+            self.assertEqual(self.store.take('client', 1, 3), 0)
+        self.assertAlmostEqual(self.store.take('client', 1, 3), 1)
+        self.now += 0.5
+        self.assertAlmostEqual(self.store.take('client', 1, 3), 0.5)
+        self.now += 0.5
+        self.assertEqual(self.store.take('client', 1, 3), 0)
+
+    def test_clients_are_independent(self):
+        self.assertEqual(self.store.take('first', 1, 1), 0)
+        self.assertGreater(self.store.take('first', 1, 1), 0)
+        self.assertEqual(self.store.take('second', 1, 1), 0)
+
+    def test_cost_above_burst_leaves_debt(self):
+        self.assertEqual(self.store.take('client', 1, 10, cost=30), 0)
+        self.now += 10
+        self.assertAlmostEqual(self.store.take('client', 1, 10), 11)
+        self.now += 21
+        self.assertEqual(self.store.take('client', 1, 10), 0)
+
+    def test_shared_between_processes(self):
+        pasted.app.config['RATE_LIMIT_SLOTS'] = 2
+        self.addCleanup(
+            pasted.app.config.__setitem__,
+            'RATE_LIMIT_SLOTS',
+            65536
+        )
+        # the client lands in the second slot of the pair
+        self.assertEqual(self.store.take('other', 1, 2), 0)
+        self.assertEqual(self.store.take('client', 1, 2), 0)
+        pid = os.fork()
+        if pid == 0:
+            signal.alarm(5)
+            status = 0 if self.store.take('client', 1, 2) == 0 else 1
+            os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertGreater(self.store.take('client', 1, 2), 0)
+
+    def test_colliding_clients_take_over_oldest_slot(self):
+        pasted.app.config['RATE_LIMIT_SLOTS'] = 2
+        self.addCleanup(
+            pasted.app.config.__setitem__,
+            'RATE_LIMIT_SLOTS',
+            65536
+        )
+        self.assertEqual(self.store.take('first', 1, 1), 0)
+        self.now += 0.1
+        self.assertEqual(self.store.take('second', 1, 1), 0)
+        self.now += 0.1
+        self.assertEqual(self.store.take('third', 1, 1), 0)
+        # the second client kept its slot and its empty bucket
+        self.assertGreater(self.store.take('second', 1, 1), 0)
+
+
+class RateLimitViewsTestCase(tests.FakeOpenStackTestCase):
+    def setUp(self):
+        super(RateLimitViewsTestCase, self).setUp()
+        pasted.app.config['RATE_LIMIT'] = True
+        pasted.app.config['RATE_LIMIT_CREATE'] = (0.001, 2)
+        pasted.app.config['RATE_LIMIT_READ'] = (0.001, 3)
+        ratelimit.REJECTED.clear()
+
+    def tearDown(self):
+        ratelimit.BUCKETS.close()
+        super(RateLimitViewsTestCase, self).tearDown()
+
+    def create(self, content, **kwargs):
+        return self.app.post(
+            '/api/pastes',
+            json={'content': content},
+            **kwargs
+        )
+
+    def test_create_limited(self):
+        self.assertEqual(self.create('one').status_code, 201)
+        self.assertEqual(self.create('two').status_code, 201)
+        r = self.create('three')
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(r.get_json()['error'], 'Rate limit exceeded')
+        self.assertGreater(int(r.headers['Retry-After']), 1)
+        self.assertEqual(self.fake.requests[('swift', 'PUT')], 2)
+        self.assertEqual(ratelimit.REJECTED['create'], 1)
+
+    def test_clients_limited_separately(self):
+        pasted.app.config['RATE_LIMIT_KEY_HEADER'] = 'X-Api-Key'
+        pasted.app.config['RATE_LIMIT_KEYS'] = {'first', 'second'}
+        for _ in range(2):
+            self.create('one', headers={'X-Api-Key': 'first'})
+        r = self.create('one', headers={'X-Api-Key': 'first'})
+        self.assertEqual(r.status_code, 429)
+        r = self.create('one', headers={'X-Api-Key': 'second'})
+        self.assertEqual(r.status_code, 201)
+        r = self.create('one', environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(r.status_code, 201)
+
+    def test_unknown_keys_limited_by_address(self):
+        pasted.app.config['RATE_LIMIT_KEY_HEADER'] = 'X-Api-Key'
+        pasted.app.config['RATE_LIMIT_KEYS'] = {'first'}
+        statuses = [
+            self.create('one', headers={'X-Api-Key': str(i)}).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [201, 201, 429])
+
+    def test_keys_set_by_trusted_proxy(self):
+        pasted.app.config['RATE_LIMIT_KEY_HEADER'] = 'X-Api-Key'
+        pasted.app.config['RATE_LIMIT_TRUSTED_PROXIES'] = {'10.0.0.1'}
+        for i in range(3):
+            r = self.create(
+                'one',
+                headers={'X-Api-Key': str(i)},
+                environ_base={'REMOTE_ADDR': '10.0.0.1'}
+            )
+            self.assertEqual(r.status_code, 201)
+
+    def test_reads_limited_apart_from_creates(self):
+        self.create('one')
+        key = hashlib.sha1(b'one').hexdigest()
+        for _ in range(3):
+            r = self.app.get('/pastes/%s.raw' % key)
+            self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.app.get('/pastes/%s' % key).status_code, 429)
+        self.assertEqual(self.create('two').status_code, 201)
+
+    def test_batch_costs_one_token_per_item(self):
+        r = self.app.post(
+            '/api/pastes/batch',
+            json={'contents': ['one', 'two', 'three']}
+        )
+        self.assertEqual(r.status_code, 201)
+        r = self.app.post('/api/pastes/batch', json={'contents': ['four']})
+        self.assertEqual(r.status_code, 429)
+
+    def test_disabled(self):
+        pasted.app.config['RATE_LIMIT'] = False
+        for content in ('one', 'two', 'three'):
+            self.assertEqual(self.create(content).status_code, 201)
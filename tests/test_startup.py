@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import unittest
+
+import pasted
+
+
+def _run(code):
+    return subprocess.check_output(
+        [sys.executable, '-c', code]
+    ).decode('utf-8').strip()
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_create_app_is_idempotent(self):
+        self.assertIs(pasted.create_app(), pasted.app)
+        self.assertIs(pasted.create_app(), pasted.app)
+        self.assertIn('show_paste_raw', pasted.app.view_functions)
+
+    def test_create_app_config(self):
+        saved_config = dict(pasted.app.config)
+        try:
+            pasted.create_app(config={'METRICS_ENABLED': True})
+            self.assertTrue(pasted.app.config['METRICS_ENABLED'])
+        finally:
+            pasted.app.config.clear()
+            pasted.app.config.update(saved_config)
+
+    def test_create_app_rejects_chunks_above_chunking_size(self):
+        with self.assertRaises(ValueError):
+            pasted.create_app(config={
+                'CHUNKING': True,
+                'CHUNKING_MIN_SIZE': 1024,
+                'CHUNK_MAX_SIZE': 4096
+            })
+        self.assertFalse(pasted.app.config['CHUNKING'])
+
+    def test_create_app_config_applies_to_responses(self):
+        saved_config = dict(pasted.app.config)
+        key = '0' * 40
+        try:
+            pasted.create_app(config={'IMMUTABLE_MAX_AGE': 60})
+            r = pasted.app.test_client().get(
+                '/pastes/%s.raw' % key,
+                headers={'If-None-Match': '"%s"' % key}
+            )
+            self.assertEqual(r.status_code, 304)
+            self.assertEqual(
+                r.headers['Cache-Control'],
+                'public, max-age=60, immutable'
+            )
+        finally:
+            pasted.app.config.clear()
+            pasted.app.config.update(saved_config)
+
+    def test_import_does_not_load_openstack(self):
+        loaded = _run(
+            "import sys, pasted; print('openstack' in sys.modules)"
+        )
+        self.assertEqual(loaded, 'False')
+
+    def test_preload_loads_openstack(self):
+        loaded = _run(
+            "import sys, pasted; pasted.preload(); "
+            "print('openstack' in sys.modules)"
+        )
+        self.assertEqual(loaded, 'True')
+
+    def test_preload_opens_nothing(self):
+        opened = _run(
+            "import pasted, threading; from pasted import backend, cdn; "
+            "pasted.preload(); "
+            "print(threading.active_count(), "
+            "backend.CACHE_MANAGER._handles or None, "
+            "cdn.CONNECTION_POOL._conns or None)"
+        )
+        self.assertEqual(opened, '1 None None')
@@ -0,0 +1,353 @@
+import email
+import hashlib
+import shutil
+import unittest
+
+from unittest import mock
+
+import pasted
+
+from pasted import backend
+from pasted import cdn
+from pasted import memory
+from pasted import views
+
+import tests
+
+
+class ViewsTestCase(tests.FakeOpenStackTestCase):
+    def create_paste(self, content):
+        r = self.app.post('/api/pastes', json={'content': content})
+        self.assertEqual(r.status_code, 201)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def test_create_pastes_batch(self):
+        r = self.app.post(
+            '/api/pastes/batch',
+            json={'contents': ['one', 'two', 'one']}
+        )
+        self.assertEqual(r.status_code, 201)
+        urls = r.get_json()['urls']
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(urls[0], urls[2])
+        self.assertTrue(urls[1].endswith(
+            '/pastes/%s.raw' % hashlib.sha1(b'two').hexdigest()
+        ))
+        single = self.app.post('/api/pastes', json={'content': 'two'})
+        self.assertEqual(single.get_data(as_text=True), urls[1])
+        r = self.app.get(urls[0].replace('http://localhost', ''))
+        self.assertEqual(r.data, b'one')
+
+    def test_create_pastes_batch_invalid(self):
+        for payload in ({}, {'contents': []}, {'contents': 'one'},
+                        {'contents': ['one', 2]}):
+            r = self.app.post('/api/pastes/batch', json=payload)
+            self.assertEqual(r.status_code, 400)
+
+        pasted.app.config['BULK_MAX_ITEMS'] = 2
+        r = self.app.post(
+            '/api/pastes/batch',
+            json={'contents': ['one', 'two', 'three']}
+        )
+        self.assertEqual(r.status_code, 400)
+
+    def test_create_links_batch(self):
+        links = ['https://example.com/a', 'https://example.com/b']
+        r = self.app.post('/api/links/batch', json={'contents': links})
+        self.assertEqual(r.status_code, 201)
+        urls = r.get_json()['urls']
+        self.assertTrue(urls[0].endswith(
+            '/l/%s' % hashlib.sha1(links[0].encode()).hexdigest()[:16]
+        ))
+
+        r = self.app.post(
+            '/api/links/batch',
+            json={'contents': ['https://example.com/c', 'not a link']}
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.get_json()['index'], 1)
+        self.assertEqual(self.fake.requests[('swift', 'PUT')], 2)
+
+    def read_multi(self, ids):
+        r = self.app.post('/api/pastes/multi', json={'ids': ids})
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.is_streamed)
+        message = email.message_from_bytes(
+            b'Content-Type: %s\r\n\r\n' % r.headers['Content-Type'].encode()
+            + r.data
+        )
+        self.assertTrue(message.is_multipart())
+        return [
+            (
+                part.get('Content-ID', '').strip('<>'),
+                int(part['X-Pasted-Status']),
+                part.get_payload(decode=True)
+            )
+            for part in message.get_payload()
+        ]
+
+    def test_read_pastes_multi(self):
+        pasted.app.config['CONTENT_COMPRESSION'] = 'gzip'
+        compressed = 'compressed line\n' * 1000
+        first = self.create_paste('first')
+        second = self.create_paste(compressed)
+        remote = hashlib.sha1(b'remote').hexdigest()
+        self.fake.objects[('pasted', remote)] = {
+            'data': b'remote',
+            'headers': {},
+            'etag': 'etag'
+        }
+        missing = hashlib.sha1(b'missing').hexdigest()
+        parts = self.read_multi(
+            [remote, first, missing, second, first]
+        )
+        self.assertEqual(parts, [
+            (remote, 200, b'remote'),
+            (first, 200, b'first'),
+            (missing, 404, b''),
+            (second, 200, compressed.encode('utf-8')),
+            (first, 200, b'first'),
+        ])
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 2)
+
+    def test_read_pastes_multi_unavailable(self):
+        first = self.create_paste('first')
+        remote = hashlib.sha1(b'remote').hexdigest()
+        self.fake.objects[('pasted', remote)] = {
+            'data': b'remote',
+            'headers': {},
+            'etag': 'etag'
+        }
+        self.fake.fail['GET'] = 1000
+        parts = self.read_multi([first, remote])
+        self.assertEqual(parts, [(first, 200, b'first'), (remote, 503, b'')])
+
+    def test_read_pastes_multi_invalid(self):
+        r = self.app.post('/api/pastes/multi', json={'ids': 'abc'})
+        self.assertEqual(r.status_code, 400)
+
+    def test_read_pastes_multi_invalid_ids(self):
+        first = self.create_paste('first')
+        parts = self.read_multi([
+            first,
+            '\u20ac',
+            'abc\n',
+            'x>\r\nX-Pasted-Status: 200\r\n\r\ninjected'
+        ])
+        self.assertEqual(parts, [
+            (first, 200, b'first'),
+            ('', 404, b''),
+            ('', 404, b''),
+            ('', 404, b''),
+        ])
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+
+    def test_index_does_not_block_on_cdn(self):
+        self.fake.fail['HEAD'] = 1000
+        r = self.app.get('/')
+        self.assertEqual(r.status_code, 200)
+
+    def test_raw_etag(self):
+        key = self.create_paste('content')
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['ETag'], '"%s"' % key)
+        self.assertIn('immutable', r.headers['Cache-Control'])
+
+    def test_raw_not_modified_without_backend_read(self):
+        key = hashlib.sha1(b'never written').hexdigest()
+        r = self.app.get(
+            '/pastes/%s.raw' % key,
+            headers={'If-None-Match': '"%s"' % key}
+        )
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+
+    def test_page_not_modified(self):
+        key = self.create_paste('content')
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+        etag = r.headers['ETag']
+        r = self.app.get('/pastes/%s' % key, headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+
+    def test_page_cached(self):
+        key = self.create_paste('cached page')
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+
+        # repeat views neither read the content nor render the page
+        memory.CONTENT.clear()
+        with backend.LocalCache() as c:
+            c.clear()
+        self.fake.fail['GET'] = 1000
+        cached = self.app.get('/pastes/%s' % key)
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.data, r.data)
+        self.assertEqual(cached.headers['ETag'], r.headers['ETag'])
+        self.assertEqual(
+            cached.headers['Cache-Control'],
+            r.headers['Cache-Control']
+        )
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+
+    def test_page_cache_templates_version(self):
+        key = self.create_paste('versioned page')
+        self.app.get('/links/%s' % key)
+        self.assertEqual(len(memory.PAGES), 1)
+        with mock.patch.object(
+            views,
+            '_templates_version',
+            return_value='redeployed'
+        ):
+            r = self.app.get('/links/%s' % key)
+        self.assertEqual(r.headers['ETag'], '"%s-redeployed"' % key)
+        self.assertEqual(len(memory.PAGES), 2)
+
+    def test_page_with_flashes_not_cached(self):
+        key = self.create_paste('flashed page')
+        with self.app.session_transaction() as flask_session:
+            flask_session['_flashes'] = [('message', 'hello')]
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn('ETag', r.headers)
+        self.assertEqual(len(memory.PAGES), 0)
+
+    def test_stale_etag(self):
+        key = self.create_paste('content')
+        r = self.app.get(
+            '/pastes/%s.raw' % key,
+            headers={'If-None-Match': '"other"'}
+        )
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, b'content')
+
+    def test_wildcard_if_none_match(self):
+        missing = '0' * 40
+        for path in ('/pastes/%s.raw', '/pastes/%s'):
+            r = self.app.get(path % missing, headers={'If-None-Match': '*'})
+            self.assertEqual(r.status_code, 404)
+        key = self.create_paste('content')
+        r = self.app.get(
+            '/pastes/%s.raw' % key,
+            headers={'If-None-Match': '*'}
+        )
+        # the content exists, the response answers the wildcard
+        self.assertEqual(r.status_code, 304)
+
+    def test_raw_range(self):
+        key = self.create_paste('0123456789')
+        r = self.app.get('/pastes/%s.raw' % key, headers={'Range': 'bytes=-4'})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.data, b'6789')
+        self.assertEqual(r.headers['Content-Range'], 'bytes 6-9/10')
+
+    def test_raw_streamed_from_cdn(self):
+        content = b'x' * (256 * 1024)
+        key = hashlib.sha1(content).hexdigest()
+        self.fake.objects[('pasted', key)] = {
+            'data': content,
+            'headers': {},
+            'etag': 'etag'
+        }
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.is_streamed)
+        self.assertEqual(r.data, content)
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.data, content)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 1)
+
+    def test_raw_compressed(self):
+        pasted.app.config['CONTENT_COMPRESSION'] = 'gzip'
+        content = 'line of a log file\n' * 1000
+        key = self.create_paste(content)
+        stored = self.fake.objects[('pasted', key)]
+        self.assertEqual(stored['headers']['Content-Encoding'], 'gzip')
+        self.assertLess(len(stored['data']), len(content))
+
+        r = self.app.get(
+            '/pastes/%s.raw' % key,
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(r.headers['ETag'], '"%s-gzip"' % key)
+        self.assertEqual(r.data, stored['data'])
+
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertNotIn('Content-Encoding', r.headers)
+        self.assertEqual(r.data, content.encode('utf-8'))
+
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+
+    def test_raw_compressed_from_cdn(self):
+        pasted.app.config['CONTENT_COMPRESSION'] = 'gzip'
+        content = 'line of a log file\n' * 1000
+        key = self.create_paste(content)
+        backend.CACHE_MANAGER.close()
+        shutil.rmtree(self.paste_dir)
+        memory.CONTENT.clear()
+        r = self.app.get(
+            '/pastes/%s.raw' % key,
+            headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-3'}
+        )
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.data, b'line')
+
+    def test_raw_chunked(self):
+        pasted.app.config['CHUNKING'] = True
+        pasted.app.config['CHUNKING_MIN_SIZE'] = 4096
+        pasted.app.config['CHUNK_SIZE'] = 1024
+        content = ''.join('log line %d\n' % i for i in range(2000))
+        key = self.create_paste(content)
+        memory.CONTENT.clear()
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.data, content.encode('utf-8'))
+        self.assertEqual(r.headers['ETag'], '"%s"' % key)
+        r = self.app.get(
+            '/pastes/%s.raw' % key,
+            headers={'Range': 'bytes=5000-5009'}
+        )
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.data, content.encode('utf-8')[5000:5010])
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('log line 1999', r.get_data(as_text=True))
+
+    def test_raw_missing(self):
+        r = self.app.get('/pastes/%s.raw' % ('0' * 40))
+        self.assertEqual(r.status_code, 404)
+
+    def test_raw_key_with_trailing_newline(self):
+        r = self.app.get('/pastes/abc%0A.raw')
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(self.fake.requests[('cdn', 'GET')], 0)
+
+
+class LocalProviderViewsTestCase(tests.LocalProviderTestCase):
+    def test_paste_round_trip(self):
+        r = self.app.post('/api/pastes', json={'content': 'content'})
+        self.assertEqual(r.status_code, 201)
+        key = hashlib.sha1(b'content').hexdigest()
+        memory.CONTENT.clear()
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.data, b'content')
+        r = self.app.get('/pastes/%s' % key)
+        self.assertEqual(r.status_code, 200)
+        r = self.app.get('/pastes/%s.raw' % ('0' * 40))
+        self.assertEqual(r.status_code, 404)
+
+    def test_paste_written_by_another_worker(self):
+        key = hashlib.sha1(b'content').hexdigest()
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.status_code, 404)
+        # the other worker writes the provider file, not this memory tier
+        cdn.upload(key=key, content=b'content')
+        r = self.app.get('/pastes/%s.raw' % key)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, b'content')
+
+
+if __name__ == '__main__':
+    unittest.main()